@@ -0,0 +1,29 @@
+"""drop_redundant_token_consumption_indexes
+
+Revision ID: 0c65713d83cf
+Revises: d8feb2903609
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0c65713d83cf'
+down_revision = 'd8feb2903609'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # ix_token_consumption_id duplicates the primary key, and idx_user_org is a prefix of
+    # idx_user_org_consumed_covering (which also backs the user_id foreign key). Dropping
+    # them saves a B-tree write per insert and keeps them out of the buffer pool.
+    op.drop_index('ix_token_consumption_id', table_name='token_consumption')
+    op.drop_index('idx_user_org', table_name='token_consumption')
+
+
+def downgrade() -> None:
+    op.create_index('idx_user_org', 'token_consumption', ['user_id', 'organization_id'], unique=False)
+    op.create_index('ix_token_consumption_id', 'token_consumption', ['id'], unique=False)
@@ -0,0 +1,33 @@
+"""add_covering_index_to_token_consumption
+
+Revision ID: d8feb2903609
+Revises: 5376fd52db07
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8feb2903609'
+down_revision = '5376fd52db07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Covering index for consumption stats, history and chart queries: they filter on
+    # (user_id, organization_id, consumed_at) and only read the trailing columns, so
+    # MySQL can answer them from the index without reading table rows
+    op.create_index(
+        'idx_user_org_consumed_covering',
+        'token_consumption',
+        ['user_id', 'organization_id', 'consumed_at', 'model_name', 'provider',
+         'total_tokens', 'cost_rub', 'price_rub'],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_user_org_consumed_covering', table_name='token_consumption')
@@ -97,7 +97,7 @@ async def get_all_pricing(
             is_visible=bool(row.is_visible),
             created_at=row.created_at.isoformat() if row.created_at else None,
             updated_at=row.updated_at.isoformat() if row.updated_at else None,
-            display_name=row.display_name if hasattr(row, 'display_name') else None,
+            display_name=row.display_name,
         ))
     
     return pricing_list
@@ -650,8 +650,8 @@ async def test_step(
                 market_data = pipeline._convert_tool_result_to_market_data(tool_result, request.instrument, request.timeframe)
             else:
                 # Fallback to DataService (backward compatibility)
-                from app.services.data.adapters import DataService
-                data_service = DataService(db=db)
+                from app.services.data.adapters import get_data_service
+                data_service = get_data_service(db)
                 market_data = data_service.fetch_market_data(
                     instrument=request.instrument,
                     timeframe=request.timeframe,
@@ -783,8 +783,8 @@ async def test_pipeline(
                 market_data = pipeline._convert_tool_result_to_market_data(tool_result, request.instrument, request.timeframe)
             else:
                 # Fallback to DataService (backward compatibility)
-                from app.services.data.adapters import DataService
-                data_service = DataService(db=db)
+                from app.services.data.adapters import get_data_service
+                data_service = get_data_service(db)
                 market_data = data_service.fetch_market_data(
                     instrument=request.instrument,
                     timeframe=request.timeframe,
@@ -20,6 +20,10 @@ from app.services.consumption import (
 
 router = APIRouter()
 
+# Endpoints here are plain (sync) functions: they only run blocking DB queries, so
+# FastAPI runs them in its threadpool and concurrent requests don't queue on the
+# event loop.
+
 
 # Response Models
 class ConsumptionStatsByModel(BaseModel):
@@ -83,7 +87,7 @@ class ChartDataResponse(BaseModel):
 
 
 @router.get("/stats", response_model=ConsumptionStatsResponse)
-async def get_consumption_stats_endpoint(
+def get_consumption_stats_endpoint(
     start_date: Optional[datetime] = Query(None, description="Start date filter (ISO format)"),
     end_date: Optional[datetime] = Query(None, description="End date filter (ISO format)"),
     db: Session = Depends(get_db),
@@ -109,17 +113,6 @@ async def get_consumption_stats_endpoint(
         end_date=adjusted_end_date,
     )
     
-    # Convert by_model and by_provider to response format
-    by_model = {
-        model_name: ConsumptionStatsByModel(**data)
-        for model_name, data in stats.by_model.items()
-    }
-    
-    by_provider = {
-        provider: ConsumptionStatsByProvider(**data)
-        for provider, data in stats.by_provider.items()
-    }
-    
     return ConsumptionStatsResponse(
         total_tokens=stats.total_tokens,
         total_cost_rub=stats.total_cost_rub,
@@ -127,13 +120,14 @@ async def get_consumption_stats_endpoint(
         consumption_count=stats.consumption_count,
         period_start=stats.period_start,
         period_end=stats.period_end,
-        by_model=by_model,
-        by_provider=by_provider,
+        # Plain dicts are validated into ConsumptionStatsByModel/ByProvider by the model itself
+        by_model=stats.by_model,
+        by_provider=stats.by_provider,
     )
 
 
 @router.get("/history", response_model=ConsumptionHistoryResponse)
-async def get_consumption_history_endpoint(
+def get_consumption_history_endpoint(
     start_date: Optional[datetime] = Query(None, description="Start date filter (ISO format)"),
     end_date: Optional[datetime] = Query(None, description="End date filter (ISO format)"),
     model_name: Optional[str] = Query(None, description="Filter by model name"),
@@ -227,7 +221,7 @@ async def get_consumption_history_endpoint(
 
 
 @router.get("/chart", response_model=ChartDataResponse)
-async def get_consumption_chart_data_endpoint(
+def get_consumption_chart_data_endpoint(
     start_date: datetime = Query(..., description="Start date (ISO format)"),
     end_date: datetime = Query(..., description="End date (ISO format)"),
     group_by: str = Query("day", regex="^(day|week|month)$", description="Grouping: day, week, or month"),
@@ -267,7 +261,7 @@ async def get_consumption_chart_data_endpoint(
 
 
 @router.get("/stats/user/{user_id}", response_model=ConsumptionStatsResponse)
-async def get_user_consumption_stats_admin(
+def get_user_consumption_stats_admin(
     user_id: int,
     start_date: Optional[datetime] = Query(None, description="Start date filter (ISO format)"),
     end_date: Optional[datetime] = Query(None, description="End date filter (ISO format)"),
@@ -292,17 +286,6 @@ async def get_user_consumption_stats_admin(
         end_date=end_date,
     )
     
-    # Convert to response format
-    by_model = {
-        model_name: ConsumptionStatsByModel(**data)
-        for model_name, data in stats.by_model.items()
-    }
-    
-    by_provider = {
-        provider: ConsumptionStatsByProvider(**data)
-        for provider, data in stats.by_provider.items()
-    }
-    
     return ConsumptionStatsResponse(
         total_tokens=stats.total_tokens,
         total_cost_rub=stats.total_cost_rub,
@@ -310,7 +293,7 @@ async def get_user_consumption_stats_admin(
         consumption_count=stats.consumption_count,
         period_start=stats.period_start,
         period_end=stats.period_end,
-        by_model=by_model,
-        by_provider=by_provider,
+        by_model=stats.by_model,
+        by_provider=stats.by_provider,
     )
 
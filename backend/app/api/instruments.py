@@ -513,6 +513,9 @@ async def toggle_instrument(request: ToggleInstrumentRequest, db: Session = Depe
         instrument.is_enabled = not instrument.is_enabled
     
     db.commit()
+    # A new row may move the symbol to another adapter (e.g. MOEX)
+    from app.services.data.adapters import invalidate_adapter_routes
+    invalidate_adapter_routes(instrument.symbol)
     db.refresh(instrument)
     
     return InstrumentWithStatusResponse(
@@ -13,7 +13,7 @@ from app.models.organization import Organization, OrganizationMember
 from app.models.organization_invitation import OrganizationInvitation
 from app.core.auth import get_current_user_dependency, verify_session, create_session
 from app.services.organization import get_user_organizations, get_user_personal_organization, create_personal_organization
-from app.services.feature import sync_organization_features_from_owner, FEATURES, set_user_feature
+from app.services.feature import sync_organization_features_from_owner, FEATURES, set_user_feature, invalidate_organization_features
 from app.api.auth import hash_password
 import re
 
@@ -850,6 +850,8 @@ async def transfer_ownership(
     organization.owner_id = request.new_owner_user_id
     db.commit()
     db.refresh(organization)
+    # Organization features follow the owner
+    invalidate_organization_features(organization_id)
     
     return {
         "success": True,
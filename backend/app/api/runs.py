@@ -14,7 +14,7 @@ from app.models.instrument import Instrument
 from app.models.organization import Organization
 from app.models.settings import AppSettings
 from app.models.user import User
-from app.services.data.adapters import DataService
+from app.services.data.adapters import get_data_service, invalidate_adapter_routes
 from app.services.analysis.pipeline import AnalysisPipeline
 from app.services.telegram.publisher import publish_to_telegram
 from app.models.telegram_post import TelegramPost, PostStatus
@@ -145,7 +145,7 @@ async def create_run(
                 raise HTTPException(status_code=400, detail=f"Tool validation failed: {str(e)}")
         else:
             # Fetch market data using DataService (backward compatibility)
-            data_service = DataService(db=db)
+            data_service = get_data_service(db)
             try:
                 market_data = data_service.fetch_market_data(
                     instrument=request.instrument,
@@ -187,6 +187,7 @@ async def create_run(
             )
             db.add(instrument)
             db.commit()
+            invalidate_adapter_routes(instrument.symbol)
             db.refresh(instrument)
     else:
         # Use dummy 'N/A' instrument for pipelines that don't need market data
@@ -68,3 +68,6 @@ DEFAULT_VISION_MODEL = "openai/gpt-4o"  # Vision model for OCR
 # Subscription & Pricing Configuration
 EXCHANGE_RATE_USD_TO_RUB = 90.0  # Exchange rate USD to RUB (manually updated)
 
+# In-process cache for token balance reads (quota checks), in seconds. 0 disables it.
+# Writes from other worker processes are only seen once an entry expires, so keep it short (2-5s).
+BALANCE_CACHE_TTL_SECONDS = 0
@@ -74,6 +74,13 @@ except ImportError:
     EXCHANGE_RATE_USD_TO_RUB: float = 90.0  # Exchange rate USD to RUB (manually updated)
 
 
+# Optional settings added after the initial config; older config_local files may not define them
+try:
+    from app.config_local import BALANCE_CACHE_TTL_SECONDS
+except ImportError:
+    BALANCE_CACHE_TTL_SECONDS: float = 0  # In-process token balance cache TTL (0 = disabled)
+
+
 def get_settings():
     """Return settings object (for FastAPI dependency injection if needed)."""
     return type("Settings", (), {
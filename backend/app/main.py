@@ -7,6 +7,7 @@ from app.api import health, runs, auth, instruments, analyses, settings, user_se
 from app.api.admin import router as admin_router, subscriptions as admin_subscriptions, pricing as admin_pricing, provider_credentials as admin_provider_credentials
 from app.core.config import get_settings
 from app.core.database import SessionLocal
+from app.services.feature import feature_cache_scope
 from app.services.telegram.bot_handler import start_bot_polling, stop_bot_polling
 
 app_settings = get_settings()
@@ -33,6 +34,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def feature_cache_middleware(request, call_next):
+    # Feature checks made while handling one request share their results
+    with feature_cache_scope():
+        return await call_next(request)
+
+
 # Include routers
 app.include_router(health.router, tags=["health"])
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
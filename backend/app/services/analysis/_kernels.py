@@ -0,0 +1,85 @@
+"""
+Numeric kernels for per-candle features used in analysis prompts.
+
+Kernels are compiled with numba when it is installed (optional, not in
+requirements.txt); otherwise the same functions fall back to vectorized NumPy.
+Compiled kernels are given explicit signatures so they are built (or loaded from
+the on-disk cache) at import time rather than on the first analysis request.
+"""
+from typing import Tuple
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _pa_features_numpy(
+    open_: np.ndarray, high: np.ndarray, low: np.ndarray, close: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Price action features for a run of candles.
+    
+    Args:
+        open_, high, low, close: float64 arrays of equal length (oldest first)
+    
+    Returns:
+        Tuple of (body, upper_wick, lower_wick, is_bullish) arrays
+    """
+    body = np.abs(close - open_)
+    upper_wick = high - np.maximum(open_, close)
+    lower_wick = np.minimum(open_, close) - low
+    is_bullish = close > open_
+    return body, upper_wick, lower_wick, is_bullish
+
+
+def _spread_numpy(high: np.ndarray, low: np.ndarray) -> np.ndarray:
+    """Candle range (high - low) for a run of candles."""
+    return high - low
+
+
+def _spread_loop(high, low):
+    """Loop form of _spread_numpy, compiled by numba."""
+    n = high.shape[0]
+    spread = np.empty(n, dtype=np.float64)
+    for i in range(n):
+        spread[i] = high[i] - low[i]
+    return spread
+
+
+def _pa_features_loop(open_, high, low, close):
+    """Single-pass loop form of _pa_features_numpy, compiled by numba."""
+    n = open_.shape[0]
+    body = np.empty(n, dtype=np.float64)
+    upper_wick = np.empty(n, dtype=np.float64)
+    lower_wick = np.empty(n, dtype=np.float64)
+    is_bullish = np.empty(n, dtype=np.bool_)
+    # One branchless pass: each candle's four values are derived together.
+    # np.maximum/np.minimum keep NaN propagation identical to the NumPy path.
+    for i in range(n):
+        o = open_[i]
+        c = close[i]
+        body[i] = abs(c - o)
+        upper_wick[i] = high[i] - np.maximum(o, c)
+        lower_wick[i] = np.minimum(o, c) - low[i]
+        is_bullish[i] = c > o
+    return body, upper_wick, lower_wick, is_bullish
+
+
+# Signatures for C-contiguous float64 columns as built by candles_to_arrays()
+_SPREAD_SIGNATURE = "float64[::1](float64[::1], float64[::1])"
+_PA_FEATURES_SIGNATURE = (
+    "Tuple((float64[::1], float64[::1], float64[::1], boolean[::1]))"
+    "(float64[::1], float64[::1], float64[::1], float64[::1])"
+)
+
+if njit is not None:
+    # cache=True stores the compiled kernel on disk so it is compiled once per
+    # deployment rather than once per worker process. fastmath is left off: it
+    # would let LLVM reorder NaN handling and change the rendered values.
+    compute_spread = njit(_SPREAD_SIGNATURE, cache=True)(_spread_loop)
+    compute_pa_features = njit(_PA_FEATURES_SIGNATURE, cache=True)(_pa_features_loop)
+else:
+    compute_spread = _spread_numpy
+    compute_pa_features = _pa_features_numpy
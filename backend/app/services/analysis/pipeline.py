@@ -7,11 +7,15 @@ from typing import Dict, Any, List, Optional, Tuple
 from sqlalchemy.orm import Session
 from app.models.analysis_run import AnalysisRun, RunStatus
 from app.models.analysis_step import AnalysisStep
-from app.services.data.adapters import DataService
+from app.services.data.adapters import get_data_service
 from app.services.data.normalized import MarketData, OHLCVCandle
 from app.services.llm.client import LLMClient
-from app.services.tools import ToolExecutor
+from app.services.pricing import get_model_pricing
+from app.services.consumption import insert_consumption_records
+from app.services.feature import feature_cache_scope
 from app.services.analysis.steps import (
+    format_user_prompt_template,
+    is_merge_template,
     BaseAnalyzer,
     WyckoffAnalyzer,
     SMCAnalyzer,
@@ -41,14 +45,11 @@ STEP_ANALYZER_MAP = {
 class GenericLLMAnalyzer(BaseAnalyzer):
     """Generic LLM analyzer for custom steps without specific analyzer classes."""
     
-    def get_system_prompt(self) -> str:
-        """Return default system prompt for generic steps."""
-        return "You are an expert analyst. Analyze the provided data and provide insights."
+    SYSTEM_PROMPT = "You are an expert analyst. Analyze the provided data and provide insights."
     
     def build_user_prompt(self, context: Dict[str, Any], step_config: Optional[Dict[str, Any]] = None) -> str:
         """Build user prompt from template in step_config."""
         if step_config and "user_prompt_template" in step_config:
-            from app.services.analysis.steps import format_user_prompt_template
             # Get db session from context if available (for tool execution)
             db = context.get("_db_session")
             return format_user_prompt_template(step_config["user_prompt_template"], context, step_config, db)
@@ -98,6 +99,11 @@ class AnalysisPipeline:
             # Log step config to debug tool_references
             logger.info(f"_build_steps_from_config: step_name={step_name}, step_config_keys={list(step_config.keys())}, has_tool_references={'tool_references' in step_config}, tool_references={step_config.get('tool_references')}")
             
+            # Classify merge steps once instead of re-scanning the template on every format
+            template = step_config.get("user_prompt_template")
+            if template and "is_merge" not in step_config:
+                step_config = {**step_config, "is_merge": is_merge_template(template)}
+            
             # Get analyzer class from map, or use generic analyzer
             analyzer_class = STEP_ANALYZER_MAP.get(step_name, GenericLLMAnalyzer)
             analyzer_instance = analyzer_class()
@@ -137,13 +143,13 @@ class AnalysisPipeline:
         # Build context section from previous step outputs
         context_sections = []
         previous_steps = context.get("previous_steps", {})
+        summarize = include_context_config.get("format", "full") == "summary"
         
         for step_name in included_step_names:
             if step_name in previous_steps:
                 step_output = previous_steps[step_name].get("output", "")
-                format_type = include_context_config.get("format", "full")
                 
-                if format_type == "summary" and len(step_output) > 200:
+                if summarize and len(step_output) > 200:
                     step_output = step_output[:200] + "..."
                 
                 context_sections.append(f"{step_name.upper()}:\n{step_output}")
@@ -227,7 +233,8 @@ class AnalysisPipeline:
         data = tool_result.get('data', {})
         candles_data = data.get('candles', [])
         
-        # Convert candles to OHLCVCandle objects
+        # Convert candles to OHLCVCandle objects. Fields are parsed and coerced here
+        # (tool results carry ISO timestamps), so candles skip pydantic validation
         candles = []
         for candle in candles_data:
             # Handle different candle formats
@@ -239,7 +246,7 @@ class AnalysisPipeline:
                 else:
                     timestamp = timestamp_str
                 
-                candles.append(OHLCVCandle(
+                candles.append(OHLCVCandle.model_construct(
                     timestamp=timestamp,
                     open=float(candle.get('open', 0)),
                     high=float(candle.get('high', 0)),
@@ -269,6 +276,7 @@ class AnalysisPipeline:
             fetched_at=fetched_at
         )
     
+    @feature_cache_scope()
     def run(
         self,
         run: AnalysisRun,
@@ -289,10 +297,9 @@ class AnalysisPipeline:
             if not self.llm_client:
                 self.llm_client = LLMClient(db=db)
             
-            # Initialize DataService with db session to read Tinkoff token from Settings
+            # Get the shared DataService (db session is used to read Tinkoff token from Settings)
             if not self.data_service:
-                from app.services.data.adapters import DataService
-                self.data_service = DataService(db=db)
+                self.data_service = get_data_service(db)
             
             # Update status to running
             run.status = RunStatus.RUNNING
@@ -333,6 +340,7 @@ class AnalysisPipeline:
                     organization_id = run.organization_id
                     
                     # Execute tool to fetch market data
+                    from app.services.tools import ToolExecutor
                     executor = ToolExecutor(
                         db=db, 
                         source_name=source_name,
@@ -378,6 +386,8 @@ class AnalysisPipeline:
                 "timeframe": run.timeframe,
                 "market_data": market_data,
                 "previous_steps": {},
+                # Output text per completed step, read directly by the merge step
+                "step_outputs": {},
             }
             
             total_cost = 0.0
@@ -403,6 +413,8 @@ class AnalysisPipeline:
                     # Add pipeline name for consumption tracking
                     if run.analysis_type:
                         enhanced_context["_source_name"] = run.analysis_type.display_name
+                    # Consumption is written together with the step record below
+                    enhanced_context["_defer_consumption"] = True
                     
                     # Run the step (sync call) with step configuration
                     step_result = analyzer.analyze(
@@ -422,7 +434,6 @@ class AnalysisPipeline:
                     
                     if model_name and input_tokens > 0:
                         try:
-                            from app.services.pricing import get_model_pricing
                             pricing = get_model_pricing(db, model_name, provider)
                             if pricing:
                                 cost_per_1k_input = float(pricing.cost_per_1k_input_usd)
@@ -445,35 +456,21 @@ class AnalysisPipeline:
                         cost_per_1k_output=cost_per_1k_output,
                         cost_est=step_result.get("cost_est", 0.0),
                     )
-                    db.add(step_record)
+                    pending_consumption = enhanced_context.get("_pending_consumption")
                     try:
-                        db.commit()
-                        db.refresh(step_record)
-                        
-                        # Update consumption record with step_id if available
-                        consumption_id = enhanced_context.get("_consumption_id")
-                        if consumption_id:
-                            from sqlalchemy import text
-                            db.execute(
-                                text("""
-                                    UPDATE token_consumption
-                                    SET step_id = :step_id
-                                    WHERE id = :consumption_id
-                                """),
-                                {"step_id": step_record.id, "consumption_id": consumption_id}
-                            )
-                            db.commit()
+                        self._save_step_record(db, step_record, pending_consumption)
                     except Exception as db_error:
                         # Handle database connection errors
                         error_str = str(db_error)
-                        if "Lost connection" in error_str or "OperationalError" in error_str or "PendingRollbackError" in error_str:
+                        # A rollback also discards the step's uncommitted token charge, so only
+                        # steps without one can simply be saved again
+                        retryable = "Lost connection" in error_str or "OperationalError" in error_str or "PendingRollbackError" in error_str
+                        if retryable and not pending_consumption:
                             logger.warning(f"Database connection error during step save, retrying: {error_str}")
                             db.rollback()
                             # Retry once
                             try:
-                                db.add(step_record)
-                                db.commit()
-                                db.refresh(step_record)
+                                self._save_step_record(db, step_record, pending_consumption)
                             except Exception as retry_error:
                                 logger.error(f"Failed to save step after retry: {retry_error}")
                                 db.rollback()
@@ -484,6 +481,11 @@ class AnalysisPipeline:
                     
                     # Update context with step result for next steps
                     context["previous_steps"][step_name] = step_result
+                    if "output" in step_result:
+                        context["step_outputs"][step_name] = step_result["output"]
+                    # Carry remaining-token figure forward so later steps can skip the pre-check
+                    if "_tokens_available" in enhanced_context:
+                        context["_tokens_available"] = enhanced_context["_tokens_available"]
                     total_cost += step_result.get("cost_est", 0.0)
                     
                     logger.info(
@@ -585,6 +587,32 @@ class AnalysisPipeline:
                 db.rollback()
             raise
     
+    @staticmethod
+    def _save_step_record(
+        db: Session,
+        step_record: AnalysisStep,
+        pending_consumption: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Commit a step record together with its token consumption record (if any).
+        
+        The step's token charge is still uncommitted in the session, so the charge, the
+        step and the consumption row land in one transaction. The step is flushed first
+        so the consumption row is inserted with its step_id. A failed consumption insert
+        is rolled back to a savepoint and logged, as consumption tracking never fails a
+        step.
+        """
+        db.add(step_record)
+        if pending_consumption:
+            db.flush()
+            pending_consumption["step_id"] = step_record.id
+            try:
+                with db.begin_nested():
+                    insert_consumption_records(db, [pending_consumption])
+            except Exception as e:
+                logger.error(f"Failed to record consumption for step {step_record.id}: {e}")
+        db.commit()
+        db.refresh(step_record)
+    
     def _extract_step_dependencies(self, template: str, all_steps: List[Tuple[str, BaseAnalyzer, Dict[str, Any]]]) -> List[int]:
         """Extract step indices that this step depends on based on variable references.
         
@@ -1,16 +1,265 @@
 """
 Base class and individual step analyzers for the Daystart analysis pipeline.
 """
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, tzinfo
+from functools import lru_cache
+from operator import attrgetter
+from typing import TYPE_CHECKING, Callable, ClassVar, Dict, Any, List, Optional, Tuple
 import re
+import string
 import logging
+from sqlalchemy import text
 from sqlalchemy.orm import Session
+from app.core.database import SessionLocal
+from app.services.balance import charge_tokens, get_available_tokens
+from app.services.consumption import build_consumption_record, record_consumption
 from app.services.llm.client import LLMClient
-from app.services.data.normalized import MarketData
-from app.services.tools import ToolExecutor
+from app.services.llm.cache import LLMResponseCache, llm_response_cache
+from app.services.analysis._kernels import compute_pa_features, compute_spread
+from app.services.data.normalized import MarketData, OHLCVCandle, candles_to_arrays
+from app.services.pricing import calculate_pricing
+
+if TYPE_CHECKING:
+    from app.models.user_tool import UserTool
 
 logger = logging.getLogger(__name__)
 
+# Matches {variable} placeholders in prompt templates
+_BRACE_VAR_RE = re.compile(r'\{([^}]+)\}')
+_LOWER_VAR_RE = re.compile(r'\{([a-z_]+)\}')
+
+# Upper bound on tool references executed concurrently for one step
+_MAX_PARALLEL_TOOLS = 8
+
+# Built-in step names whose outputs are always available as {step}_output
+_STANDARD_STEPS = ("wyckoff", "smc", "vsa", "delta", "ict", "price_action")
+_STANDARD_STEPS_SET = frozenset(_STANDARD_STEPS)
+
+# Variables every user prompt template can use
+_STANDARD_VARS = ("instrument", "timeframe", "market_data_summary") + tuple(
+    f"{step}_output" for step in _STANDARD_STEPS
+)
+
+# Placeholder for a step output that is missing from a prompt
+_NOT_AVAILABLE = "Не доступно"
+
+# Previous step outputs longer than this are shortened in non-merge prompts
+_OUTPUT_PREVIEW_CHARS = 100
+
+_FORMATTER = string.Formatter()
+
+# Hardcoded "last N candles" phrases in templates, rewritten to the configured num_candles
+_EN_CANDLES_RE = re.compile(r'last\s+\d+\s+candles?', re.IGNORECASE)
+_RU_CANDLES_RE = re.compile(r'последние\s+\d+\s+свеч(?:ей|и|а)?', re.IGNORECASE)
+
+# Russian plural suffix for "свеч-" indexed by the count's last digit
+# (1 -> свеча, 2-4 -> свечи, otherwise свечей); 11-14 always take "ей"
+_RU_CANDLES_SUFFIX = ("ей", "а", "и", "и", "и", "ей", "ей", "ей", "ей", "ей")
+
+
+def _en_candles_phrase(num_candles: int) -> str:
+    return f"last {num_candles} candle" if num_candles == 1 else f"last {num_candles} candles"
+
+
+def _ru_candles_phrase(num_candles: int) -> str:
+    suffix = "ей" if 11 <= num_candles % 100 <= 14 else _RU_CANDLES_SUFFIX[num_candles % 10]
+    return f"последние {num_candles} свеч{suffix}"
+
+
+@lru_cache(maxsize=512)
+def _parse_template(template: str) -> Optional[Tuple[Tuple[str, Optional[str]], ...]]:
+    """Split a template into (literal_text, field_name) chunks, memoized per template.
+    
+    Pipelines re-run the same step templates for every instrument/timeframe, so the
+    placeholder scan is done once per unique template. Returns None for templates
+    using format specs, conversions or attribute/index lookups - those are left to
+    str.format().
+    """
+    parts = []
+    for literal_text, field_name, format_spec, conversion in _FORMATTER.parse(template):
+        if field_name is not None and (format_spec or conversion or not field_name.isidentifier()):
+            return None
+        parts.append((literal_text, field_name))
+    return tuple(parts)
+
+
+def _render_template(template: str, format_dict: Dict[str, Any]) -> str:
+    """Equivalent of template.format_map(format_dict) using the cached template parse.
+    
+    Raises KeyError for unknown variables, same as str.format_map().
+    """
+    parts = _parse_template(template)
+    if parts is None:
+        # format_map reads format_dict directly instead of copying it into kwargs
+        return template.format_map(format_dict)
+    
+    chunks = []
+    for literal_text, field_name in parts:
+        if literal_text:
+            chunks.append(literal_text)
+        if field_name is not None:
+            value = format_dict[field_name]
+            chunks.append(value if type(value) is str else format(value, ""))
+    return "".join(chunks)
+
+
+def _prev_output(
+    previous_steps: Dict[str, Any], key: str, default: str = "N/A", limit: Optional[int] = None
+) -> Any:
+    """Output of a previous step (or default), optionally truncated to limit characters."""
+    result = previous_steps.get(key)
+    output = result.get("output", default) if result else default
+    return output[:limit] if limit is not None else output
+
+
+def _maybe_truncate(output: str, step_name: str, is_merge_step: bool) -> str:
+    """Shorten a previous step output for use as context in a non-merge prompt.
+    
+    Merge steps and fetch_market_data (which carries data that must be passed in
+    full) keep the whole output, as do outputs already within the preview length.
+    """
+    if is_merge_step or step_name == "fetch_market_data" or len(output) <= _OUTPUT_PREVIEW_CHARS:
+        return output
+    return output[:_OUTPUT_PREVIEW_CHARS] + "..."
+
+
+# Per-candle line renderers. Each takes the candles to show (oldest first) and
+# returns one "- <timestamp>: ...\n" line per candle; MarketData.formatted_tail()
+# caches their output so a candle is formatted once per renderer per run.
+
+@lru_cache(maxsize=8192)
+def _timestamp_label(timestamp: datetime, tz: Optional[tzinfo]) -> str:
+    # tz is part of the cache key: equal instants in different zones compare
+    # equal but have different wall-clock labels
+    return timestamp.isoformat(" ", "minutes")[:16]
+
+
+def _timestamp_labels(candles: List[OHLCVCandle]) -> List[str]:
+    """'%Y-%m-%d %H:%M' labels for candle timestamps.
+    
+    Labels are cached per timestamp, so candles shared by several steps (and by
+    repeated runs on the same instrument) are formatted once. isoformat() is used
+    instead of strftime(), which re-parses the format string on every call.
+    """
+    return [_timestamp_label(candle.timestamp, candle.timestamp.tzinfo) for candle in candles]
+
+
+# Precompiled line formatters for the renderers below (bound str.format methods).
+# map() calls them with one argument per column, so the per-candle loop runs in C
+# without building a row tuple per candle.
+_OHLCV_LINE = "- {}: O={:.2f} H={:.2f} L={:.2f} C={:.2f} V={:.2f}\n".format
+_OHLC_LINE = "- {}: O={:.2f} H={:.2f} L={:.2f} C={:.2f}\n".format
+_HLC_LINE = "- {}: H={:.2f} L={:.2f} C={:.2f}\n".format
+_VSA_LINE = "- {}: Spread={:.2f} Volume={:.2f} Close={:.2f}\n".format
+_DELTA_LINE = "- {}: {} Body={:.2f} Volume={:.2f}\n".format
+_PRICE_ACTION_LINE = "- {}: {} Body={:.2f} UpperWick={:.2f} LowerWick={:.2f} Close={:.2f}\n".format
+
+# Columns the NumPy-backed renderers need; volume/close are read per line instead
+_HL_FIELDS = ("high", "low")
+_OHLC_FIELDS = ("open", "high", "low", "close")
+
+_DELTA_DIRECTION = ("Bearish", "Bullish")
+_PRICE_ACTION_DIRECTION = ("🔴", "🟢")
+
+
+def _format_lines(line_format: Callable[..., str], *columns) -> List[str]:
+    """Apply line_format to each row of the given columns."""
+    return list(map(line_format, *columns))
+
+
+def _field(candles: List[OHLCVCandle], name: str):
+    return map(attrgetter(name), candles)
+
+
+def _render_ohlcv(candles: List[OHLCVCandle]) -> List[str]:
+    return _format_lines(
+        _OHLCV_LINE, _timestamp_labels(candles),
+        _field(candles, "open"), _field(candles, "high"), _field(candles, "low"),
+        _field(candles, "close"), _field(candles, "volume"),
+    )
+
+
+def _render_ohlc(candles: List[OHLCVCandle]) -> List[str]:
+    return _format_lines(
+        _OHLC_LINE, _timestamp_labels(candles),
+        _field(candles, "open"), _field(candles, "high"), _field(candles, "low"), _field(candles, "close"),
+    )
+
+
+def _render_hlc(candles: List[OHLCVCandle]) -> List[str]:
+    return _format_lines(
+        _HLC_LINE, _timestamp_labels(candles),
+        _field(candles, "high"), _field(candles, "low"), _field(candles, "close"),
+    )
+
+
+def _render_vsa(candles: List[OHLCVCandle]) -> List[str]:
+    columns = candles_to_arrays(candles, _HL_FIELDS)
+    spread = compute_spread(columns["high"], columns["low"]).tolist()
+    return _format_lines(
+        _VSA_LINE, _timestamp_labels(candles), spread, _field(candles, "volume"), _field(candles, "close"),
+    )
+
+
+def _render_delta(candles: List[OHLCVCandle]) -> List[str]:
+    columns = candles_to_arrays(candles, _OHLC_FIELDS)
+    body, _, _, is_bullish = compute_pa_features(columns["open"], columns["high"], columns["low"], columns["close"])
+    body, is_bullish = body.tolist(), is_bullish.tolist()
+    return _format_lines(
+        _DELTA_LINE, _timestamp_labels(candles), map(_DELTA_DIRECTION.__getitem__, is_bullish),
+        body, _field(candles, "volume"),
+    )
+
+
+def _render_price_action(candles: List[OHLCVCandle]) -> List[str]:
+    columns = candles_to_arrays(candles, _OHLC_FIELDS)
+    body, upper_wick, lower_wick, is_bullish = (
+        feature.tolist()
+        for feature in compute_pa_features(columns["open"], columns["high"], columns["low"], columns["close"])
+    )
+    return _format_lines(
+        _PRICE_ACTION_LINE, _timestamp_labels(candles), map(_PRICE_ACTION_DIRECTION.__getitem__, is_bullish),
+        body, upper_wick, lower_wick, _field(candles, "close"),
+    )
+
+
+def is_merge_template(template: str) -> bool:
+    """Whether a user prompt template belongs to a merge step (outputs are passed untruncated)."""
+    template_lower = template.lower()
+    return "объедини" in template_lower or "merge" in template_lower or "финальный пост" in template_lower
+
+
+def _format_prompt(template: str, num_candles: Optional[int], format_dict: Dict[str, Any]) -> str:
+    """Rewrite "last N candles" phrases and substitute template variables.
+    
+    Raises:
+        KeyError: If the template references a variable missing from format_dict
+    """
+    # Replace hardcoded "last X candles" text in template with actual num_candles value
+    # This handles cases where templates have hardcoded text like "last 20 candles"
+    if num_candles:
+        # Replace patterns like "last 20 candles", "last 50 candles", etc.
+        template = _EN_CANDLES_RE.sub(_en_candles_phrase(num_candles), template)
+        # Also handle Russian text patterns like "последние 20 свечей"
+        template = _RU_CANDLES_RE.sub(_ru_candles_phrase(num_candles), template)
+    
+    return _render_template(template, format_dict)
+
+
+def _template_num_candles(template: str, step_config: Optional[Dict[str, Any]]) -> int:
+    """Number of candles for a template step: step_config's num_candles, else a default by step type."""
+    if step_config and step_config.get("num_candles") is not None:
+        return step_config["num_candles"]
+    # Default based on step type (backward compatibility)
+    template_lower = template.lower()
+    if "wyckoff" in template_lower:
+        return 20
+    if "smc" in template_lower or "ict" in template_lower:
+        return 50
+    return 30
+
 
 def format_user_prompt_template(
     template: str, 
@@ -43,6 +292,7 @@ def format_user_prompt_template(
     has_tool_references_config = step_config and "tool_references" in step_config
     tool_references_list = step_config.get("tool_references", []) if has_tool_references_config else []
     
+    tool_values: Dict[str, str] = {}
     if has_tool_references_config and tool_references_list:
         if not db:
             logger.warning("tool_references found in step_config but db session not provided, skipping tool execution")
@@ -50,38 +300,29 @@ def format_user_prompt_template(
             for tool_ref in tool_references_list:
                 variable_name = tool_ref.get("variable_name")
                 if variable_name:
-                    template = template.replace(f"{{{variable_name}}}", f"[Tool {variable_name} execution skipped: db session not provided]")
+                    tool_values.setdefault(variable_name, f"[Tool {variable_name} execution skipped: db session not provided]")
         else:
-            template = _process_tool_references(template, step_config, context, db)
+            tool_values = _process_tool_references(template, step_config, context, db)
     elif has_tool_references_config and not tool_references_list:
         # tool_references exists but is empty - this shouldn't happen, but log it
-        potential_tool_refs = re.findall(r'\{([a-z_]+)\}', template.lower())
+        potential_tool_refs = _LOWER_VAR_RE.findall(template.lower())
         logger.warning(f"tool_references exists in step_config but is empty. Template contains potential tool references: {potential_tool_refs}")
     
-    # Get number of candles from step_config if available, otherwise use defaults based on step type
-    num_candles = None
-    if step_config and "num_candles" in step_config and step_config["num_candles"] is not None:
-        num_candles = step_config["num_candles"]
-    else:
-        # Default based on step type (backward compatibility)
-        num_candles = 30  # default
-        if "wyckoff" in template.lower():
-            num_candles = 20
-        elif "smc" in template.lower() or "ict" in template.lower():
-            num_candles = 50
+    num_candles = _template_num_candles(template, step_config)
     
     # Build market data summary
     market_data_summary = ""
     if market_data:
-        # Ensure candles are sorted by timestamp (oldest first) before taking last N
-        sorted_candles = sorted(market_data.candles, key=lambda c: c.timestamp)
-        candles_to_show = sorted_candles[-num_candles:] if len(sorted_candles) > num_candles else sorted_candles
-        for candle in candles_to_show:
-            market_data_summary += f"- {candle.timestamp.strftime('%Y-%m-%d %H:%M')}: O={candle.open:.2f} H={candle.high:.2f} L={candle.low:.2f} C={candle.close:.2f} V={candle.volume:.2f}\n"
+        # Last N candles (oldest first); lines are shared with other steps of the run
+        market_data_summary = "".join(market_data.formatted_tail(num_candles, _render_ohlcv))
     
     # Get previous step outputs
     # For merge step, use full outputs; for other steps, truncate for context
-    is_merge_step = "объедини" in template.lower() or "merge" in template.lower() or "финальный пост" in template.lower()
+    # The pipeline sets is_merge when it loads the config; other callers fall back to the heuristic
+    if step_config and "is_merge" in step_config:
+        is_merge_step = step_config["is_merge"]
+    else:
+        is_merge_step = is_merge_template(template)
     
     # Build format dict with standard variables
     format_dict = {
@@ -90,92 +331,48 @@ def format_user_prompt_template(
         "market_data_summary": market_data_summary,
     }
     
-    # Add all previous step outputs dynamically (supports custom step names)
-    # First add standard step outputs for backward compatibility
-    standard_steps = ["wyckoff", "smc", "vsa", "delta", "ict", "price_action"]
-    for step_name in standard_steps:
-        step_output = previous_steps.get(step_name, {}).get("output", "Не доступно")
-        if not is_merge_step and len(step_output) > 100:
-            step_output = step_output[:100] + "..."
-        format_dict[f"{step_name}_output"] = step_output
-    
-    # Add any other step outputs dynamically (for custom steps)
-    for step_name, step_result in previous_steps.items():
-        if step_name not in standard_steps:
-            step_output = step_result.get("output", "Не доступно")
-            # Don't truncate fetch_market_data output - it contains data that needs to be passed fully
-            # Also don't truncate for merge steps
-            if step_name != "fetch_market_data" and not is_merge_step and len(step_output) > 100:
-                step_output = step_output[:100] + "..."
-            format_dict[f"{step_name}_output"] = step_output
+    # Add all previous step outputs dynamically (supports custom step names).
+    # Standard step outputs are always present for backward compatibility.
+    for step_name in _STANDARD_STEPS_SET.union(previous_steps):
+        step_output = _prev_output(previous_steps, step_name, _NOT_AVAILABLE)
+        format_dict[f"{step_name}_output"] = _maybe_truncate(step_output, step_name, is_merge_step)
     
-    # Replace hardcoded "last X candles" text in template with actual num_candles value
-    # This handles cases where templates have hardcoded text like "last 20 candles"
-    if num_candles:
-        # Replace patterns like "last 20 candles", "last 50 candles", etc.
-        template = re.sub(
-            r'last\s+\d+\s+candles?',
-            f'last {num_candles} candle{"s" if num_candles != 1 else ""}',
-            template,
-            flags=re.IGNORECASE
-        )
-        # Also handle Russian text patterns like "последние 20 свечей"
-        template = re.sub(
-            r'последние\s+\d+\s+свеч(?:ей|и|а)?',
-            f'последние {num_candles} свеч{"ей" if num_candles > 4 else "и" if num_candles > 1 else "а"}',
-            template,
-            flags=re.IGNORECASE
-        )
+    # Tool results take precedence over standard variables of the same name
+    format_dict.update(tool_values)
     
     # Before formatting, check if there are any tool references that weren't replaced
     # This can happen if tool_references weren't processed or tool execution failed
-    # Extract all {variable} patterns from template
-    remaining_tool_refs = re.findall(r'\{([^}]+)\}', template)
+    # Extract all {variable} patterns from template; format_dict already holds every
+    # standard, step output and resolved tool variable
+    remaining_tool_refs = [var for var in _BRACE_VAR_RE.findall(template) if var not in format_dict]
     if remaining_tool_refs:
-        # Check if any of them look like tool references (not standard variables)
-        standard_vars = ['instrument', 'timeframe', 'market_data_summary'] + [f'{step}_output' for step in standard_steps]
-        for step_name in previous_steps.keys():
-            if step_name not in standard_steps:
-                standard_vars.append(f'{step_name}_output')
-        
         # If step_config has tool_references, add them to available vars for better error message
-        tool_var_names = []
-        if step_config and "tool_references" in step_config:
-            tool_var_names = [ref.get("variable_name") for ref in step_config.get("tool_references", []) if ref.get("variable_name")]
+        tool_var_names = [ref.get("variable_name") for ref in tool_references_list if ref.get("variable_name")]
         
         for var in remaining_tool_refs:
-            if var not in standard_vars and var not in tool_var_names:
+            if var not in tool_var_names:
                 # This might be a tool reference that wasn't processed
                 logger.warning(f"Found potential tool reference '{var}' in template that wasn't replaced. "
-                             f"Tool references: {tool_var_names}, Standard vars: {standard_vars[:5]}...")
+                             f"Tool references: {tool_var_names}, Standard vars: {list(_STANDARD_VARS[:5])}...")
     
-    # Format template with all variables
-    # Note: Tool results already have braces escaped, so they won't interfere with format()
+    # Format template with all variables (tool results are values, so their braces are never parsed)
     try:
-        formatted = template.format(**format_dict)
-        # Unescape braces in tool results (they were escaped to prevent format() errors)
-        # Replace {{ with { and }} with } but only in tool result sections
-        # Simple approach: unescape all double braces (this is safe since we control tool results)
-        formatted = formatted.replace('{{', '{').replace('}}', '}')
+        formatted = _format_prompt(template, num_candles, format_dict)
     except KeyError as e:
         # Provide helpful error message for invalid variables
         invalid_var = str(e).strip("'")
-        available_vars = ['instrument', 'timeframe', 'market_data_summary']
-        # Add standard step outputs
-        available_vars.extend([f'{step}_output' for step in standard_steps])
+        available_vars = set(_STANDARD_VARS)
         # Add any custom step outputs
-        for step_name in previous_steps.keys():
-            if step_name not in standard_steps:
-                available_vars.append(f'{step_name}_output')
+        available_vars.update(f'{step_name}_output' for step_name in previous_steps)
         
         # Add tool variable names if available
         if step_config and "tool_references" in step_config:
             tool_var_names = [ref.get("variable_name") for ref in step_config.get("tool_references", []) if ref.get("variable_name")]
-            available_vars.extend(tool_var_names)
+            available_vars.update(tool_var_names)
         
         error_msg = (
             f"Invalid variable '{invalid_var}' in prompt template. "
-            f"Available variables: {', '.join(sorted(set(available_vars)))}. "
+            f"Available variables: {', '.join(sorted(available_vars))}. "
         )
         
         # Check if it's a tool reference that wasn't processed
@@ -206,15 +403,51 @@ def format_user_prompt_template(
     return formatted
 
 
+def _execute_tool_in_own_session(
+    executor_kwargs: Dict[str, Any],
+    tool_id: int,
+    prompt_text: str,
+    variable_name: str,
+    step_context: Dict[str, Any],
+    model: Optional[str],
+    llm_client: Optional[LLMClient],
+) -> str:
+    """Run execute_tool_with_context on a worker thread.
+    
+    SQLAlchemy sessions are not thread-safe, so each worker gets its own session and
+    loads the tool into it by id rather than sharing the caller's ORM instance.
+    """
+    from app.models.user_tool import UserTool
+    from app.services.tools import ToolExecutor
+    
+    db = SessionLocal()
+    try:
+        tool = db.get(UserTool, tool_id)
+        if tool is None:
+            raise ValueError(f"Tool with id {tool_id} not found")
+        tool_executor = ToolExecutor(db=db, **executor_kwargs)
+        return tool_executor.execute_tool_with_context(
+            tool=tool,
+            prompt_text=prompt_text,
+            tool_variable_name=variable_name,
+            step_context=step_context,
+            model=model,
+            llm_client=llm_client,
+        )
+    finally:
+        db.close()
+
+
 def _process_tool_references(
     template: str,
     step_config: Dict[str, Any],
     context: Dict[str, Any],
     db: Session
-) -> str:
+) -> Dict[str, str]:
     """Process tool references in prompt template.
     
-    Executes tools referenced in step_config.tool_references and injects results into template.
+    Executes tools referenced in step_config.tool_references and returns their results
+    for substitution into the template.
     
     Args:
         template: Prompt template string
@@ -223,9 +456,12 @@ def _process_tool_references(
         db: Database session for loading tools
         
     Returns:
-        Template with tool references replaced by tool execution results
+        Mapping of tool variable name to the text that replaces its placeholder
     """
+    # Tool support pulls in the RAG and data adapter stacks, so it is only imported
+    # once a step actually references tools
     from app.models.user_tool import UserTool
+    from app.services.tools import ToolExecutor
     
     tool_references = step_config.get("tool_references", [])
     logger.info(f"Processing {len(tool_references)} tool reference(s)")
@@ -246,8 +482,9 @@ def _process_tool_references(
         "timeframe": context.get("timeframe", ""),
     }
     # Add previous step outputs to context
-    for step_name, step_result in context.get("previous_steps", {}).items():
-        step_context[f"{step_name}_output"] = step_result.get("output", "")
+    previous_steps = context.get("previous_steps", {})
+    for step_name in previous_steps:
+        step_context[f"{step_name}_output"] = _prev_output(previous_steps, step_name, "")
     
     # Get model from step_config for AI extraction (use same model as step)
     step_model = step_config.get("model")
@@ -255,12 +492,37 @@ def _process_tool_references(
     # Get LLM client for AI extraction (will be created in ToolExecutor if needed)
     llm_client = None
     if step_model:
-        from app.services.llm.client import LLMClient
         llm_client = LLMClient(db=db)
     else:
         logger.warning(f"No model found in step_config, AI extraction will use default model")
     
-    # Execute each tool reference sequentially
+    # Index placeholders once instead of scanning the template for every reference
+    present_vars = set(_BRACE_VAR_RE.findall(template))
+    
+    # Load all referenced tools in one query (ids may come from JSON as str or int)
+    tool_ids = {ref.get("tool_id") for ref in tool_references if ref.get("tool_id")}
+    tools_by_id = {}
+    if tool_ids:
+        tools_by_id = {
+            str(tool.id): tool
+            for tool in db.query(UserTool).filter(UserTool.id.in_(tool_ids)).all()
+        }
+    
+    # Text for each tool placeholder. It is substituted by the template render along
+    # with the standard variables, so results need no brace escaping.
+    tool_values: Dict[str, str] = {}
+    # The prompt as tools see it for parameter extraction, with earlier values filled in
+    prompt_text = template
+    
+    def resolve(variable_name: str, value: str) -> None:
+        nonlocal prompt_text
+        # The first reference to a variable wins
+        if variable_name not in tool_values:
+            tool_values[variable_name] = value
+            prompt_text = prompt_text.replace(f"{{{variable_name}}}", value)
+    
+    # Resolve references first; missing or inactive tools get their message right away
+    runnable = []  # (tool_id, variable_name, tool)
     for tool_ref in tool_references:
         tool_id = tool_ref.get("tool_id")
         variable_name = tool_ref.get("variable_name")
@@ -272,52 +534,115 @@ def _process_tool_references(
             logger.warning(f"Invalid tool reference config: {tool_ref}")
             continue
         
-        # Load tool from database
-        tool = db.query(UserTool).filter(UserTool.id == tool_id).first()
+        tool = tools_by_id.get(str(tool_id))
         if not tool:
             logger.warning(f"Tool with id {tool_id} not found")
-            template = template.replace(f"{{{variable_name}}}", f"[Tool {tool_id} not found]")
+            resolve(variable_name, f"[Tool {tool_id} not found]")
             continue
         
         # Check if tool is active
         if not tool.is_active:
             logger.warning(f"Tool {tool.display_name} (id: {tool_id}) is not active")
-            template = template.replace(f"{{{variable_name}}}", f"[Tool {tool.display_name} is not active]")
+            resolve(variable_name, f"[Tool {tool.display_name} is not active]")
             continue
         
+        if variable_name not in present_vars:
+            logger.error(f"Tool reference {{{variable_name}}} not found in template")
+        runnable.append((tool_id, variable_name, tool))
+    
+    # Tools are usually independent network calls (APIs, RAG, LLM extraction), so run
+    # them concurrently unless the step opts out to let later tools see earlier results
+    if step_config.get("tools_parallel", True) and len(runnable) > 1:
+        executor_kwargs = {"source_name": source_name, "user_id": user_id, "organization_id": organization_id}
+        with ThreadPoolExecutor(max_workers=min(_MAX_PARALLEL_TOOLS, len(runnable))) as pool:
+            futures = [
+                pool.submit(
+                    _execute_tool_in_own_session, executor_kwargs, tool.id, prompt_text,
+                    variable_name, step_context, step_model, llm_client,
+                )
+                for _, variable_name, tool in runnable
+            ]
+            for (tool_id, variable_name, tool), future in zip(runnable, futures):
+                try:
+                    value = future.result()
+                    logger.info(f"Executed tool {tool.display_name} (id: {tool_id}), variable: {variable_name}")
+                except Exception as e:
+                    logger.error(f"Tool execution failed for {tool.display_name} (id: {tool_id}): {e}", exc_info=True)
+                    value = f"[Tool {tool.display_name} execution failed: {str(e)}]"
+                tool_values.setdefault(variable_name, value)
+        return tool_values
+    
+    # Execute each tool reference sequentially
+    for tool_id, variable_name, tool in runnable:
         # Execute tool with context (AI-based extraction)
         try:
-            if f'{{{variable_name}}}' not in template:
-                logger.error(f"Tool reference {{{variable_name}}} not found in template")
             tool_result = tool_executor.execute_tool_with_context(
                 tool=tool,
-                prompt_text=template,
+                prompt_text=prompt_text,
                 tool_variable_name=variable_name,
                 step_context=step_context,
                 model=step_model,  # Use same model as step
                 llm_client=llm_client
             )
-            
-            # Replace tool reference with result
-            # Escape braces in tool_result to prevent format() errors
-            # We'll unescape them after format() is called
-            escaped_result = tool_result.replace('{', '{{').replace('}', '}}')
-            template = template.replace(f"{{{variable_name}}}", escaped_result)
+            resolve(variable_name, tool_result)
             logger.info(f"Executed tool {tool.display_name} (id: {tool_id}), variable: {variable_name}")
             
         except Exception as e:
             logger.error(f"Tool execution failed for {tool.display_name} (id: {tool_id}): {e}", exc_info=True)
-            template = template.replace(f"{{{variable_name}}}", f"[Tool {tool.display_name} execution failed: {str(e)}]")
+            resolve(variable_name, f"[Tool {tool.display_name} execution failed: {str(e)}]")
+    
+    return tool_values
+
+
+def _apply_included_context(user_prompt: str, context: Dict[str, Any]) -> str:
+    """Place the included previous-step context before or after the user prompt."""
+    included_context = context.get("_included_context")
+    if not included_context:
+        return user_prompt
     
-    return template
+    context_text = included_context.get("text", "")
+    if included_context.get("placement", "before") == "before":
+        return f"{context_text}\n\n{user_prompt}"
+    return f"{user_prompt}\n\n{context_text}"  # after
+
+
+@dataclass(frozen=True)
+class AnalyzerSpec:
+    """Prompt definition for a candle-based analyzer."""
+    system_prompt: str
+    header: str  # Template with {instrument}, {timeframe} and {last_candles} fields
+    render: Callable[[List[OHLCVCandle]], List[str]]  # One line per candle, e.g. _render_ohlcv
+    footer: str
+    default_num_candles: int
 
 
 class BaseAnalyzer:
-    """Base class for analysis steps."""
+    """Base class for analysis steps.
+    
+    Candle-based analyzers pass an AnalyzerSpec as a class keyword
+    (``class X(BaseAnalyzer, spec=...)``) and inherit build_user_prompt.
+    """
+    
+    SPEC: ClassVar[Optional[AnalyzerSpec]] = None
+    # Default system prompt; subclasses set it (or override get_system_prompt)
+    SYSTEM_PROMPT: ClassVar[Optional[str]] = None
+    # Candles shown when step_config has no num_candles
+    DEFAULT_NUM_CANDLES: ClassVar[int] = 50
+    # Cache for repeated identical LLM requests (None disables it)
+    RESPONSE_CACHE: ClassVar[Optional[LLMResponseCache]] = llm_response_cache
+    
+    def __init_subclass__(cls, spec: Optional[AnalyzerSpec] = None, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if spec is not None:
+            cls.SPEC = spec
+            cls.SYSTEM_PROMPT = spec.system_prompt
+            cls.DEFAULT_NUM_CANDLES = spec.default_num_candles
     
     def get_system_prompt(self) -> str:
         """Get the system prompt for this step."""
-        raise NotImplementedError
+        if self.SYSTEM_PROMPT is None:
+            raise NotImplementedError
+        return self.SYSTEM_PROMPT
     
     def build_user_prompt(self, context: Dict[str, Any], step_config: Optional[Dict[str, Any]] = None) -> str:
         """Build the user prompt from context.
@@ -326,7 +651,50 @@ class BaseAnalyzer:
             context: Context dictionary with market_data, instrument, timeframe, previous_steps
             step_config: Optional step configuration dict (may contain num_candles)
         """
-        raise NotImplementedError
+        if self.SPEC is None:
+            raise NotImplementedError
+        num_candles = self._num_candles(step_config)
+        return self._build_candle_block(
+            context, self.SPEC.header, num_candles, self.SPEC.render, self._build_footer(context)
+        )
+    
+    def _build_footer(self, context: Dict[str, Any]) -> str:
+        """Text that follows the candle lines in build_user_prompt."""
+        return self.SPEC.footer
+    
+    def _num_candles(self, step_config: Optional[Dict[str, Any]]) -> int:
+        """num_candles from step_config, or the class default."""
+        if step_config:
+            return step_config.get("num_candles", self.DEFAULT_NUM_CANDLES)
+        return self.DEFAULT_NUM_CANDLES
+    
+    @staticmethod
+    def _build_candle_block(
+        context: Dict[str, Any],
+        header_template: str,
+        num_candles: int,
+        render: Callable[[List[OHLCVCandle]], List[str]],
+        footer: str = "",
+    ) -> str:
+        """Build the prompt header, the last ``num_candles`` candle lines and the footer.
+        
+        Args:
+            context: Context dictionary with market_data, instrument, timeframe
+            header_template: Header with {instrument}, {timeframe} and {last_candles} fields
+            num_candles: Number of most recent candles to include
+            render: Block renderer producing one line per candle (e.g. _render_ohlcv)
+            footer: Text appended after the candle lines
+        
+        Returns:
+            The prompt, joined in a single pass so it is copied once
+        """
+        market_data: MarketData = context["market_data"]
+        header = header_template.format(
+            instrument=context["instrument"],
+            timeframe=context["timeframe"],
+            last_candles=_en_candles_phrase(num_candles),
+        )
+        return "".join([header, *market_data.formatted_tail(num_candles, render), footer])
     
     def analyze(
         self,
@@ -340,7 +708,7 @@ class BaseAnalyzer:
             context: Context dictionary with instrument, timeframe, market_data, previous_steps
             llm_client: LLM client instance
             step_config: Optional step configuration dict with model, temperature, max_tokens, 
-                        system_prompt, user_prompt_template
+                        system_prompt, user_prompt_template, cache_response
         
         Returns:
             Dict with 'input', 'output', 'model', 'tokens_used', 'cost_est'
@@ -361,17 +729,6 @@ class BaseAnalyzer:
             else:
                 user_prompt = self.build_user_prompt(context, step_config)
             
-            # Inject included context if present
-            included_context = context.get("_included_context")
-            if included_context:
-                context_text = included_context.get("text", "")
-                placement = included_context.get("placement", "before")
-                
-                if placement == "before":
-                    user_prompt = f"{context_text}\n\n{user_prompt}"
-                else:  # after
-                    user_prompt = f"{user_prompt}\n\n{context_text}"
-            
             model = step_config.get("model")
             temperature = step_config.get("temperature", 0.7)
             max_tokens = step_config.get("max_tokens")
@@ -380,61 +737,70 @@ class BaseAnalyzer:
             system_prompt = self.get_system_prompt()
             user_prompt = self.build_user_prompt(context, None)
             
-            # Inject included context if present (for backward compatibility)
-            included_context = context.get("_included_context")
-            if included_context:
-                context_text = included_context.get("text", "")
-                placement = included_context.get("placement", "before")
-                
-                if placement == "before":
-                    user_prompt = f"{context_text}\n\n{user_prompt}"
-                else:  # after
-                    user_prompt = f"{user_prompt}\n\n{context_text}"
-            
             model = None
             temperature = 0.7
             max_tokens = None
         
+        # Inject included context if present
+        user_prompt = _apply_included_context(user_prompt, context)
+        
         # Check token availability BEFORE making LLM call
         # We need to estimate tokens needed (rough estimate: 1 token ≈ 4 characters)
         db = context.get("_db_session")
         user_id = context.get("_user_id")
         organization_id = context.get("_organization_id")
         
+        # Identical deterministic requests (temperature 0, or steps that opt in with
+        # cache_response) from the same user reuse the previous answer instead of
+        # calling the provider again
+        response_cache = self.RESPONSE_CACHE
+        cache_key = None
+        cached_result = None
+        if response_cache is not None and (temperature == 0 or (step_config and step_config.get("cache_response"))):
+            cache_key = response_cache.make_key(
+                system_prompt, user_prompt, model, temperature, max_tokens,
+                organization_id=organization_id, user_id=user_id,
+            )
+            cached_result = response_cache.get(cache_key)
+        
         if db and user_id and organization_id:
             # Estimate tokens needed (rough: prompt length / 4, plus some buffer for response)
-            estimated_input_tokens = len(system_prompt + user_prompt) // 4
+            estimated_input_tokens = (len(system_prompt) + len(user_prompt)) // 4
             estimated_output_tokens = max_tokens if max_tokens else 1000  # Default estimate
             estimated_total = estimated_input_tokens + estimated_output_tokens
-            
-            from app.services.balance import get_token_balance
-            from app.services.subscription import get_active_subscription
-            
-            # Get available tokens
-            subscription = get_active_subscription(db, user_id, organization_id)
-            subscription_tokens_available = 0
-            if subscription:
-                subscription_tokens_available = subscription.tokens_allocated - subscription.tokens_used_this_period
-            
-            balance = get_token_balance(db, user_id, organization_id)
-            balance_tokens_available = balance.balance
-            
-            total_available = subscription_tokens_available + balance_tokens_available
-            
+
+            # Remaining tokens reported by the previous charge in this run (if any).
+            # charge_tokens() enforces the limit after the call anyway, so only hit
+            # the database when nothing is known yet or the user is running low.
+            total_available = context.get("_tokens_available")
+            if total_available is None or total_available < estimated_total:
+                total_available = get_available_tokens(db, user_id, organization_id)
+                context["_tokens_available"] = total_available
+
             # Block if insufficient tokens (with some buffer for estimation error)
             if total_available < estimated_total:
                 raise ValueError(
                     f"Недостаточно токенов. Доступно: {total_available}"
                 )
         
-        # Make LLM call with configuration
-        result = llm_client.call(
-            system_prompt=system_prompt,
-            user_prompt=user_prompt,
-            model=model,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
+        if cached_result is not None:
+            logger.info(f"llm_response_cache_hit: model={cached_result.get('model')}")
+            # Billing for a reused answer: the user is charged the cached token counts,
+            # as for the original call, since the cache is per user and the answer is
+            # worth the same to them. Nothing was paid to the provider, so the step's
+            # cost estimate and the consumption record's provider cost are zero.
+            result = {**cached_result, "cost_est": 0.0}
+        else:
+            # Make LLM call with configuration
+            result = llm_client.call(
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+            if cache_key is not None:
+                response_cache.set(cache_key, result)
         
         # Extract token information
         input_tokens = result.get("input_tokens", 0)
@@ -457,47 +823,62 @@ class BaseAnalyzer:
         
         if db and user_id and organization_id and total_tokens > 0:
             try:
-                from app.services.balance import charge_tokens
-                from app.services.consumption import record_consumption
-                from app.services.pricing import calculate_pricing, get_exchange_rate
                 
-                # Calculate pricing for logging/validation
-                pricing_calc = calculate_pricing(
-                    db, model or "unknown", provider, input_tokens, output_tokens
-                )
-                exchange_rate = get_exchange_rate()
-                
-                if pricing_calc:
-                    logger.info(
-                        f"[PRICING] Step execution pricing calculation:\n"
-                        f"  Model: {model} ({provider})\n"
-                        f"  Input tokens: {input_tokens}, Output tokens: {output_tokens}, Total: {total_tokens}\n"
-                        f"  Cost per 1k input: ${pricing_calc.cost_per_1k_input_usd:.6f} USD\n"
-                        f"  Cost per 1k output: ${pricing_calc.cost_per_1k_output_usd:.6f} USD\n"
-                        f"  Price per 1k: ${pricing_calc.price_per_1k_usd:.6f} USD\n"
-                        f"  Exchange rate: {exchange_rate} RUB/USD\n"
-                        f"  Our cost: ${pricing_calc.our_total_cost_usd:.6f} USD = ₽{pricing_calc.our_cost_rub:.2f} RUB\n"
-                        f"  User price: ${pricing_calc.user_price_usd:.6f} USD = ₽{pricing_calc.user_price_rub:.2f} RUB"
+                # Pricing is only computed for the log line, so skip it (and its
+                # DB lookup) entirely when INFO logging is disabled
+                if logger.isEnabledFor(logging.INFO):
+                    pricing_calc = calculate_pricing(
+                        db, model or "unknown", provider, input_tokens, output_tokens
                     )
+                    if pricing_calc:
+                        logger.info(
+                            "[PRICING] Step execution pricing calculation:\n"
+                            "  Model: %s (%s)\n"
+                            "  Input tokens: %s, Output tokens: %s, Total: %s\n"
+                            "  Cost per 1k input: $%.6f USD\n"
+                            "  Cost per 1k output: $%.6f USD\n"
+                            "  Price per 1k: $%.6f USD\n"
+                            "  Exchange rate: %s RUB/USD\n"
+                            "  Our cost: $%.6f USD = ₽%.2f RUB\n"
+                            "  User price: $%.6f USD = ₽%.2f RUB",
+                            model, provider,
+                            input_tokens, output_tokens, total_tokens,
+                            pricing_calc.cost_per_1k_input_usd,
+                            pricing_calc.cost_per_1k_output_usd,
+                            pricing_calc.price_per_1k_usd,
+                            pricing_calc.exchange_rate,
+                            pricing_calc.our_total_cost_usd, pricing_calc.our_cost_rub,
+                            pricing_calc.user_price_usd, pricing_calc.user_price_rub,
+                        )
                 
-                # Charge tokens (priority: subscription first, then balance)
+                # Charge tokens (priority: subscription first, then balance). The charge is
+                # committed together with the consumption record: below, or with the step
+                # record when the pipeline defers consumption to the step's transaction
+                defer_consumption = bool(context.get("_defer_consumption"))
                 charge_result = charge_tokens(
                     db=db,
                     user_id=user_id,
                     organization_id=organization_id,
                     amount=total_tokens,
-                    source_type="subscription"
+                    source_type="subscription",
+                    commit=False
                 )
                 
                 logger.info(
-                    f"[TOKEN_CHARGE] Charged {charge_result.tokens_charged} tokens from {charge_result.source}\n"
-                    f"  Remaining subscription tokens: {charge_result.remaining_subscription_tokens}\n"
-                    f"  Remaining balance: {charge_result.remaining_balance}"
+                    "[TOKEN_CHARGE] Charged %s tokens from %s\n"
+                    "  Remaining subscription tokens: %s\n"
+                    "  Remaining balance: %s",
+                    charge_result.tokens_charged, charge_result.source,
+                    charge_result.remaining_subscription_tokens,
+                    charge_result.remaining_balance,
                 )
                 
+                # Remember what is left so the next step can skip the balance pre-check
+                total_available = charge_result.remaining_subscription_tokens + charge_result.remaining_balance
+                context["_tokens_available"] = total_available
+
                 if not charge_result.success:
                     # Insufficient tokens - raise error
-                    total_available = charge_result.remaining_subscription_tokens + charge_result.remaining_balance
                     raise ValueError(
                         f"Недостаточно токенов. Доступно: {total_available}"
                     )
@@ -505,7 +886,6 @@ class BaseAnalyzer:
                 # Get pipeline name from context (for test steps) or from run_id (for saved runs)
                 source_name = context.get("_source_name")
                 if not source_name and run_id:
-                    from sqlalchemy import text
                     result = db.execute(
                         text("""
                             SELECT at.display_name
@@ -519,8 +899,7 @@ class BaseAnalyzer:
                     if row:
                         source_name = row[0]
                 
-                # Record consumption (will be updated with step_id after step is saved)
-                consumption_id = record_consumption(
+                consumption_kwargs = dict(
                     db=db,
                     user_id=user_id,
                     organization_id=organization_id,
@@ -529,23 +908,48 @@ class BaseAnalyzer:
                     input_tokens=input_tokens,
                     output_tokens=output_tokens,
                     run_id=run_id,
-                    step_id=None,  # Will be updated after step is saved
+                    step_id=None,  # Will be set once the step is saved
                     source_type=charge_result.source,
-                    source_name=source_name
-                )
-                
-                logger.info(
-                    f"[CONSUMPTION] Recorded consumption ID: {consumption_id}\n"
-                    f"  Tokens: {total_tokens} (input: {input_tokens}, output: {output_tokens})\n"
-                    f"  Source: {charge_result.source}\n"
-                    f"  Run ID: {run_id}, Step ID: {step_id}"
+                    source_name=source_name,
+                    served_from_cache=cached_result is not None
                 )
+                # A failure to record usage (e.g. no pricing for the model) must not
+                # discard the charge, so the consumption write gets a savepoint
+                consumption_id = None
+                try:
+                    if defer_consumption:
+                        # The pipeline inserts the record in the same transaction as the step,
+                        # with step_id already set
+                        context["_pending_consumption"] = build_consumption_record(**consumption_kwargs)
+                    else:
+                        # Record consumption (will be updated with step_id after step is saved)
+                        with db.begin_nested():
+                            consumption_id = record_consumption(**consumption_kwargs, commit=False)
+                    
+                    logger.info(
+                        "[CONSUMPTION] Recorded consumption ID: %s\n"
+                        "  Tokens: %s (input: %s, output: %s)\n"
+                        "  Source: %s\n"
+                        "  Run ID: %s, Step ID: %s",
+                        consumption_id if consumption_id is not None else "pending (saved with step)",
+                        total_tokens, input_tokens, output_tokens,
+                        charge_result.source,
+                        run_id, step_id,
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to record consumption, keeping the charge: {e}")
+                if not defer_consumption:
+                    db.commit()
                 
                 # Store consumption_id in context for later step_id update
                 context["_consumption_id"] = consumption_id
                 
             except Exception as e:
                 logger.error(f"Failed to charge tokens or record consumption: {e}")
+                # Never leave a partially applied charge (and the balance row locks it
+                # holds) pending in the shared session
+                db.rollback()
+                context.pop("_pending_consumption", None)
                 # Re-raise if it's an insufficient tokens error (check both English and Russian)
                 error_str = str(e)
                 if "Insufficient tokens" in error_str or "Недостаточно токенов" in error_str:
@@ -567,33 +971,16 @@ class BaseAnalyzer:
         }
 
 
-class WyckoffAnalyzer(BaseAnalyzer):
-    """Wyckoff analysis step."""
-    
-    def get_system_prompt(self) -> str:
-        return """You are an expert in Wyckoff Method analysis. Analyze market structure 
+_WYCKOFF_SYSTEM_PROMPT = """You are an expert in Wyckoff Method analysis. Analyze market structure 
         to identify accumulation, distribution, markup, and markdown phases. Provide clear, 
         actionable insights about market context and likely scenarios."""
-    
-    def build_user_prompt(self, context: Dict[str, Any], step_config: Optional[Dict[str, Any]] = None) -> str:
-        market_data: MarketData = context["market_data"]
-        instrument = context["instrument"]
-        timeframe = context["timeframe"]
-        
-        # Get number of candles from step_config if available, otherwise default to 20
-        num_candles = step_config.get("num_candles", 20) if step_config else 20
-        
-        # Build prompt with market data summary
-        # Ensure candles are sorted by timestamp (oldest first) before taking last N
-        sorted_candles = sorted(market_data.candles, key=lambda c: c.timestamp)
-        prompt = f"""Analyze {instrument} on {timeframe} timeframe using Wyckoff Method.
 
-Recent price action (last {num_candles} candle{"s" if num_candles != 1 else ""}):
+_WYCKOFF_USER_HEADER = """Analyze {instrument} on {timeframe} timeframe using Wyckoff Method.
+
+Recent price action ({last_candles}):
 """
-        for candle in sorted_candles[-num_candles:]:
-            prompt += f"- {candle.timestamp.strftime('%Y-%m-%d %H:%M')}: O={candle.open:.2f} H={candle.high:.2f} L={candle.low:.2f} C={candle.close:.2f} V={candle.volume:.2f}\n"
-        
-        prompt += """
+
+_WYCKOFF_USER_FOOTER = """
 Determine:
 1. Current Wyckoff phase (Accumulation/Distribution/Markup/Markdown)
 2. Market context and cycle position
@@ -601,36 +988,18 @@ Determine:
 4. Key levels to watch
 
 Provide analysis in structured format suitable for trading decisions."""
-        
-        return prompt
 
 
-class SMCAnalyzer(BaseAnalyzer):
-    """Smart Money Concepts analysis step."""
-    
-    def get_system_prompt(self) -> str:
-        return """You are an expert in Smart Money Concepts (SMC). Analyze market structure 
+_SMC_SYSTEM_PROMPT = """You are an expert in Smart Money Concepts (SMC). Analyze market structure 
         to identify BOS (Break of Structure), CHoCH (Change of Character), Order Blocks, 
         Fair Value Gaps (FVG), and Liquidity Pools. Identify key levels and liquidity events."""
-    
-    def build_user_prompt(self, context: Dict[str, Any], step_config: Optional[Dict[str, Any]] = None) -> str:
-        market_data: MarketData = context["market_data"]
-        instrument = context["instrument"]
-        timeframe = context["timeframe"]
-        
-        # Get number of candles from step_config if available, otherwise default to 50
-        num_candles = step_config.get("num_candles", 50) if step_config else 50
-        
-        # Ensure candles are sorted by timestamp (oldest first) before taking last N
-        sorted_candles = sorted(market_data.candles, key=lambda c: c.timestamp)
-        prompt = f"""Analyze {instrument} on {timeframe} using Smart Money Concepts.
 
-Price structure (last {num_candles} candle{"s" if num_candles != 1 else ""}):
+_SMC_USER_HEADER = """Analyze {instrument} on {timeframe} using Smart Money Concepts.
+
+Price structure ({last_candles}):
 """
-        for candle in sorted_candles[-num_candles:]:
-            prompt += f"- {candle.timestamp.strftime('%Y-%m-%d %H:%M')}: O={candle.open:.2f} H={candle.high:.2f} L={candle.low:.2f} C={candle.close:.2f}\n"
-        
-        prompt += """
+
+_SMC_USER_FOOTER = """
 Identify:
 1. BOS (Break of Structure) and CHoCH points
 2. Order Blocks (OB) - supply/demand zones
@@ -639,37 +1008,18 @@ Identify:
 5. Key levels for potential price returns
 
 Provide structured analysis with specific price levels."""
-        
-        return prompt
 
 
-class VSAAnalyzer(BaseAnalyzer):
-    """Volume Spread Analysis step."""
-    
-    def get_system_prompt(self) -> str:
-        return """You are an expert in Volume Spread Analysis (VSA). Analyze volume, spread, 
+_VSA_SYSTEM_PROMPT = """You are an expert in Volume Spread Analysis (VSA). Analyze volume, spread, 
         and price action to identify large participant activity. Look for signals like no demand, 
         no supply, stopping volume, climactic action, and effort vs result."""
-    
-    def build_user_prompt(self, context: Dict[str, Any], step_config: Optional[Dict[str, Any]] = None) -> str:
-        market_data: MarketData = context["market_data"]
-        instrument = context["instrument"]
-        timeframe = context["timeframe"]
-        
-        # Get number of candles from step_config if available, otherwise default to 30
-        num_candles = step_config.get("num_candles", 30) if step_config else 30
-        
-        # Ensure candles are sorted by timestamp (oldest first) before taking last N
-        sorted_candles = sorted(market_data.candles, key=lambda c: c.timestamp)
-        prompt = f"""Analyze {instrument} on {timeframe} using Volume Spread Analysis.
 
-OHLCV data (last {num_candles} candle{"s" if num_candles != 1 else ""}):
+_VSA_USER_HEADER = """Analyze {instrument} on {timeframe} using Volume Spread Analysis.
+
+OHLCV data ({last_candles}):
 """
-        for candle in sorted_candles[-num_candles:]:
-            spread = candle.high - candle.low
-            prompt += f"- {candle.timestamp.strftime('%Y-%m-%d %H:%M')}: Spread={spread:.2f} Volume={candle.volume:.2f} Close={candle.close:.2f}\n"
-        
-        prompt += """
+
+_VSA_USER_FOOTER = """
 Identify:
 1. Large participant activity (volume analysis)
 2. No demand / no supply signals
@@ -679,41 +1029,20 @@ Identify:
 6. Areas where effort without result suggests reversal
 
 Provide VSA signals and their implications."""
-        
-        return prompt
 
 
-class DeltaAnalyzer(BaseAnalyzer):
-    """Delta analysis step."""
-    
-    def get_system_prompt(self) -> str:
-        return """You are an expert in Delta analysis. Analyze buying vs selling pressure 
+_DELTA_SYSTEM_PROMPT = """You are an expert in Delta analysis. Analyze buying vs selling pressure 
         to identify dominance, anomalous delta, absorption, divergence, and where large 
         players are holding positions or absorbing aggression."""
-    
-    def build_user_prompt(self, context: Dict[str, Any], step_config: Optional[Dict[str, Any]] = None) -> str:
-        market_data: MarketData = context["market_data"]
-        instrument = context["instrument"]
-        timeframe = context["timeframe"]
-        
-        # Note: Real delta requires order flow data, but we'll analyze what we can from volume/price
-        # Get number of candles from step_config if available, otherwise default to 30
-        num_candles = step_config.get("num_candles", 30) if step_config else 30
-        
-        prompt = f"""Analyze {instrument} on {timeframe} using Delta analysis principles.
+
+_DELTA_USER_HEADER = """Analyze {instrument} on {timeframe} using Delta analysis principles.
 
 Note: Full delta requires order flow data. Analyze buying/selling pressure from volume and price action.
 
-Price and volume data (last {num_candles} candle{"s" if num_candles != 1 else ""}):
+Price and volume data ({last_candles}):
 """
-        # Ensure candles are sorted by timestamp (oldest first) before taking last N
-        sorted_candles = sorted(market_data.candles, key=lambda c: c.timestamp)
-        for candle in sorted_candles[-num_candles:]:
-            body = abs(candle.close - candle.open)
-            is_bullish = candle.close > candle.open
-            prompt += f"- {candle.timestamp.strftime('%Y-%m-%d %H:%M')}: {'Bullish' if is_bullish else 'Bearish'} Body={body:.2f} Volume={candle.volume:.2f}\n"
-        
-        prompt += """
+
+_DELTA_USER_FOOTER = """
 Identify:
 1. Buying vs selling dominance
 2. Anomalous delta patterns
@@ -722,41 +1051,21 @@ Identify:
 5. Where large players are holding or absorbing
 
 Provide delta-based insights."""
-        
-        return prompt
 
 
-class ICTAnalyzer(BaseAnalyzer):
-    """ICT (Inner Circle Trader) analysis step."""
-    
-    def get_system_prompt(self) -> str:
-        return """You are an expert in ICT (Inner Circle Trader) methodology. Analyze 
+_ICT_SYSTEM_PROMPT = """You are an expert in ICT (Inner Circle Trader) methodology. Analyze 
         liquidity manipulation, PD Arrays (Premium/Discount), Fair Value Gaps, and optimal 
         entry points after liquidity sweeps."""
-    
-    def build_user_prompt(self, context: Dict[str, Any], step_config: Optional[Dict[str, Any]] = None) -> str:
-        market_data: MarketData = context["market_data"]
-        instrument = context["instrument"]
-        timeframe = context["timeframe"]
-        wyckoff_result = context["previous_steps"].get("wyckoff", {})
-        smc_result = context["previous_steps"].get("smc", {})
-        
-        # Get number of candles from step_config if available, otherwise default to 50
-        num_candles = step_config.get("num_candles", 50) if step_config else 50
-        
-        # Ensure candles are sorted by timestamp (oldest first) before taking last N
-        sorted_candles = sorted(market_data.candles, key=lambda c: c.timestamp)
-        prompt = f"""Analyze {instrument} on {timeframe} using ICT methodology.
 
-Price action (last {num_candles} candle{"s" if num_candles != 1 else ""}):
+_ICT_USER_HEADER = """Analyze {instrument} on {timeframe} using ICT methodology.
+
+Price action ({last_candles}):
 """
-        for candle in sorted_candles[-num_candles:]:
-            prompt += f"- {candle.timestamp.strftime('%Y-%m-%d %H:%M')}: H={candle.high:.2f} L={candle.low:.2f} C={candle.close:.2f}\n"
-        
-        prompt += f"""
+
+_ICT_USER_FOOTER = """
 Previous analysis context:
-- Wyckoff phase: {wyckoff_result.get('output', 'N/A')[:100]}...
-- SMC structure: {smc_result.get('output', 'N/A')[:100]}...
+- Wyckoff phase: {wyckoff_summary}...
+- SMC structure: {smc_summary}...
 
 Identify:
 1. Liquidity manipulation (sweeps above highs/below lows)
@@ -766,41 +1075,19 @@ Identify:
 5. False breakouts and return scenarios
 
 Provide ICT-based entry strategy."""
-        
-        return prompt
 
 
-class PriceActionAnalyzer(BaseAnalyzer):
-    """Price Action and Pattern Analysis step."""
-    
-    def get_system_prompt(self) -> str:
-        return """You are an expert in Price Action and Pattern Analysis. Analyze candlestick patterns, 
+_PRICE_ACTION_SYSTEM_PROMPT = """You are an expert in Price Action and Pattern Analysis. Analyze candlestick patterns, 
         chart formations, and price movements to identify trading opportunities. Focus on patterns like 
         flags, triangles, head and shoulders, and candlestick formations. Provide specific entry, stop, 
         and target levels based on pattern completion."""
-    
-    def build_user_prompt(self, context: Dict[str, Any], step_config: Optional[Dict[str, Any]] = None) -> str:
-        market_data: MarketData = context["market_data"]
-        instrument = context["instrument"]
-        timeframe = context["timeframe"]
-        
-        # Get number of candles from step_config if available, otherwise default to 50
-        num_candles = step_config.get("num_candles", 50) if step_config else 50
-        
-        # Ensure candles are sorted by timestamp (oldest first) before taking last N
-        sorted_candles = sorted(market_data.candles, key=lambda c: c.timestamp)
-        prompt = f"""Analyze {instrument} on {timeframe} using Price Action and Pattern Analysis.
 
-Price action (last {num_candles} candle{"s" if num_candles != 1 else ""}):
+_PRICE_ACTION_USER_HEADER = """Analyze {instrument} on {timeframe} using Price Action and Pattern Analysis.
+
+Price action ({last_candles}):
 """
-        for candle in sorted_candles[-num_candles:]:
-            body = abs(candle.close - candle.open)
-            is_bullish = candle.close > candle.open
-            upper_wick = candle.high - max(candle.open, candle.close)
-            lower_wick = min(candle.open, candle.close) - candle.low
-            prompt += f"- {candle.timestamp.strftime('%Y-%m-%d %H:%M')}: {'🟢' if is_bullish else '🔴'} Body={body:.2f} UpperWick={upper_wick:.2f} LowerWick={lower_wick:.2f} Close={candle.close:.2f}\n"
-        
-        prompt += """
+
+_PRICE_ACTION_USER_FOOTER = """
 Identify:
 1. Chart patterns forming (flags, triangles, head and shoulders, double tops/bottoms, etc.)
 2. Candlestick patterns (doji, engulfing, pin bars, hammers, shooting stars)
@@ -810,46 +1097,103 @@ Identify:
 
 Provide specific price levels for entries, stops, and targets."""
 
-        return prompt
 
+# Candle-based analyzers: prompt text, per-candle renderer and default candle count
+ANALYZER_SPECS: Dict[str, AnalyzerSpec] = {
+    "wyckoff": AnalyzerSpec(
+        system_prompt=_WYCKOFF_SYSTEM_PROMPT,
+        header=_WYCKOFF_USER_HEADER,
+        render=_render_ohlcv,
+        footer=_WYCKOFF_USER_FOOTER,
+        default_num_candles=20,
+    ),
+    "smc": AnalyzerSpec(
+        system_prompt=_SMC_SYSTEM_PROMPT,
+        header=_SMC_USER_HEADER,
+        render=_render_ohlc,
+        footer=_SMC_USER_FOOTER,
+        default_num_candles=50,
+    ),
+    "vsa": AnalyzerSpec(
+        system_prompt=_VSA_SYSTEM_PROMPT,
+        header=_VSA_USER_HEADER,
+        render=_render_vsa,
+        footer=_VSA_USER_FOOTER,
+        default_num_candles=30,
+    ),
+    # Real delta requires order flow data; we analyze what we can from volume/price
+    "delta": AnalyzerSpec(
+        system_prompt=_DELTA_SYSTEM_PROMPT,
+        header=_DELTA_USER_HEADER,
+        render=_render_delta,
+        footer=_DELTA_USER_FOOTER,
+        default_num_candles=30,
+    ),
+    # Footer is filled with the Wyckoff/SMC summaries by ICTAnalyzer
+    "ict": AnalyzerSpec(
+        system_prompt=_ICT_SYSTEM_PROMPT,
+        header=_ICT_USER_HEADER,
+        render=_render_hlc,
+        footer=_ICT_USER_FOOTER,
+        default_num_candles=50,
+    ),
+    "price_action": AnalyzerSpec(
+        system_prompt=_PRICE_ACTION_SYSTEM_PROMPT,
+        header=_PRICE_ACTION_USER_HEADER,
+        render=_render_price_action,
+        footer=_PRICE_ACTION_USER_FOOTER,
+        default_num_candles=50,
+    ),
+}
+
+
+class WyckoffAnalyzer(BaseAnalyzer, spec=ANALYZER_SPECS["wyckoff"]):
+    """Wyckoff analysis step."""
 
-class MergeAnalyzer(BaseAnalyzer):
-    """Merge step - combines all analyses into final Telegram post."""
-    
-    def get_system_prompt(self) -> str:
-        return """You are a professional trading analyst. Combine multiple analysis methods 
-        into a cohesive, actionable Telegram post. Follow the exact format and style specified 
-        in the user prompt. Write in Russian as specified."""
+
+class SMCAnalyzer(BaseAnalyzer, spec=ANALYZER_SPECS["smc"]):
+    """Smart Money Concepts analysis step."""
+
+
+class VSAAnalyzer(BaseAnalyzer, spec=ANALYZER_SPECS["vsa"]):
+    """Volume Spread Analysis step."""
+
+
+class DeltaAnalyzer(BaseAnalyzer, spec=ANALYZER_SPECS["delta"]):
+    """Delta analysis step."""
+
+
+class ICTAnalyzer(BaseAnalyzer, spec=ANALYZER_SPECS["ict"]):
+    """ICT (Inner Circle Trader) analysis step."""
     
-    def build_user_prompt(self, context: Dict[str, Any], step_config: Optional[Dict[str, Any]] = None) -> str:
-        instrument = context["instrument"]
-        timeframe = context["timeframe"]
+    def _build_footer(self, context: Dict[str, Any]) -> str:
         previous_steps = context["previous_steps"]
-        # Merge step doesn't use candles, so step_config is not needed here
-        
-        # Build prompt with all previous step outputs
-        prompt = f"""Объедини результаты анализа {instrument} на таймфрейме {timeframe} в единый пост для Telegram.
+        return self.SPEC.footer.format(
+            wyckoff_summary=_prev_output(previous_steps, "wyckoff", limit=100),
+            smc_summary=_prev_output(previous_steps, "smc", limit=100),
+        )
 
-Результаты анализа по методам:
 
-1️⃣ WYCKOFF:
-{previous_steps.get('wyckoff', {}).get('output', 'Не доступно')}
+class PriceActionAnalyzer(BaseAnalyzer, spec=ANALYZER_SPECS["price_action"]):
+    """Price Action and Pattern Analysis step."""
 
-2️⃣ SMC (Smart Money Concepts):
-{previous_steps.get('smc', {}).get('output', 'Не доступно')}
 
-3️⃣ VSA (Volume Spread Analysis):
-{previous_steps.get('vsa', {}).get('output', 'Не доступно')}
+_MERGE_SYSTEM_PROMPT = """You are a professional trading analyst. Combine multiple analysis methods 
+        into a cohesive, actionable Telegram post. Follow the exact format and style specified 
+        in the user prompt. Write in Russian as specified."""
 
-4️⃣ DELTA:
-{previous_steps.get('delta', {}).get('output', 'Не доступно')}
+_MERGE_USER_INTRO = " в единый пост для Telegram.\n\nРезультаты анализа по методам:"
 
-5️⃣ ICT:
-{previous_steps.get('ict', {}).get('output', 'Не доступно')}
+# (step name, section title) for each analysis included in the merge prompt
+_MERGE_SECTIONS = (
+    ("wyckoff", "\n\n1️⃣ WYCKOFF:\n"),
+    ("smc", "\n\n2️⃣ SMC (Smart Money Concepts):\n"),
+    ("vsa", "\n\n3️⃣ VSA (Volume Spread Analysis):\n"),
+    ("delta", "\n\n4️⃣ DELTA:\n"),
+    ("ict", "\n\n5️⃣ ICT:\n"),
+)
 
----
-
-Теперь создай финальный пост в формате Telegram, следуя ТОЧНО этому шаблону:
+_MERGE_USER_INSTRUCTIONS = """Создай финальный пост в формате Telegram, следуя ТОЧНО этому шаблону:
 
 💬 ПРОМТ ДЛЯ АНАЛИЗА РЫНКА (в формате поста для TELEGRAM)
 
@@ -925,7 +1269,46 @@ class MergeAnalyzer(BaseAnalyzer):
  • Есть заголовок.
  • Всё списками, без таблиц, без воды.
 
-Создай финальный пост сейчас, используя результаты анализа выше."""
+---
+
+"""
+
+_MERGE_USER_OUTRO = "\n\nСоздай финальный пост сейчас, используя результаты анализа выше."
+
+
+# Whole merge user prompt with positional fields for instrument, timeframe and the
+# section outputs, joined once at import. The static text contains no braces.
+# The fixed instructions come first so that consecutive merge requests share a long
+# identical prefix, which providers with prompt caching bill at the cached rate.
+_MERGE_USER_TEMPLATE = "".join([
+    _MERGE_USER_INSTRUCTIONS,
+    "Объедини результаты анализа {} на таймфрейме {}",
+    _MERGE_USER_INTRO,
+    *(title + "{}" for _, title in _MERGE_SECTIONS),
+    _MERGE_USER_OUTRO,
+])
+
+
+class MergeAnalyzer(BaseAnalyzer):
+    """Merge step - combines all analyses into final Telegram post."""
+    
+    SYSTEM_PROMPT = _MERGE_SYSTEM_PROMPT
+    
+    def build_user_prompt(self, context: Dict[str, Any], step_config: Optional[Dict[str, Any]] = None) -> str:
+        instrument = context["instrument"]
+        timeframe = context["timeframe"]
+        previous_steps = context["previous_steps"]
+        # Merge step doesn't use candles, so step_config is not needed here
+        
+        # The pipeline run keeps a flat step_outputs dict; ad-hoc/test contexts only have previous_steps
+        step_outputs = context.get("step_outputs")
+        if step_outputs is not None:
+            outputs = [step_outputs.get(step_name, _NOT_AVAILABLE) for step_name, _ in _MERGE_SECTIONS]
+        else:
+            outputs = [_prev_output(previous_steps, step_name, _NOT_AVAILABLE) for step_name, _ in _MERGE_SECTIONS]
+        
+        # Build prompt with all previous step outputs
+        prompt = _MERGE_USER_TEMPLATE.format(instrument, timeframe, *outputs)
         
         return prompt
 
@@ -6,7 +6,7 @@ from datetime import datetime
 from typing import Optional
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class TokenBalance:
     """Token balance data class."""
     id: int
@@ -29,7 +29,7 @@ class TokenBalance:
         )
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class TokenChargeResult:
     """Result of token charging operation."""
     success: bool
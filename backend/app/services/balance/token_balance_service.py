@@ -6,17 +6,80 @@ Token Consumption Priority:
 2. Second: Use token balance (token_balances.balance)
 3. Third: Block request (no overages)
 """
-from typing import Optional
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import event, text
+from app.core.config import BALANCE_CACHE_TTL_SECONDS
 from app.services.balance.balance_models import TokenBalance, TokenChargeResult
-from app.services.subscription import get_active_subscription
+from app.services.subscription import get_active_subscription, invalidate_active_subscription
+
+
+# Short-lived per-process caches for the read paths, keyed by (user_id, organization_id).
+# Writes in this module invalidate their entry; other writers (other worker processes,
+# subscription changes) become visible when the entry expires.
+_CACHE_MAX_ENTRIES = 10000
+_balance_cache: Dict[Tuple[int, int], Tuple[float, TokenBalance]] = {}
+_available_cache: Dict[Tuple[int, int], Tuple[float, int]] = {}
+_cache_lock = threading.Lock()
+
+
+def _cache_get(cache: Dict[Tuple[int, int], Tuple[float, Any]], key: Tuple[int, int]) -> Optional[Any]:
+    if not BALANCE_CACHE_TTL_SECONDS:
+        return None
+    with _cache_lock:
+        entry = cache.get(key)
+    if entry is None or entry[0] < time.monotonic():
+        return None
+    return entry[1]
+
+
+def _cache_put(cache: Dict[Tuple[int, int], Tuple[float, Any]], key: Tuple[int, int], value: Any) -> None:
+    if not BALANCE_CACHE_TTL_SECONDS:
+        return
+    with _cache_lock:
+        if len(cache) >= _CACHE_MAX_ENTRIES:
+            cache.clear()
+        cache[key] = (time.monotonic() + BALANCE_CACHE_TTL_SECONDS, value)
+
+
+# Session.info key holding cache keys written by a transaction that hasn't ended yet
+_PENDING_BALANCE_INVALIDATIONS = "pending_balance_invalidations"
+
+
+def _invalidate_cached_balance(user_id: int, organization_id: int) -> None:
+    key = (user_id, organization_id)
+    with _cache_lock:
+        _balance_cache.pop(key, None)
+        _available_cache.pop(key, None)
+
+
+def _invalidate_cached_balance_on_write(db: Session, user_id: int, organization_id: int, committed: bool) -> None:
+    """Invalidate the cached entry for a write, again at commit if it is still pending.
+    
+    Until an uncommitted write commits, concurrent readers still see (and may
+    re-cache) the old values, so the entry is dropped once more when the
+    transaction ends.
+    """
+    _invalidate_cached_balance(user_id, organization_id)
+    if not committed:
+        db.info.setdefault(_PENDING_BALANCE_INVALIDATIONS, set()).add((user_id, organization_id))
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _flush_pending_balance_invalidations(session: Session) -> None:
+    """Drop cached balances written by the transaction that just ended."""
+    for user_id, organization_id in session.info.pop(_PENDING_BALANCE_INVALIDATIONS, ()):
+        _invalidate_cached_balance(user_id, organization_id)
 
 
 def get_token_balance(
     db: Session,
     user_id: int,
-    organization_id: int
+    organization_id: int,
+    commit: bool = True
 ) -> TokenBalance:
     """
     Get token balance for user/organization.
@@ -27,10 +90,18 @@ def get_token_balance(
         db: Database session
         user_id: User ID
         organization_id: Organization ID
+        commit: Commit the session after creating a missing balance record. Writers
+            called with commit=False pass it through, so the new row joins their
+            transaction instead of committing it early.
     
     Returns:
         TokenBalance object
     """
+    cached = _cache_get(_balance_cache, (user_id, organization_id))
+    if cached is not None:
+        # TokenBalance is frozen, so the cached instance can be shared
+        return cached
+    
     # Check if balance exists
     result = db.execute(
         text("""
@@ -44,17 +115,23 @@ def get_token_balance(
     row = result.fetchone()
     
     if row:
-        return TokenBalance.from_db_row(row)
+        balance = TokenBalance.from_db_row(row)
+        _cache_put(_balance_cache, (user_id, organization_id), balance)
+        return balance
     
-    # Create balance if it doesn't exist
+    # Create balance if it doesn't exist. ON DUPLICATE KEY (uk_user_org) makes this a
+    # no-op when a concurrent request created the row after the SELECT above, instead
+    # of failing with a duplicate key error.
     db.execute(
         text("""
             INSERT INTO token_balances (user_id, organization_id, balance)
             VALUES (:user_id, :org_id, 0)
+            ON DUPLICATE KEY UPDATE id = id
         """),
         {"user_id": user_id, "org_id": organization_id}
     )
-    db.commit()
+    if commit:
+        db.commit()
     
     # Get created balance
     result = db.execute(
@@ -78,7 +155,8 @@ def add_tokens(
     user_id: int,
     organization_id: int,
     amount: int,
-    reason: Optional[str] = None
+    reason: Optional[str] = None,
+    commit: bool = True
 ) -> TokenBalance:
     """
     Add tokens to balance (admin operation).
@@ -89,6 +167,8 @@ def add_tokens(
         organization_id: Organization ID
         amount: Number of tokens to add
         reason: Optional reason for adding tokens
+        commit: Commit the session after the update. Pass False to leave the
+            update in the caller's transaction.
     
     Returns:
         Updated TokenBalance object
@@ -97,7 +177,7 @@ def add_tokens(
         raise ValueError("Amount must be positive")
     
     # Get or create balance
-    balance = get_token_balance(db, user_id, organization_id)
+    balance = get_token_balance(db, user_id, organization_id, commit=commit)
     
     # Add tokens
     db.execute(
@@ -109,7 +189,9 @@ def add_tokens(
         """),
         {"balance_id": balance.id, "amount": amount}
     )
-    db.commit()
+    if commit:
+        db.commit()
+    _invalidate_cached_balance_on_write(db, user_id, organization_id, committed=commit)
     
     # Get updated balance
     result = db.execute(
@@ -133,7 +215,8 @@ def set_token_balance(
     user_id: int,
     organization_id: int,
     amount: int,
-    reason: Optional[str] = None
+    reason: Optional[str] = None,
+    commit: bool = True
 ) -> TokenBalance:
     """
     Set token balance directly (admin operation).
@@ -144,12 +227,14 @@ def set_token_balance(
         organization_id: Organization ID
         amount: New balance amount (can be negative)
         reason: Optional reason for setting balance
+        commit: Commit the session after the update. Pass False to leave the
+            update in the caller's transaction.
     
     Returns:
         Updated TokenBalance object
     """
     # Get or create balance
-    balance = get_token_balance(db, user_id, organization_id)
+    balance = get_token_balance(db, user_id, organization_id, commit=commit)
     
     # Set balance directly
     db.execute(
@@ -161,7 +246,9 @@ def set_token_balance(
         """),
         {"balance_id": balance.id, "amount": amount}
     )
-    db.commit()
+    if commit:
+        db.commit()
+    _invalidate_cached_balance_on_write(db, user_id, organization_id, committed=commit)
     
     # Get updated balance
     result = db.execute(
@@ -180,12 +267,58 @@ def set_token_balance(
     return TokenBalance.from_db_row(row)
 
 
+# Charge source label by (charged from subscription, charged from balance)
+_CHARGE_SOURCE = {
+    (False, False): "none",
+    (True, False): "subscription",
+    (False, True): "balance",
+    (True, True): "subscription+balance",
+}
+
+
+def _lock_charge_sources(db: Session, user_id: int, organization_id: int):
+    """
+    Read the token balance and the active subscription with one locking read.
+    
+    Both rows stay locked (SELECT ... FOR UPDATE) until the caller's transaction
+    ends. The subscription is chosen like get_active_subscription(); its columns
+    are NULL when there is none.
+    
+    Returns:
+        Row with balance_id, balance, subscription_id, tokens_allocated and
+        tokens_used_this_period, or None if the balance record doesn't exist
+    """
+    result = db.execute(
+        text("""
+            SELECT
+                b.id AS balance_id, b.balance,
+                s.id AS subscription_id, s.tokens_allocated, s.tokens_used_this_period
+            FROM token_balances b
+            LEFT JOIN user_subscriptions s ON s.id = (
+                SELECT s2.id
+                FROM user_subscriptions s2
+                INNER JOIN subscription_plans p ON s2.plan_id = p.id
+                WHERE s2.user_id = :user_id
+                  AND s2.organization_id = :org_id
+                  AND s2.status IN ('trial', 'active')
+                ORDER BY s2.started_at DESC
+                LIMIT 1
+            )
+            WHERE b.user_id = :user_id AND b.organization_id = :org_id
+            FOR UPDATE
+        """),
+        {"user_id": user_id, "org_id": organization_id}
+    )
+    return result.fetchone()
+
+
 def charge_tokens(
     db: Session,
     user_id: int,
     organization_id: int,
     amount: int,
-    source_type: str = "subscription"
+    source_type: str = "subscription",
+    commit: bool = True
 ) -> TokenChargeResult:
     """
     Charge tokens from subscription allocation or balance.
@@ -201,6 +334,10 @@ def charge_tokens(
         organization_id: Organization ID
         amount: Number of tokens to charge
         source_type: Preferred source type ("subscription" or "balance")
+        commit: End the transaction when done. Pass False to commit the charge
+            together with the caller's own writes (e.g. the consumption record);
+            the balance and subscription rows then stay locked until the caller
+            commits or rolls back.
     
     Returns:
         TokenChargeResult object
@@ -208,27 +345,31 @@ def charge_tokens(
     if amount <= 0:
         raise ValueError("Amount must be positive")
     
-    # Get active subscription
-    subscription = get_active_subscription(db, user_id, organization_id)
-    
+    # Lock the balance and the active subscription for the rest of the transaction so
+    # concurrent charges are serialized instead of both spending the same tokens
+    row = _lock_charge_sources(db, user_id, organization_id)
+    if row is None:
+        # Create the balance record, then lock it
+        get_token_balance(db, user_id, organization_id, commit=commit)
+        row = _lock_charge_sources(db, user_id, organization_id)
+        if row is None:
+            raise Exception("Failed to create token balance")
+    
+    has_subscription = row.subscription_id is not None
     subscription_tokens_available = 0
-    subscription_tokens_used = 0
-    subscription_tokens_allocated = 0
+    if has_subscription:
+        subscription_tokens_available = row.tokens_allocated - row.tokens_used_this_period
     
-    if subscription:
-        subscription_tokens_allocated = subscription.tokens_allocated
-        subscription_tokens_used = subscription.tokens_used_this_period
-        subscription_tokens_available = subscription.tokens_allocated - subscription.tokens_used_this_period
-    
-    # Get token balance
-    balance = get_token_balance(db, user_id, organization_id)
-    balance_tokens_available = balance.balance
+    balance_tokens_available = row.balance
     
     # Calculate total available
     total_available = subscription_tokens_available + balance_tokens_available
     
     # Check if we have enough tokens
     if total_available < amount:
+        # Nothing to charge - end the transaction to release the row locks
+        if commit:
+            db.commit()
         return TokenChargeResult(
             success=False,
             tokens_charged=0,
@@ -244,7 +385,7 @@ def charge_tokens(
     remaining_amount = amount
     
     # Priority 1: Charge from subscription if available
-    if subscription and subscription_tokens_available > 0:
+    if has_subscription and subscription_tokens_available > 0:
         tokens_charged_from_subscription = min(remaining_amount, subscription_tokens_available)
         remaining_amount -= tokens_charged_from_subscription
         
@@ -257,10 +398,13 @@ def charge_tokens(
                 WHERE id = :subscription_id
             """),
             {
-                "subscription_id": subscription.id,
+                "subscription_id": row.subscription_id,
                 "amount": tokens_charged_from_subscription,
             }
         )
+        # The charge may stay uncommitted, so later reads in this transaction
+        # must not see the memoized pre-charge usage
+        invalidate_active_subscription(db)
     
     # Priority 2: Charge remaining from balance if needed
     if remaining_amount > 0 and balance_tokens_available > 0:
@@ -275,26 +419,21 @@ def charge_tokens(
                 WHERE id = :balance_id
             """),
             {
-                "balance_id": balance.id,
+                "balance_id": row.balance_id,
                 "amount": tokens_charged_from_balance,
             }
         )
     
-    db.commit()
+    if commit:
+        db.commit()
+    _invalidate_cached_balance_on_write(db, user_id, organization_id, committed=commit)
     
     # Calculate remaining tokens
-    remaining_subscription = subscription_tokens_available - tokens_charged_from_subscription if subscription else 0
+    remaining_subscription = subscription_tokens_available - tokens_charged_from_subscription if has_subscription else 0
     remaining_balance = balance_tokens_available - tokens_charged_from_balance
     
     # Determine source
-    if tokens_charged_from_subscription > 0 and tokens_charged_from_balance > 0:
-        source = "subscription+balance"
-    elif tokens_charged_from_subscription > 0:
-        source = "subscription"
-    elif tokens_charged_from_balance > 0:
-        source = "balance"
-    else:
-        source = "none"
+    source = _CHARGE_SOURCE[(tokens_charged_from_subscription > 0, tokens_charged_from_balance > 0)]
     
     return TokenChargeResult(
         success=True,
@@ -322,6 +461,11 @@ def get_available_tokens(
     Returns:
         Total available tokens
     """
+    key = (user_id, organization_id)
+    cached = _cache_get(_available_cache, key)
+    if cached is not None:
+        return cached
+    
     # Get active subscription
     subscription = get_active_subscription(db, user_id, organization_id)
     
@@ -333,5 +477,7 @@ def get_available_tokens(
     balance = get_token_balance(db, user_id, organization_id)
     balance_tokens_available = balance.balance
     
-    return subscription_tokens_available + balance_tokens_available
+    total_available = subscription_tokens_available + balance_tokens_available
+    _cache_put(_available_cache, key, total_available)
+    return total_available
 
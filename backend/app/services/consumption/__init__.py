@@ -3,8 +3,11 @@ Token consumption service for tracking and analyzing token usage.
 """
 from app.services.consumption.token_consumption_service import (
     record_consumption,
+    build_consumption_record,
+    insert_consumption_records,
     get_consumption_stats,
     get_consumption_history,
+    iter_consumption_history,
     get_consumption_chart_data,
 )
 from app.services.consumption.consumption_models import (
@@ -15,8 +18,11 @@ from app.services.consumption.consumption_models import (
 
 __all__ = [
     "record_consumption",
+    "build_consumption_record",
+    "insert_consumption_records",
     "get_consumption_stats",
     "get_consumption_history",
+    "iter_consumption_history",
     "get_consumption_chart_data",
     "ConsumptionStats",
     "ConsumptionHistoryItem",
@@ -7,7 +7,7 @@ from datetime import datetime
 from typing import Optional
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ConsumptionStats:
     """Consumption statistics for a user/organization."""
     total_tokens: int
@@ -24,7 +24,7 @@ class ConsumptionStats:
     by_provider: dict[str, dict]  # provider -> {tokens, cost, price, count}
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ConsumptionHistoryItem:
     """Single consumption record for history listing."""
     id: int
@@ -42,7 +42,7 @@ class ConsumptionHistoryItem:
     source_name: Optional[str] = None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ChartDataPoint:
     """Data point for consumption charts."""
     date: str  # Date in YYYY-MM-DD format
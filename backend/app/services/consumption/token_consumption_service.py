@@ -2,10 +2,10 @@
 Token consumption service for recording and analyzing token usage.
 """
 from decimal import Decimal
-from datetime import datetime, timedelta, timezone
-from typing import Optional, List, Dict, Any
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, Iterator
 from sqlalchemy.orm import Session
-from sqlalchemy import text, func, and_, or_
+from sqlalchemy import text, func, and_, or_, select, table, column
 from app.services.consumption.consumption_models import (
     ConsumptionStats,
     ConsumptionHistoryItem,
@@ -14,6 +14,147 @@ from app.services.consumption.consumption_models import (
 from app.services.pricing import calculate_pricing
 
 
+def _to_decimal(value: Any) -> Decimal:
+    """NUMERIC columns already arrive as Decimal from the driver; convert anything else."""
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value or 0))
+
+
+_INSERT_CONSUMPTION_SQL = text("""
+    INSERT INTO token_consumption
+    (user_id, organization_id, run_id, step_id, rag_query_id,
+     model_name, provider, input_tokens, output_tokens, total_tokens,
+     cost_per_1k_input_usd, cost_per_1k_output_usd, price_per_1k_usd,
+     exchange_rate_usd_to_rub, cost_rub, price_rub,
+     source_type, tokens_charged, source_name, consumed_at)
+    VALUES
+    (:user_id, :org_id, :run_id, :step_id, :rag_query_id,
+     :model_name, :provider, :input_tokens, :output_tokens, :total_tokens,
+     :cost_input, :cost_output, :price_per_1k,
+     :exchange_rate, :cost_rub, :price_rub,
+     :source_type, :tokens_charged, :source_name, CURRENT_TIMESTAMP)
+""")
+
+# For dialects that can return the new id from the INSERT itself (MySQL cannot;
+# there lastrowid comes back in the OK packet without an extra round-trip)
+_INSERT_CONSUMPTION_RETURNING_SQL = text(_INSERT_CONSUMPTION_SQL.text.rstrip() + " RETURNING id")
+
+# Lightweight Core table for the read queries: statements built from it are cached in
+# compiled form, whatever combination of optional filters is applied
+_token_consumption = table(
+    "token_consumption",
+    column("id"),
+    column("user_id"),
+    column("organization_id"),
+    column("run_id"),
+    column("step_id"),
+    column("model_name"),
+    column("provider"),
+    column("input_tokens"),
+    column("output_tokens"),
+    column("total_tokens"),
+    column("cost_rub"),
+    column("price_rub"),
+    column("source_type"),
+    column("source_name"),
+    column("consumed_at"),
+)
+
+
+def _consumption_filters(
+    user_id: int,
+    organization_id: int,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    model_name: Optional[str] = None,
+    provider: Optional[str] = None,
+) -> list:
+    """WHERE criteria on token_consumption for the given user/organization and optional filters."""
+    tc = _token_consumption.c
+    filters = [tc.user_id == user_id, tc.organization_id == organization_id]
+    if start_date:
+        filters.append(tc.consumed_at >= start_date)
+    if end_date:
+        filters.append(tc.consumed_at <= end_date)
+    if model_name:
+        filters.append(tc.model_name == model_name)
+    if provider:
+        filters.append(tc.provider == provider)
+    return filters
+
+
+def build_consumption_record(
+    db: Session,
+    user_id: int,
+    organization_id: int,
+    model_name: str,
+    provider: str,
+    input_tokens: int,
+    output_tokens: int,
+    run_id: Optional[int] = None,
+    step_id: Optional[int] = None,
+    rag_query_id: Optional[int] = None,
+    source_type: str = "subscription",
+    source_name: Optional[str] = None,
+    served_from_cache: bool = False
+) -> Dict[str, Any]:
+    """
+    Price a token usage and build the token_consumption row for it without writing it.
+    
+    Args are the same as for record_consumption().
+    
+    Returns:
+        Row parameters for insert_consumption_records()
+    """
+    # Calculate pricing
+    pricing_calc = calculate_pricing(
+        db, model_name, provider, input_tokens, output_tokens
+    )
+    
+    if not pricing_calc:
+        raise ValueError(f"Pricing not found for model {model_name} ({provider})")
+    
+    # Calculate tokens charged (total tokens)
+    total_tokens = input_tokens + output_tokens
+    tokens_charged = total_tokens
+    
+    return {
+        "user_id": user_id,
+        "org_id": organization_id,
+        "run_id": run_id,
+        "step_id": step_id,
+        "rag_query_id": rag_query_id,
+        "model_name": model_name,
+        "provider": provider,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "total_tokens": total_tokens,
+        # Decimals are bound as-is so NUMERIC columns get the exact values
+        "cost_input": pricing_calc.cost_per_1k_input_usd,
+        "cost_output": pricing_calc.cost_per_1k_output_usd,
+        "price_per_1k": pricing_calc.price_per_1k_usd,
+        "exchange_rate": pricing_calc.exchange_rate,
+        # A cached response was never paid for at the provider
+        "cost_rub": Decimal(0) if served_from_cache else pricing_calc.our_cost_rub,
+        "price_rub": pricing_calc.user_price_rub,
+        "source_type": source_type,
+        "tokens_charged": tokens_charged,
+        "source_name": source_name,
+    }
+
+
+def insert_consumption_records(db: Session, records: List[Dict[str, Any]]) -> None:
+    """
+    Insert consumption rows built by build_consumption_record() in one batch.
+    
+    All rows go through one executemany() call. The caller commits, so the rows can
+    share a transaction with the records they belong to.
+    """
+    if records:
+        db.execute(_INSERT_CONSUMPTION_SQL, records)
+
+
 def record_consumption(
     db: Session,
     user_id: int,
@@ -26,7 +167,9 @@ def record_consumption(
     step_id: Optional[int] = None,
     rag_query_id: Optional[int] = None,
     source_type: str = "subscription",
-    source_name: Optional[str] = None
+    source_name: Optional[str] = None,
+    served_from_cache: bool = False,
+    commit: bool = True
 ) -> int:
     """
     Record token consumption in database.
@@ -44,67 +187,30 @@ def record_consumption(
         rag_query_id: Optional RAG query ID
         source_type: Source type ("subscription", "balance", "package")
         source_name: Optional source name (e.g., pipeline name, RAG name)
+        served_from_cache: The usage was answered from the LLM response cache, so it
+            is recorded with zero provider cost (cost_rub); the user price is kept
+        commit: Commit the session after inserting. Pass False when the caller
+            commits the record as part of its own transaction.
     
     Returns:
         Consumption record ID
     """
-    # Calculate pricing
-    pricing_calc = calculate_pricing(
-        db, model_name, provider, input_tokens, output_tokens
+    record = build_consumption_record(
+        db, user_id, organization_id, model_name, provider, input_tokens, output_tokens,
+        run_id=run_id, step_id=step_id, rag_query_id=rag_query_id,
+        source_type=source_type, source_name=source_name,
+        served_from_cache=served_from_cache,
     )
     
-    if not pricing_calc:
-        raise ValueError(f"Pricing not found for model {model_name} ({provider})")
-    
-    # Get exchange rate
-    from app.services.pricing import get_exchange_rate
-    exchange_rate = get_exchange_rate()
-    
-    # Calculate tokens charged (total tokens)
-    total_tokens = input_tokens + output_tokens
-    tokens_charged = total_tokens
-    
     # Insert consumption record
-    result = db.execute(
-        text("""
-            INSERT INTO token_consumption
-            (user_id, organization_id, run_id, step_id, rag_query_id,
-             model_name, provider, input_tokens, output_tokens, total_tokens,
-             cost_per_1k_input_usd, cost_per_1k_output_usd, price_per_1k_usd,
-             exchange_rate_usd_to_rub, cost_rub, price_rub,
-             source_type, tokens_charged, source_name, consumed_at)
-            VALUES
-            (:user_id, :org_id, :run_id, :step_id, :rag_query_id,
-             :model_name, :provider, :input_tokens, :output_tokens, :total_tokens,
-             :cost_input, :cost_output, :price_per_1k,
-             :exchange_rate, :cost_rub, :price_rub,
-             :source_type, :tokens_charged, :source_name, CURRENT_TIMESTAMP)
-        """),
-        {
-            "user_id": user_id,
-            "org_id": organization_id,
-            "run_id": run_id,
-            "step_id": step_id,
-            "rag_query_id": rag_query_id,
-            "model_name": model_name,
-            "provider": provider,
-            "input_tokens": input_tokens,
-            "output_tokens": output_tokens,
-            "total_tokens": total_tokens,
-            "cost_input": float(pricing_calc.cost_per_1k_input_usd),
-            "cost_output": float(pricing_calc.cost_per_1k_output_usd),
-            "price_per_1k": float(pricing_calc.price_per_1k_usd),
-            "exchange_rate": float(exchange_rate),
-            "cost_rub": float(pricing_calc.our_cost_rub),
-            "price_rub": float(pricing_calc.user_price_rub),
-            "source_type": source_type,
-            "tokens_charged": tokens_charged,
-            "source_name": source_name,
-        }
-    )
+    if db.get_bind().dialect.insert_returning:
+        consumption_id = db.execute(_INSERT_CONSUMPTION_RETURNING_SQL, record).scalar_one()
+    else:
+        consumption_id = db.execute(_INSERT_CONSUMPTION_SQL, record).lastrowid
     
-    db.commit()
-    return result.lastrowid
+    if commit:
+        db.commit()
+    return consumption_id
 
 
 def get_consumption_stats(
@@ -127,94 +233,144 @@ def get_consumption_stats(
     Returns:
         ConsumptionStats object
     """
-    # Build WHERE clause
-    where_clauses = ["user_id = :user_id", "organization_id = :org_id"]
-    params = {"user_id": user_id, "org_id": organization_id}
-    
-    if start_date:
-        where_clauses.append("consumed_at >= :start_date")
-        params["start_date"] = start_date
-    
-    if end_date:
-        where_clauses.append("consumed_at <= :end_date")
-        params["end_date"] = end_date
-    
-    where_sql = " AND ".join(where_clauses)
-    
-    # Build query
-    query = text(f"""
-        SELECT 
-            SUM(total_tokens) as total_tokens,
-            SUM(cost_rub) as total_cost_rub,
-            SUM(price_rub) as total_price_rub,
-            COUNT(*) as consumption_count,
-            MIN(consumed_at) as period_start,
-            MAX(consumed_at) as period_end
-        FROM token_consumption
-        WHERE {where_sql}
-    """)
-    
-    result = db.execute(query, params)
-    stats_row = result.fetchone()  # Save the main stats row before loops overwrite 'row'
+    tc = _token_consumption.c
+    
+    # One scan grouped by (model, provider); the totals and both breakdowns are
+    # rolled up from these few rows instead of scanning the table three times
+    query = (
+        select(
+            tc.model_name,
+            tc.provider,
+            func.sum(tc.total_tokens).label("tokens"),
+            func.sum(tc.cost_rub).label("cost"),
+            func.sum(tc.price_rub).label("price"),
+            func.count().label("count"),
+            func.min(tc.consumed_at).label("period_start"),
+            func.max(tc.consumed_at).label("period_end"),
+        )
+        .where(*_consumption_filters(user_id, organization_id, start_date, end_date))
+        .group_by(tc.model_name, tc.provider)
+    )
     
-    # Get breakdown by model
-    model_query = text(f"""
-        SELECT 
-            model_name,
-            SUM(total_tokens) as tokens,
-            SUM(cost_rub) as cost,
-            SUM(price_rub) as price,
-            COUNT(*) as count
-        FROM token_consumption
-        WHERE {where_sql}
-        GROUP BY model_name
-    """)
+    result = db.execute(query)
     
-    model_result = db.execute(model_query, params)
+    total_tokens = 0
+    total_cost_rub = Decimal(0)
+    total_price_rub = Decimal(0)
+    consumption_count = 0
+    period_start = None
+    period_end = None
     by_model = {}
-    for row in model_result:
-        by_model[row.model_name] = {
-            "tokens": int(row.tokens or 0),
-            "cost": Decimal(str(row.cost or 0)),
-            "price": Decimal(str(row.price or 0)),
-            "count": int(row.count or 0),
-        }
-    
-    # Get breakdown by provider
-    provider_query = text(f"""
-        SELECT 
-            provider,
-            SUM(total_tokens) as tokens,
-            SUM(cost_rub) as cost,
-            SUM(price_rub) as price,
-            COUNT(*) as count
-        FROM token_consumption
-        WHERE {where_sql}
-        GROUP BY provider
-    """)
-    
-    provider_result = db.execute(provider_query, params)
     by_provider = {}
-    for row in provider_result:
-        by_provider[row.provider] = {
-            "tokens": int(row.tokens or 0),
-            "cost": Decimal(str(row.cost or 0)),
-            "price": Decimal(str(row.price or 0)),
-            "count": int(row.count or 0),
-        }
+    for row in result:
+        tokens = int(row.tokens or 0)
+        cost = _to_decimal(row.cost)
+        price = _to_decimal(row.price)
+        count = int(row.count or 0)
+        
+        total_tokens += tokens
+        total_cost_rub += cost
+        total_price_rub += price
+        consumption_count += count
+        if row.period_start and (period_start is None or row.period_start < period_start):
+            period_start = row.period_start
+        if row.period_end and (period_end is None or row.period_end > period_end):
+            period_end = row.period_end
+        
+        for breakdown, key in ((by_model, row.model_name), (by_provider, row.provider)):
+            entry = breakdown.get(key)
+            if entry is None:
+                breakdown[key] = {"tokens": tokens, "cost": cost, "price": price, "count": count}
+            else:
+                entry["tokens"] += tokens
+                entry["cost"] += cost
+                entry["price"] += price
+                entry["count"] += count
     
     return ConsumptionStats(
-        total_tokens=int(stats_row.total_tokens or 0) if stats_row else 0,
-        total_cost_rub=Decimal(str(stats_row.total_cost_rub or 0)) if stats_row else Decimal(0),
-        total_price_rub=Decimal(str(stats_row.total_price_rub or 0)) if stats_row else Decimal(0),
-        consumption_count=int(stats_row.consumption_count or 0) if stats_row else 0,
-        period_start=stats_row.period_start if stats_row and stats_row.period_start else datetime.now(timezone.utc),
-        period_end=stats_row.period_end if stats_row and stats_row.period_end else datetime.now(timezone.utc),
+        total_tokens=total_tokens,
+        total_cost_rub=total_cost_rub,
+        total_price_rub=total_price_rub,
+        consumption_count=consumption_count,
+        period_start=period_start or datetime.now(timezone.utc),
+        period_end=period_end or datetime.now(timezone.utc),
         by_model=by_model,
         by_provider=by_provider,
     )
 
 
+# Rows fetched per round-trip when streaming history from a server-side cursor
+_HISTORY_STREAM_BATCH = 1000
+
+
+def iter_consumption_history(
+    db: Session,
+    user_id: int,
+    organization_id: int,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    model_name: Optional[str] = None,
+    provider: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0
+) -> Iterator[ConsumptionHistoryItem]:
+    """
+    Stream consumption history with filters, newest first.
+    
+    Rows are read from a server-side cursor in batches, so memory stays flat no
+    matter how many records match (e.g. for exports). The session's connection
+    is busy until the iterator is exhausted or closed.
+    
+    Args:
+        db: Database session
+        user_id: User ID
+        organization_id: Organization ID
+        start_date: Optional start date filter
+        end_date: Optional end date filter
+        model_name: Optional model name filter
+        provider: Optional provider filter
+        limit: Optional maximum number of records (None for all)
+        offset: Offset for pagination
+    
+    Yields:
+        ConsumptionHistoryItem objects
+    """
+    tc = _token_consumption.c
+    query = (
+        select(
+            tc.id, tc.consumed_at, tc.model_name, tc.provider,
+            tc.input_tokens, tc.output_tokens, tc.total_tokens,
+            tc.cost_rub, tc.price_rub, tc.source_type,
+            tc.run_id, tc.step_id, tc.source_name,
+        )
+        .where(*_consumption_filters(
+            user_id, organization_id, start_date, end_date, model_name, provider
+        ))
+        .order_by(tc.consumed_at.desc())
+        .limit(limit)
+        .offset(offset)
+        .execution_options(stream_results=True, yield_per=_HISTORY_STREAM_BATCH)
+    )
+    
+    with db.execute(query) as result:
+        for row in result:
+            yield ConsumptionHistoryItem(
+                id=row.id,
+                consumed_at=row.consumed_at,
+                model_name=row.model_name,
+                provider=row.provider,
+                input_tokens=row.input_tokens,
+                output_tokens=row.output_tokens,
+                total_tokens=row.total_tokens,
+                cost_rub=_to_decimal(row.cost_rub),
+                price_rub=_to_decimal(row.price_rub),
+                source_type=row.source_type,
+                run_id=row.run_id,
+                step_id=row.step_id,
+                source_name=row.source_name,
+            )
+
+
 def get_consumption_history(
     db: Session,
     user_id: int,
@@ -243,64 +399,61 @@ def get_consumption_history(
     Returns:
         List of ConsumptionHistoryItem objects
     """
-    # Build query
-    where_clauses = ["user_id = :user_id", "organization_id = :org_id"]
-    params = {"user_id": user_id, "org_id": organization_id}
-    
-    if start_date:
-        where_clauses.append("consumed_at >= :start_date")
-        params["start_date"] = start_date
-    
-    if end_date:
-        where_clauses.append("consumed_at <= :end_date")
-        params["end_date"] = end_date
-    
-    if model_name:
-        where_clauses.append("model_name = :model_name")
-        params["model_name"] = model_name
-    
-    if provider:
-        where_clauses.append("provider = :provider")
-        params["provider"] = provider
-    
-    where_sql = " AND ".join(where_clauses)
-    
-    query = text(f"""
-        SELECT 
-            id, consumed_at, model_name, provider,
-            input_tokens, output_tokens, total_tokens,
-            cost_rub, price_rub, source_type,
-            run_id, step_id, source_name
-        FROM token_consumption
-        WHERE {where_sql}
-        ORDER BY consumed_at DESC
-        LIMIT :limit OFFSET :offset
-    """)
-    
-    params["limit"] = limit
-    params["offset"] = offset
-    
-    result = db.execute(query, params)
-    
-    history = []
-    for row in result:
-        history.append(ConsumptionHistoryItem(
-            id=row.id,
-            consumed_at=row.consumed_at,
-            model_name=row.model_name,
-            provider=row.provider,
-            input_tokens=row.input_tokens,
-            output_tokens=row.output_tokens,
-            total_tokens=row.total_tokens,
-            cost_rub=Decimal(str(row.cost_rub)),
-            price_rub=Decimal(str(row.price_rub)),
-            source_type=row.source_type,
-            run_id=row.run_id,
-            step_id=row.step_id,
-            source_name=row.source_name if hasattr(row, 'source_name') else None,
-        ))
+    return list(iter_consumption_history(
+        db, user_id, organization_id, start_date, end_date, model_name, provider,
+        limit=limit, offset=offset,
+    ))
+
+
+# Date bucket expressions for chart grouping, per SQL dialect. Each yields the first
+# day of the bucket as a DATE (weeks start on Monday).
+_CHART_BUCKET_SQL = {
+    "mysql": {
+        "day": "DATE(consumed_at)",
+        "week": "DATE(DATE_SUB(consumed_at, INTERVAL WEEKDAY(consumed_at) DAY))",
+        "month": "DATE_FORMAT(consumed_at, '%Y-%m-01')",
+    },
+    "postgresql": {
+        "day": "CAST(date_trunc('day', consumed_at) AS DATE)",
+        "week": "CAST(date_trunc('week', consumed_at) AS DATE)",
+        "month": "CAST(date_trunc('month', consumed_at) AS DATE)",
+    },
+    "sqlite": {
+        "day": "DATE(consumed_at)",
+        "week": "DATE(consumed_at, '-6 days', 'weekday 1')",
+        "month": "strftime('%Y-%m-01', consumed_at)",
+    },
+}
+
+
+def _chart_bucket_sql(dialect_name: str, group_by: str) -> str:
+    """SQL expression bucketing consumed_at by group_by ("day", "week", "month").
     
-    return history
+    Unknown groupings fall back to days; unknown dialects use the MySQL expressions.
+    """
+    expressions = _CHART_BUCKET_SQL.get(dialect_name, _CHART_BUCKET_SQL["mysql"])
+    return expressions.get(group_by, expressions["day"])
+
+
+def _chart_buckets(start: date, end: date, group_by: str) -> List[str]:
+    """Start dates (YYYY-MM-DD) of every bucket between start and end, matching _chart_bucket_sql."""
+    if group_by == "month":
+        current = start.replace(day=1)
+    elif group_by == "week":
+        current = start - timedelta(days=start.weekday())
+    else:
+        current = start
+    
+    buckets = []
+    while current <= end:
+        buckets.append(current.isoformat())
+        if group_by == "month":
+            current = (current + timedelta(days=32)).replace(day=1)
+        elif group_by == "week":
+            current += timedelta(days=7)
+        else:
+            current += timedelta(days=1)
+    return buckets
 
 
 def get_consumption_chart_data(
@@ -323,21 +476,13 @@ def get_consumption_chart_data(
         group_by: Grouping ("day", "week", "month")
     
     Returns:
-        List of ChartDataPoint objects
+        List of ChartDataPoint objects, one per bucket in the range (empty buckets are zero)
     """
-    # Determine date format based on group_by
-    if group_by == "day":
-        date_format = "DATE(consumed_at)"
-    elif group_by == "week":
-        date_format = "DATE(DATE_SUB(consumed_at, INTERVAL WEEKDAY(consumed_at) DAY))"
-    elif group_by == "month":
-        date_format = "DATE_FORMAT(consumed_at, '%Y-%m-01')"
-    else:
-        date_format = "DATE(consumed_at)"
+    bucket_sql = _chart_bucket_sql(db.get_bind().dialect.name, group_by)
     
     query = text(f"""
         SELECT 
-            {date_format} as date,
+            {bucket_sql} as date,
             SUM(total_tokens) as tokens,
             SUM(cost_rub) as cost_rub,
             SUM(price_rub) as price_rub
@@ -346,7 +491,7 @@ def get_consumption_chart_data(
           AND organization_id = :org_id
           AND consumed_at >= :start_date
           AND consumed_at <= :end_date
-        GROUP BY {date_format}
+        GROUP BY {bucket_sql}
         ORDER BY date ASC
     """)
     
@@ -357,13 +502,21 @@ def get_consumption_chart_data(
         "end_date": end_date,
     })
     
+    rows = {str(row.date): row for row in result}
+    zero = Decimal("0")
+    
+    # Densify: every bucket in the range gets a point, empty ones zero-filled
     chart_data = []
-    for row in result:
+    for bucket in _chart_buckets(start_date.date(), end_date.date(), group_by):
+        row = rows.get(bucket)
+        if row is None:
+            chart_data.append(ChartDataPoint(date=bucket, tokens=0, cost_rub=zero, price_rub=zero))
+            continue
         chart_data.append(ChartDataPoint(
-            date=str(row.date),
+            date=bucket,
             tokens=int(row.tokens or 0),
-            cost_rub=Decimal(str(row.cost_rub or 0)),
-            price_rub=Decimal(str(row.price_rub or 0)),
+            cost_rub=_to_decimal(row.cost_rub),
+            price_rub=_to_decimal(row.price_rub),
         ))
     
     return chart_data
@@ -2,22 +2,165 @@
 Data adapters for fetching market data from various sources.
 """
 from datetime import datetime, timedelta, timezone
-from typing import Optional, List
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
+from typing import Callable, Dict, Optional, List, Tuple
 import ccxt
+import numpy as np
+import orjson
 import yfinance as yf
 import pandas as pd
 from app.core.database import SessionLocal
 from app.models.data_cache import DataCache
 from app.models.instrument import Instrument
 from app.models.settings import AppSettings
-from app.services.data.normalized import MarketData, OHLCVCandle
-import json
-import hashlib
+from app.services.data.normalized import MarketData, OHLCVCandle, latest_index
+import atexit
 import logging
+import random
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
 
+# Retries after the first attempt when a provider rate-limits a request
+_RATE_LIMIT_RETRIES = 3
+
+# Tickers per yf.download() request in YFinanceAdapter.fetch_ohlcv_batch()
+_YFINANCE_BATCH_SIZE = 20
+
+# Our timeframe -> CCXT timeframe
+_CCXT_TIMEFRAMES = {
+    'M1': '1m',
+    'M5': '5m',
+    'M15': '15m',
+    'M30': '30m',
+    'H1': '1h',
+    'H4': '4h',
+    'D1': '1d',
+}
+
+# Our timeframe -> yfinance interval
+_YF_INTERVALS = {
+    'M1': '1m',
+    'M5': '5m',
+    'M15': '15m',
+    'M30': '30m',
+    'H1': '1h',
+    'D1': '1d',
+}
+
+# Bloomberg to Yahoo Finance futures ticker mapping
+_YF_TICKER_MAP = {
+    'NG1': 'NG=F',      # Natural Gas
+    'NG1!': 'NG=F',     # Natural Gas (continuous)
+    'B1': 'BZ=F',       # Brent Crude Oil
+    'B1!': 'BZ=F',      # Brent Crude Oil (continuous)
+    'CL1': 'CL=F',      # WTI Crude Oil
+    'CL1!': 'CL=F',     # WTI Crude Oil (continuous)
+    'GC1': 'GC=F',      # Gold
+    'GC1!': 'GC=F',     # Gold (continuous)
+    'SI1': 'SI=F',      # Silver
+    'SI1!': 'SI=F',     # Silver (continuous)
+    'PL1': 'PL=F',      # Platinum
+    'PL1!': 'PL=F',     # Platinum (continuous)
+    'PA1': 'PA=F',      # Palladium
+    'PA1!': 'PA=F',     # Palladium (continuous)
+    'HO1': 'HO=F',      # Heating Oil
+    'HO1!': 'HO=F',     # Heating Oil (continuous)
+    'RB1': 'RB=F',      # RBOB Gasoline
+    'RB1!': 'RB=F',     # RBOB Gasoline (continuous)
+    'ZC1': 'ZC=F',      # Corn
+    'ZC1!': 'ZC=F',     # Corn (continuous)
+    'ZS1': 'ZS=F',      # Soybeans
+    'ZS1!': 'ZS=F',     # Soybeans (continuous)
+    'ZW1': 'ZW=F',      # Wheat
+    'ZW1!': 'ZW=F',     # Wheat (continuous)
+}
+
+# Days of history TinkoffAdapter requests per timeframe when no start date is given
+_TINKOFF_HISTORY_DAYS = {
+    'M1': 1,   # 1 day for 1-minute candles
+    'M5': 1,   # 1 day for 5-minute candles
+    'M15': 3,  # 3 days for 15-minute candles
+    'H1': 7,   # 7 days for hourly candles
+    'D1': 365, # 1 year for daily candles
+}
+
+# Exchange name -> ccxt client shared by all CCXTAdapter instances, so markets are
+# loaded once per process (by ccxt, on the first fetch)
+_ccxt_exchanges: Dict[str, ccxt.Exchange] = {}
+_ccxt_exchanges_lock = threading.Lock()
+
+# API token -> (Client, open client services) shared by all TinkoffAdapter instances,
+# so each fetch reuses one gRPC channel instead of reconnecting
+_tinkoff_clients: Dict[str, tuple] = {}
+_tinkoff_clients_lock = threading.Lock()
+
+# Ticker -> FIGI for TinkoffAdapter, shared by all instances (FIGIs don't change)
+_figi_cache: Dict[str, str] = {}
+_figi_cache_loaded = False
+_figi_cache_lock = threading.Lock()
+
+
+# Process-wide in-memory tier in front of the DataCache table: cache key ->
+# (data, ttl_seconds), least recently used first. Entries age from data.fetched_at,
+# like the DB rows they mirror.
+_MEMORY_CACHE_MAX_ITEMS = 256
+_memory_cache: "OrderedDict[str, Tuple[MarketData, int]]" = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+# Instrument -> (time.monotonic() when stored, DataService adapter attribute), so
+# routing skips the Instrument query on repeat fetches. Entries expire so exchange
+# changes made by other processes are picked up; writers in this process call
+# invalidate_adapter_routes().
+_ADAPTER_ROUTE_TTL_SECONDS = 300
+_adapter_routes: Dict[str, Tuple[float, str]] = {}
+_adapter_routes_lock = threading.Lock()
+
+# Cache key -> Future for the adapter fetch in progress, so concurrent misses on the
+# same pair (across threads and DataService instances) share one upstream request
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def _get_memory(cache_key: str, ttl_seconds: int, now: Optional[datetime] = None) -> Optional[MarketData]:
+    with _memory_cache_lock:
+        entry = _memory_cache.get(cache_key)
+        if entry is None:
+            return None
+        data, entry_ttl = entry
+        age = ((now or datetime.now(timezone.utc)) - data.fetched_at).total_seconds()
+        if age >= min(entry_ttl, ttl_seconds):
+            if age >= entry_ttl:
+                del _memory_cache[cache_key]
+            return None
+        _memory_cache.move_to_end(cache_key)
+        return data
+
+
+def _put_memory(cache_key: str, data: MarketData, ttl_seconds: int) -> None:
+    with _memory_cache_lock:
+        _memory_cache[cache_key] = (data, ttl_seconds)
+        _memory_cache.move_to_end(cache_key)
+        while len(_memory_cache) > _MEMORY_CACHE_MAX_ITEMS:
+            _memory_cache.popitem(last=False)
+
+
+def invalidate_adapter_routes(instrument: Optional[str] = None) -> None:
+    """Forget memoized adapter routes after an Instrument row is created or edited.
+    
+    Args:
+        instrument: Symbol whose route to drop; all routes are dropped if None
+    """
+    with _adapter_routes_lock:
+        if instrument is None:
+            _adapter_routes.clear()
+        else:
+            _adapter_routes.pop(instrument, None)
+
+
 def get_tinkoff_token(db: Optional[SessionLocal] = None) -> Optional[str]:
     """Get Tinkoff API token from Settings.
     
@@ -45,6 +188,34 @@ def get_tinkoff_token(db: Optional[SessionLocal] = None) -> Optional[str]:
 class DataAdapter:
     """Base class for data adapters."""
     
+    # Caps concurrent fetch_ohlcv() calls through DataService per provider (shared by
+    # all instances of the class) to stay within the provider's rate limits
+    fetch_slots = threading.BoundedSemaphore(4)
+    
+    # Base delay in seconds before retrying a rate-limited request (doubles per attempt)
+    retry_delay = 1.0
+    
+    def _is_rate_limited(self, error: Exception) -> bool:
+        """Whether an error means the provider is throttling us. Override per provider."""
+        return False
+    
+    def _call_with_backoff(self, call: Callable, *args, **kwargs):
+        """Make a provider request, retrying with exponential backoff while rate-limited.
+        
+        Retrying here keeps one throttled request from failing a whole fetch_many
+        batch. Other errors, and the last rate-limit error, are raised as is.
+        """
+        for attempt in range(_RATE_LIMIT_RETRIES + 1):
+            try:
+                return call(*args, **kwargs)
+            except Exception as e:
+                if attempt == _RATE_LIMIT_RETRIES or not self._is_rate_limited(e):
+                    raise
+                # Jitter keeps concurrent fetches from retrying in lockstep
+                delay = self.retry_delay * 2 ** attempt + random.uniform(0, 0.2)
+                logger.warning(f"{type(self).__name__} rate-limited ({e}), retry {attempt + 1}/{_RATE_LIMIT_RETRIES} in {delay:.1f}s")
+                time.sleep(delay)
+    
     def fetch_ohlcv(
         self,
         instrument: str,
@@ -65,27 +236,44 @@ class CCXTAdapter(DataAdapter):
         Args:
             exchange_name: Exchange name (binance, coinbase, etc.)
         """
-        exchange_class = getattr(ccxt, exchange_name)
-        self.exchange = exchange_class({
-            'enableRateLimit': True,
-            'options': {
-                'defaultType': 'spot',  # or 'future'
-            }
-        })
+        self.exchange = self._get_exchange(exchange_name)
         self.exchange_name = exchange_name
+        # Back off from the exchange's own request interval (ms), but at least a second
+        self.retry_delay = max(self.exchange.rateLimit / 1000, 1.0)
+    
+    @staticmethod
+    def _get_exchange(exchange_name: str) -> ccxt.Exchange:
+        """Get the process-wide client for an exchange, creating it on first use.
+        
+        ccxt loads markets on the client's first fetch, so later fetches (and other
+        DataService instances) don't pay for it, and creating the client never waits
+        on the exchange. The client is shared by all threads; with enableRateLimit
+        its throttling then covers all of them.
+        """
+        exchange = _ccxt_exchanges.get(exchange_name)
+        if exchange is not None:
+            return exchange
+        
+        with _ccxt_exchanges_lock:
+            exchange = _ccxt_exchanges.get(exchange_name)
+            if exchange is None:
+                exchange_class = getattr(ccxt, exchange_name)
+                exchange = exchange_class({
+                    'enableRateLimit': True,
+                    'options': {
+                        'defaultType': 'spot',  # or 'future'
+                    }
+                })
+                _ccxt_exchanges[exchange_name] = exchange
+        return exchange
+    
+    def _is_rate_limited(self, error: Exception) -> bool:
+        # RateLimitExceeded is a subclass of DDoSProtection
+        return isinstance(error, ccxt.DDoSProtection)
     
     def _normalize_timeframe(self, timeframe: str) -> str:
         """Convert our timeframe to CCXT format."""
-        mapping = {
-            'M1': '1m',
-            'M5': '5m',
-            'M15': '15m',
-            'M30': '30m',
-            'H1': '1h',
-            'H4': '4h',
-            'D1': '1d',
-        }
-        return mapping.get(timeframe.upper(), timeframe.lower())
+        return _CCXT_TIMEFRAMES.get(timeframe.upper(), timeframe.lower())
     
     def fetch_ohlcv(
         self,
@@ -106,37 +294,16 @@ class CCXTAdapter(DataAdapter):
         
         try:
             # Fetch OHLCV data
-            ohlcv = self.exchange.fetch_ohlcv(
+            ohlcv = self._call_with_backoff(
+                self.exchange.fetch_ohlcv,
                 symbol,
                 ccxt_timeframe,
                 since=since_timestamp,
                 limit=limit
             )
             
-            # Convert to normalized format
-            candles = []
-            for candle in ohlcv:
-                candles.append(OHLCVCandle(
-                    timestamp=datetime.fromtimestamp(candle[0] / 1000, tz=timezone.utc),
-                    open=candle[1],
-                    high=candle[2],
-                    low=candle[3],
-                    close=candle[4],
-                    volume=candle[5]
-                ))
-            
-            # Sort by timestamp (oldest first) to ensure correct order
-            candles.sort(key=lambda c: c.timestamp)
-            # Take last N candles (most recent)
-            candles = candles[-limit:] if len(candles) > limit else candles
-            
-            return MarketData(
-                instrument=instrument,
-                timeframe=timeframe,
-                exchange=self.exchange_name,
-                candles=candles,
-                fetched_at=datetime.now(timezone.utc)
-            )
+            # Rows come back oldest first; from_ohlcv_rows only sorts if they don't
+            return MarketData.from_ohlcv_rows(instrument, timeframe, self.exchange_name, ohlcv, limit)
         except Exception as e:
             raise ValueError(f"Failed to fetch data from {self.exchange_name}: {str(e)}")
 
@@ -144,6 +311,14 @@ class CCXTAdapter(DataAdapter):
 class YFinanceAdapter(DataAdapter):
     """yfinance adapter for equities."""
     
+    fetch_slots = threading.BoundedSemaphore(8)
+    retry_delay = 2.0
+    
+    def _is_rate_limited(self, error: Exception) -> bool:
+        # HTTP 429 from Yahoo, raised by requests or re-raised with its message
+        response = getattr(error, 'response', None)
+        return getattr(response, 'status_code', None) == 429 or 'Too Many Requests' in str(error)
+    
     def _normalize_futures_ticker(self, symbol: str) -> str:
         """Convert Bloomberg-style futures tickers to Yahoo Finance format.
         
@@ -153,49 +328,51 @@ class YFinanceAdapter(DataAdapter):
             B1! -> BZ=F (Brent Crude Oil)
             CL1 -> CL=F (WTI Crude Oil)
         """
-        # Bloomberg to Yahoo Finance ticker mapping
-        ticker_map = {
-            'NG1': 'NG=F',      # Natural Gas
-            'NG1!': 'NG=F',     # Natural Gas (continuous)
-            'B1': 'BZ=F',       # Brent Crude Oil
-            'B1!': 'BZ=F',      # Brent Crude Oil (continuous)
-            'CL1': 'CL=F',      # WTI Crude Oil
-            'CL1!': 'CL=F',     # WTI Crude Oil (continuous)
-            'GC1': 'GC=F',      # Gold
-            'GC1!': 'GC=F',     # Gold (continuous)
-            'SI1': 'SI=F',      # Silver
-            'SI1!': 'SI=F',     # Silver (continuous)
-            'PL1': 'PL=F',      # Platinum
-            'PL1!': 'PL=F',     # Platinum (continuous)
-            'PA1': 'PA=F',      # Palladium
-            'PA1!': 'PA=F',     # Palladium (continuous)
-            'HO1': 'HO=F',      # Heating Oil
-            'HO1!': 'HO=F',     # Heating Oil (continuous)
-            'RB1': 'RB=F',      # RBOB Gasoline
-            'RB1!': 'RB=F',     # RBOB Gasoline (continuous)
-            'ZC1': 'ZC=F',      # Corn
-            'ZC1!': 'ZC=F',     # Corn (continuous)
-            'ZS1': 'ZS=F',      # Soybeans
-            'ZS1!': 'ZS=F',     # Soybeans (continuous)
-            'ZW1': 'ZW=F',      # Wheat
-            'ZW1!': 'ZW=F',     # Wheat (continuous)
-        }
-        
-        # Check if symbol needs mapping
-        normalized = ticker_map.get(symbol.upper(), symbol)
-        return normalized
+        return _YF_TICKER_MAP.get(symbol.upper(), symbol)
     
     def _normalize_timeframe(self, timeframe: str) -> str:
         """Convert our timeframe to yfinance interval."""
-        mapping = {
-            'M1': '1m',
-            'M5': '5m',
-            'M15': '15m',
-            'M30': '30m',
-            'H1': '1h',
-            'D1': '1d',
-        }
-        return mapping.get(timeframe.upper(), '1d')
+        return _YF_INTERVALS.get(timeframe.upper(), '1d')
+    
+    def _default_period(self, timeframe: str) -> str:
+        """History period to request when no start date is given."""
+        # Default period based on timeframe
+        if timeframe in ['M1', 'M5', 'M15', 'M30', 'H1']:
+            return '5d'  # Intraday data
+        return '1mo'  # Daily data
+    
+    def _frame_to_market_data(self, instrument: str, timeframe: str, df: pd.DataFrame, limit: int) -> MarketData:
+        """Build MarketData from a yfinance OHLCV frame."""
+        df = df[['Open', 'High', 'Low', 'Close', 'Volume']]
+        # yfinance leaves NaN in partially filled rows; JSON has no NaN, so such rows
+        # would come back from the cache as None. Drop rows without prices and treat
+        # missing volume as none traded.
+        df = df.dropna(subset=['Open', 'High', 'Low', 'Close']).fillna({'Volume': 0.0})
+        # yfinance returns rows oldest first; only sort if they aren't
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index(kind='stable')
+        # Limit results (tail gets last N, the most recent)
+        df = df.tail(limit)
+        
+        # Convert to normalized format: extract whole columns instead of iterating
+        # rows; values are float64 already, so per-field validation is skipped
+        index = df.index
+        timestamps = index.to_pydatetime() if isinstance(index, pd.DatetimeIndex) else list(index)
+        fields = df.to_numpy(dtype=np.float64).tolist()
+        candles = [
+            OHLCVCandle.model_construct(
+                timestamp=ts, open=o, high=h, low=l, close=c, volume=v,
+            )
+            for ts, (o, h, l, c, v) in zip(timestamps, fields)
+        ]
+        
+        return MarketData(
+            instrument=instrument,  # Keep original symbol for display
+            timeframe=timeframe,
+            exchange='yfinance',
+            candles=candles,
+            fetched_at=datetime.now(timezone.utc)
+        )
     
     def fetch_ohlcv(
         self,
@@ -210,65 +387,87 @@ class YFinanceAdapter(DataAdapter):
         ticker = yf.Ticker(normalized_instrument)
         interval = self._normalize_timeframe(timeframe)
         
-        # Calculate period
-        if since:
-            period = None
-            end_date = datetime.utcnow()
-        else:
-            # Default period based on timeframe
-            if timeframe in ['M1', 'M5', 'M15', 'M30', 'H1']:
-                period = '5d'  # Intraday data
-            else:
-                period = '1mo'  # Daily data
-        
         try:
             # Fetch data
             if since:
-                df = ticker.history(
+                df = self._call_with_backoff(
+                    ticker.history,
                     start=since,
                     end=datetime.utcnow(),
                     interval=interval
                 )
             else:
-                df = ticker.history(period=period, interval=interval)
+                df = self._call_with_backoff(ticker.history, period=self._default_period(timeframe), interval=interval)
             
             if df.empty:
                 raise ValueError(f"No data available for {instrument} (tried {normalized_instrument})")
             
-            # Limit results (tail gets last N, which should be most recent)
-            df = df.tail(limit)
-            
-            # Convert to normalized format
-            candles = []
-            for idx, row in df.iterrows():
-                candles.append(OHLCVCandle(
-                    timestamp=idx.to_pydatetime() if isinstance(idx, pd.Timestamp) else idx,
-                    open=float(row['Open']),
-                    high=float(row['High']),
-                    low=float(row['Low']),
-                    close=float(row['Close']),
-                    volume=float(row['Volume'])
-                ))
-            
-            # Sort by timestamp (oldest first) to ensure correct order
-            candles.sort(key=lambda c: c.timestamp)
-            # Take last N candles (most recent) - safety check in case tail didn't work as expected
-            candles = candles[-limit:] if len(candles) > limit else candles
-            
-            return MarketData(
-                instrument=instrument,  # Keep original symbol for display
-                timeframe=timeframe,
-                exchange='yfinance',
-                candles=candles,
-                fetched_at=datetime.now(timezone.utc)
-            )
+            return self._frame_to_market_data(instrument, timeframe, df, limit)
         except Exception as e:
             raise ValueError(f"Failed to fetch data from yfinance for {instrument} (tried {normalized_instrument}): {str(e)}")
+    
+    def fetch_ohlcv_batch(
+        self,
+        instruments: List[str],
+        timeframe: str,
+        limit: int = 500
+    ) -> Dict[str, MarketData]:
+        """Fetch OHLCV data for several instruments with one yfinance download per chunk.
+        
+        Args:
+            instruments: Symbols (Bloomberg-style futures tickers are normalized)
+            timeframe: Timeframe shared by all instruments
+            limit: Maximum number of candles per instrument
+        
+        Returns:
+            Market data keyed by the original symbol. Symbols yfinance returned no
+            data for are left out.
+        """
+        interval = self._normalize_timeframe(timeframe)
+        period = self._default_period(timeframe)
+        results: Dict[str, MarketData] = {}
+        
+        for start in range(0, len(instruments), _YFINANCE_BATCH_SIZE):
+            chunk = instruments[start:start + _YFINANCE_BATCH_SIZE]
+            normalized = {instrument: self._normalize_futures_ticker(instrument) for instrument in chunk}
+            try:
+                # Match Ticker.history(): adjusted prices, exchange-local timestamps
+                df = self._call_with_backoff(
+                    yf.download,
+                    tickers=list(dict.fromkeys(normalized.values())),
+                    period=period,
+                    interval=interval,
+                    group_by='ticker',
+                    auto_adjust=True,
+                    ignore_tz=False,
+                    threads=True,
+                    progress=False,
+                )
+            except Exception as e:
+                raise ValueError(f"Failed to fetch data from yfinance for {', '.join(chunk)}: {str(e)}")
+            
+            for instrument, ticker in normalized.items():
+                if isinstance(df.columns, pd.MultiIndex):
+                    if ticker not in df.columns.get_level_values(0):
+                        continue
+                    frame = df[ticker]
+                else:
+                    # Single ticker downloads come back with flat columns
+                    frame = df
+                # Rows are aligned across tickers, so drop the ones this ticker lacks
+                frame = frame.dropna(how='all')
+                if frame.empty:
+                    continue
+                results[instrument] = self._frame_to_market_data(instrument, timeframe, frame, limit)
+        
+        return results
 
 
 class TinkoffAdapter(DataAdapter):
     """Tinkoff Invest API adapter for MOEX instruments."""
     
+    fetch_slots = threading.BoundedSemaphore(2)
+    
     def __init__(self, api_token: str):
         """Initialize Tinkoff adapter.
         
@@ -284,22 +483,52 @@ class TinkoffAdapter(DataAdapter):
             raise ImportError("tinkoff-investments package not installed. Install with: pip install tinkoff-investments")
         
         self.api_token = api_token
-        self.client = None  # Will be created per request (not kept open)
+        
+        # Our timeframe -> Tinkoff CandleInterval
+        self._intervals = {
+            'M1': CandleInterval.CANDLE_INTERVAL_1_MIN,
+            'M5': CandleInterval.CANDLE_INTERVAL_5_MIN,
+            'M15': CandleInterval.CANDLE_INTERVAL_15_MIN,
+            'M30': CandleInterval.CANDLE_INTERVAL_15_MIN,  # Tinkoff doesn't have M30, use M15
+            'H1': CandleInterval.CANDLE_INTERVAL_HOUR,
+            'D1': CandleInterval.CANDLE_INTERVAL_DAY,
+        }
+    
+    def _get_client(self):
+        """Get the open Tinkoff client for this token, connecting on first use.
+        
+        The client is shared process-wide and stays open until close() or exit.
+        """
+        entry = _tinkoff_clients.get(self.api_token)
+        if entry is None:
+            with _tinkoff_clients_lock:
+                entry = _tinkoff_clients.get(self.api_token)
+                if entry is None:
+                    manager = self.Client(self.api_token)
+                    entry = (manager, manager.__enter__())
+                    _tinkoff_clients[self.api_token] = entry
+        return entry[1]
+    
+    def close(self):
+        """Close the shared Tinkoff client for this token, if one is open."""
+        with _tinkoff_clients_lock:
+            entry = _tinkoff_clients.pop(self.api_token, None)
+        if entry is not None:
+            entry[0].__exit__(None, None, None)
+    
+    def _is_rate_limited(self, error: Exception) -> bool:
+        # tinkoff.invest RequestError carries the gRPC status code
+        return getattr(getattr(error, 'code', None), 'name', None) == 'RESOURCE_EXHAUSTED'
     
     def _normalize_timeframe(self, timeframe: str):
         """Convert our timeframe to Tinkoff CandleInterval."""
-        mapping = {
-            'M1': self.CandleInterval.CANDLE_INTERVAL_1_MIN,
-            'M5': self.CandleInterval.CANDLE_INTERVAL_5_MIN,
-            'M15': self.CandleInterval.CANDLE_INTERVAL_15_MIN,
-            'M30': self.CandleInterval.CANDLE_INTERVAL_15_MIN,  # Tinkoff doesn't have M30, use M15
-            'H1': self.CandleInterval.CANDLE_INTERVAL_HOUR,
-            'D1': self.CandleInterval.CANDLE_INTERVAL_DAY,
-        }
-        return mapping.get(timeframe.upper(), self.CandleInterval.CANDLE_INTERVAL_DAY)
+        return self._intervals.get(timeframe.upper(), self.CandleInterval.CANDLE_INTERVAL_DAY)
     
     def _get_figi_for_ticker(self, ticker: str, db: SessionLocal) -> Optional[str]:
-        """Get FIGI for a ticker from database or Tinkoff API.
+        """Get FIGI for a ticker from the process-wide cache, database or Tinkoff API.
+        
+        The first lookup loads every known FIGI with one query; FIGIs resolved later
+        are added as they are found.
         
         Args:
             ticker: Instrument ticker (e.g., 'SBER')
@@ -308,6 +537,55 @@ class TinkoffAdapter(DataAdapter):
         Returns:
             FIGI string or None if not found
         """
+        global _figi_cache_loaded
+        if not _figi_cache_loaded:
+            with _figi_cache_lock:
+                if not _figi_cache_loaded:
+                    rows = db.query(Instrument.symbol, Instrument.figi).filter(Instrument.figi.isnot(None)).all()
+                    _figi_cache.update((row.symbol, row.figi) for row in rows if row.figi)
+                    _figi_cache_loaded = True
+        
+        figi = _figi_cache.get(ticker)
+        if figi:
+            return figi
+        
+        figi = self._resolve_figi(ticker, db)
+        if figi:
+            with _figi_cache_lock:
+                _figi_cache[ticker] = figi
+        return figi
+    
+    @staticmethod
+    def _store_figi(ticker: str, figi: str) -> None:
+        """Save a resolved FIGI on the ticker's Instrument row (created if missing).
+        
+        Uses a session of its own: the caller's session is shared across the fetch,
+        and committing belongs to its owner.
+        """
+        try:
+            with SessionLocal() as db:
+                instrument = db.query(Instrument).filter(Instrument.symbol == ticker).first()
+                if instrument:
+                    instrument.figi = figi
+                    instrument.exchange = "MOEX"  # Normalize to MOEX
+                else:
+                    # Create instrument record if it doesn't exist
+                    db.add(Instrument(
+                        symbol=ticker,
+                        type="equity",  # Keep as equity for now (futures are also equity-like)
+                        exchange="MOEX",
+                        figi=figi,
+                        is_enabled=False
+                    ))
+                db.commit()
+        except Exception as e:
+            logger.warning(f"Could not save FIGI {figi} for ticker {ticker}: {e}")
+            return
+        # The ticker is now known to be a MOEX instrument
+        invalidate_adapter_routes(ticker)
+    
+    def _resolve_figi(self, ticker: str, db: SessionLocal) -> Optional[str]:
+        """Look up a FIGI in the database, then via the Tinkoff API (caching it in the DB)."""
         # Check database first
         instrument = db.query(Instrument).filter(Instrument.symbol == ticker).first()
         if instrument and instrument.figi:
@@ -315,98 +593,71 @@ class TinkoffAdapter(DataAdapter):
         
         # If not in DB, search Tinkoff API
         try:
-            with self.Client(self.api_token) as client:
-                from tinkoff.invest.schemas import InstrumentIdType
-                
-                # Search for instrument
-                search_result = client.instruments.find_instrument(query=ticker)
-                
-                if not search_result.instruments:
-                    logger.warning(f"No instruments found for ticker: {ticker}")
-                    return None
-                
-                # Find MOEX instruments (shares OR futures) with matching ticker
-                # Prefer BBG FIGI (Bloomberg) over TCS (Tinkoff internal)
-                # Note: Tinkoff API uses "futures" (plural) not "future" (singular)
-                found_instruments = []
-                for inst in search_result.instruments:
-                    # Check for both shares and futures (note: Tinkoff uses "futures" plural)
-                    if inst.ticker == ticker and inst.instrument_type in ["share", "future", "futures"]:
-                        found_instruments.append(inst)
-                
-                # Sort: prefer BBG FIGI
-                found_instruments.sort(key=lambda x: (not x.figi.startswith("BBG"), x.figi))
-                
-                for inst in found_instruments:
-                    # Verify it's MOEX by getting full details
-                    try:
-                        if inst.instrument_type == "share":
-                            full_inst = client.instruments.share_by(
-                                id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI,
-                                id=inst.figi
-                            )
-                            exchange = full_inst.instrument.exchange
-                        elif inst.instrument_type in ["future", "futures"]:
-                            # Tinkoff API uses "futures" (plural) for futures contracts
-                            full_inst = client.instruments.future_by(
-                                id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI,
-                                id=inst.figi
-                            )
-                            exchange = full_inst.instrument.exchange
-                        else:
-                            continue
-                        
-                        # MOEX futures can have exchange "forts_futures_weekend" or "MOEX"
-                        # Both are valid MOEX exchanges
-                        if exchange == "MOEX" or "forts" in exchange.lower() or "moex" in exchange.lower():
-                            figi = inst.figi
-                            # Cache FIGI in database
-                            if instrument:
-                                instrument.figi = figi
-                                instrument.exchange = "MOEX"  # Normalize to MOEX
-                                db.commit()
-                            else:
-                                # Create instrument record if it doesn't exist
-                                instrument = Instrument(
-                                    symbol=ticker,
-                                    type="equity",  # Keep as equity for now (futures are also equity-like)
-                                    exchange="MOEX",
-                                    figi=figi,
-                                    is_enabled=False
-                                )
-                                db.add(instrument)
-                                db.commit()
-                            
-                            logger.info(f"Cached FIGI {figi} for ticker {ticker} (type: {inst.instrument_type}, exchange: {exchange})")
-                            return figi
-                    except Exception as e:
-                        logger.warning(f"Could not verify exchange for {ticker} (FIGI: {inst.figi}, type: {inst.instrument_type}): {e}")
-                        continue
-                
-                # If we found instruments but couldn't verify exchange, try using first one anyway
-                # This handles cases where exchange name might be different (e.g., "forts_futures_weekend")
-                if found_instruments:
-                    logger.info(f"Using first found instrument for {ticker}: {found_instruments[0].figi} (type: {found_instruments[0].instrument_type})")
-                    figi = found_instruments[0].figi
-                    if instrument:
-                        instrument.figi = figi
-                        instrument.exchange = "MOEX"  # Normalize to MOEX
-                        db.commit()
-                    else:
-                        instrument = Instrument(
-                            symbol=ticker,
-                            type="equity",
-                            exchange="MOEX",
-                            figi=figi,
-                            is_enabled=False
-                        )
-                        db.add(instrument)
-                        db.commit()
-                    return figi
-                
-                logger.warning(f"Could not find MOEX instrument (share or future) for ticker: {ticker}")
+            client = self._get_client()
+            from tinkoff.invest.schemas import InstrumentIdType
+            
+            # Search for instrument
+            search_result = client.instruments.find_instrument(query=ticker)
+            
+            if not search_result.instruments:
+                logger.warning(f"No instruments found for ticker: {ticker}")
                 return None
-                
+            
+            # Find MOEX instruments (shares OR futures) with matching ticker
+            # Prefer BBG FIGI (Bloomberg) over TCS (Tinkoff internal)
+            # Note: Tinkoff API uses "futures" (plural) not "future" (singular)
+            found_instruments = []
+            for inst in search_result.instruments:
+                # Check for both shares and futures (note: Tinkoff uses "futures" plural)
+                if inst.ticker == ticker and inst.instrument_type in ["share", "future", "futures"]:
+                    found_instruments.append(inst)
+            
+            # Sort: prefer BBG FIGI
+            found_instruments.sort(key=lambda x: (not x.figi.startswith("BBG"), x.figi))
+            
+            for inst in found_instruments:
+                # Verify it's MOEX by getting full details
+                try:
+                    if inst.instrument_type == "share":
+                        full_inst = client.instruments.share_by(
+                            id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI,
+                            id=inst.figi
+                        )
+                        exchange = full_inst.instrument.exchange
+                    elif inst.instrument_type in ["future", "futures"]:
+                        # Tinkoff API uses "futures" (plural) for futures contracts
+                        full_inst = client.instruments.future_by(
+                            id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI,
+                            id=inst.figi
+                        )
+                        exchange = full_inst.instrument.exchange
+                    else:
+                        continue
+                    
+                    # MOEX futures can have exchange "forts_futures_weekend" or "MOEX"
+                    # Both are valid MOEX exchanges
+                    if exchange == "MOEX" or "forts" in exchange.lower() or "moex" in exchange.lower():
+                        figi = inst.figi
+                        # Cache FIGI in database
+                        self._store_figi(ticker, figi)
+                        
+                        logger.info(f"Cached FIGI {figi} for ticker {ticker} (type: {inst.instrument_type}, exchange: {exchange})")
+                        return figi
+                except Exception as e:
+                    logger.warning(f"Could not verify exchange for {ticker} (FIGI: {inst.figi}, type: {inst.instrument_type}): {e}")
+                    continue
+            
+            # If we found instruments but couldn't verify exchange, try using first one anyway
+            # This handles cases where exchange name might be different (e.g., "forts_futures_weekend")
+            if found_instruments:
+                logger.info(f"Using first found instrument for {ticker}: {found_instruments[0].figi} (type: {found_instruments[0].instrument_type})")
+                figi = found_instruments[0].figi
+                self._store_figi(ticker, figi)
+                return figi
+            
+            logger.warning(f"Could not find MOEX instrument (share or future) for ticker: {ticker}")
+            return None
+            
         except Exception as e:
             logger.error(f"Failed to get FIGI for {ticker}: {e}")
             return None
@@ -416,7 +667,8 @@ class TinkoffAdapter(DataAdapter):
         instrument: str,
         timeframe: str,
         limit: int = 500,
-        since: Optional[datetime] = None
+        since: Optional[datetime] = None,
+        db: Optional[SessionLocal] = None
     ) -> MarketData:
         """Fetch OHLCV data from Tinkoff API.
         
@@ -425,8 +677,12 @@ class TinkoffAdapter(DataAdapter):
             timeframe: Timeframe (M1, M5, M15, H1, D1)
             limit: Maximum number of candles
             since: Start datetime (optional)
+            db: Optional database session for the FIGI lookup. If None, creates a new one.
         """
-        db = SessionLocal()
+        if db is None:
+            with SessionLocal() as db:
+                return self.fetch_ohlcv(instrument, timeframe, limit, since, db)
+        
         try:
             # Get FIGI for ticker
             figi = self._get_figi_for_ticker(instrument, db)
@@ -439,66 +695,79 @@ class TinkoffAdapter(DataAdapter):
                 from_date = since
             else:
                 # Default: fetch last N days based on timeframe
-                days_map = {
-                    'M1': 1,   # 1 day for 1-minute candles
-                    'M5': 1,   # 1 day for 5-minute candles
-                    'M15': 3,  # 3 days for 15-minute candles
-                    'H1': 7,   # 7 days for hourly candles
-                    'D1': 365, # 1 year for daily candles
-                }
-                days = days_map.get(timeframe.upper(), 30)
+                days = _TINKOFF_HISTORY_DAYS.get(timeframe.upper(), 30)
                 from_date = to_date - timedelta(days=days)
             
             # Get candle interval
             candle_interval = self._normalize_timeframe(timeframe)
             
             # Fetch candles from Tinkoff
-            with self.Client(self.api_token) as client:
-                candles_response = client.market_data.get_candles(
-                    figi=figi,
-                    from_=from_date,
-                    to=to_date,
-                    interval=candle_interval
-                )
-                
-                if not candles_response.candles:
-                    raise ValueError(f"No candles returned for {instrument} (FIGI: {figi})")
-                
-                # Convert to normalized format
-                candles = []
-                for candle in candles_response.candles:
-                    # Tinkoff uses units.nano format for prices
-                    def convert_price(price_obj):
-                        if hasattr(price_obj, 'units') and hasattr(price_obj, 'nano'):
-                            return float(price_obj.units) + float(price_obj.nano) / 1e9
-                        return float(price_obj)
-                    
-                    candles.append(OHLCVCandle(
-                        timestamp=candle.time.replace(tzinfo=timezone.utc) if candle.time.tzinfo is None else candle.time,
-                        open=convert_price(candle.open),
-                        high=convert_price(candle.high),
-                        low=convert_price(candle.low),
-                        close=convert_price(candle.close),
-                        volume=candle.volume
-                    ))
-                
-                # Sort by timestamp (oldest first) to ensure correct order
-                candles.sort(key=lambda c: c.timestamp)
-                # Take last N candles (most recent)
-                candles = candles[-limit:] if len(candles) > limit else candles
-                
-                return MarketData(
-                    instrument=instrument,
-                    timeframe=timeframe,
-                    exchange="MOEX",
-                    candles=candles,
-                    fetched_at=datetime.now(timezone.utc)
+            client = self._get_client()
+            candles_response = self._call_with_backoff(
+                client.market_data.get_candles,
+                figi=figi,
+                from_=from_date,
+                to=to_date,
+                interval=candle_interval
+            )
+            
+            if not candles_response.candles:
+                raise ValueError(f"No candles returned for {instrument} (FIGI: {figi})")
+            
+            # Convert to normalized format. Tinkoff prices are Quotations
+            # (units + nano / 1e9): gather every units/nano pair in one pass,
+            # then convert them all at once
+            raw = candles_response.candles
+            # Candle times are UTC; the tz check is done once for the whole response
+            times = [c.time for c in raw]
+            if times[0].tzinfo is None:
+                times = [t.replace(tzinfo=timezone.utc) for t in times]
+            # Candles come back oldest first: keep the last N (most recent),
+            # sorting only if they are out of order
+            index = latest_index(np.fromiter((t.timestamp() for t in times), dtype=np.float64, count=len(times)), limit)
+            if isinstance(index, slice):
+                raw, times = raw[index], times[index]
+            else:
+                raw, times = [raw[i] for i in index.tolist()], [times[i] for i in index.tolist()]
+            quotes = np.array(
+                [
+                    (c.open.units, c.high.units, c.low.units, c.close.units,
+                     c.open.nano, c.high.nano, c.low.nano, c.close.nano)
+                    for c in raw
+                ],
+                dtype=np.int64,
+            )
+            prices = (quotes[:, :4] + quotes[:, 4:] / 1e9).tolist()
+            candles = [
+                OHLCVCandle.model_construct(
+                    timestamp=ts, open=o, high=h, low=l, close=c, volume=float(candle.volume),
                 )
-                
+                for candle, ts, (o, h, l, c) in zip(raw, times, prices)
+            ]
+            
+            return MarketData(
+                instrument=instrument,
+                timeframe=timeframe,
+                exchange="MOEX",
+                candles=candles,
+                fetched_at=to_date  # Request time, taken once above
+            )
+            
         except Exception as e:
             raise ValueError(f"Failed to fetch data from Tinkoff: {str(e)}")
-        finally:
-            db.close()
+
+
+@atexit.register
+def _close_tinkoff_clients():
+    """Close Tinkoff clients left open at interpreter exit."""
+    with _tinkoff_clients_lock:
+        entries = list(_tinkoff_clients.values())
+        _tinkoff_clients.clear()
+    for manager, _ in entries:
+        try:
+            manager.__exit__(None, None, None)
+        except Exception as e:
+            logger.warning(f"Error closing Tinkoff client: {e}")
 
 
 class DataService:
@@ -517,6 +786,7 @@ class DataService:
         # Get Tinkoff token if not provided
         if tinkoff_token is None:
             tinkoff_token = get_tinkoff_token(db)
+        self.tinkoff_token = tinkoff_token
         
         # Initialize Tinkoff adapter if token available
         if tinkoff_token:
@@ -527,71 +797,241 @@ class DataService:
                 self.tinkoff_adapter = None
         else:
             self.tinkoff_adapter = None
+
     
     def _get_cache_key(self, instrument: str, timeframe: str) -> str:
         """Generate cache key."""
-        key = f"{instrument}:{timeframe}"
-        return hashlib.md5(key.encode()).hexdigest()
+        return f"{instrument}:{timeframe}"
     
-    def _get_cached_data(self, cache_key: str, ttl_seconds: int = 300) -> Optional[MarketData]:
+    def _get_cached_data(
+        self,
+        cache_key: str,
+        ttl_seconds: int = 300,
+        db: Optional[SessionLocal] = None,
+        now: Optional[datetime] = None
+    ) -> Optional[MarketData]:
         """Get cached data if still valid."""
-        db = SessionLocal()
-        try:
-            cache_entry = db.query(DataCache).filter(DataCache.key == cache_key).first()
-            if cache_entry:
-                age = (datetime.now(timezone.utc) - cache_entry.fetched_at.replace(tzinfo=timezone.utc)).total_seconds()
-                if age < min(cache_entry.ttl_seconds, ttl_seconds):
-                    # Return cached data
-                    data_dict = json.loads(cache_entry.payload)
-                    # Convert datetime strings back to datetime objects
-                    data_dict['fetched_at'] = datetime.fromisoformat(data_dict['fetched_at'])
-                    for candle in data_dict['candles']:
-                        candle['timestamp'] = datetime.fromisoformat(candle['timestamp'])
-                    return MarketData(**data_dict)
-            return None
-        finally:
-            db.close()
+        if db is None:
+            with SessionLocal() as db:
+                return self._get_cached_data(cache_key, ttl_seconds, db, now)
+        
+        cache_entry = db.query(DataCache).filter(DataCache.key == cache_key).first()
+        if cache_entry:
+            age = ((now or datetime.now(timezone.utc)) - cache_entry.fetched_at.replace(tzinfo=timezone.utc)).total_seconds()
+            if age < min(cache_entry.ttl_seconds, ttl_seconds):
+                # Return cached data
+                data_dict = orjson.loads(cache_entry.payload)
+                rows = data_dict.get('rows')
+                if rows is None or any(None in row for row in rows):
+                    # Entry written in the old per-candle dict format, or with values
+                    # that were NaN when cached - refetch
+                    return None
+                # Values were validated before they were cached, so candles are
+                # rebuilt without validation; timestamps keep their UTC offsets
+                fromisoformat = datetime.fromisoformat
+                candles = [
+                    OHLCVCandle.model_construct(
+                        timestamp=fromisoformat(ts), open=o, high=h, low=l, close=c, volume=v,
+                    )
+                    for ts, o, h, l, c, v in rows
+                ]
+                return MarketData(
+                    instrument=data_dict['instrument'],
+                    timeframe=data_dict['timeframe'],
+                    exchange=data_dict['exchange'],
+                    candles=candles,
+                    fetched_at=fromisoformat(data_dict['fetched_at']),
+                )
+        return None
+    
+    def _lookup_cache(
+        self,
+        cache_key: str,
+        ttl_seconds: int,
+        db: Optional[SessionLocal] = None,
+        now: Optional[datetime] = None
+    ) -> Optional[MarketData]:
+        """Get cached data from memory, falling back to the DataCache table.
+        
+        Both tiers measure age against `now`, taken once by the caller (default:
+        the current time).
+        """
+        if now is None:
+            now = datetime.now(timezone.utc)
+        data = _get_memory(cache_key, ttl_seconds, now)
+        if data is None:
+            data = self._get_cached_data(cache_key, ttl_seconds, db, now)
+            if data is not None:
+                _put_memory(cache_key, data, ttl_seconds)
+        return data
     
-    def _cache_data(self, cache_key: str, data: MarketData, ttl_seconds: int = 300):
+    def _cache_data(
+        self,
+        cache_key: str,
+        data: MarketData,
+        ttl_seconds: int = 300,
+        db: Optional[SessionLocal] = None
+    ):
         """Cache market data."""
-        db = SessionLocal()
+        if db is None:
+            with SessionLocal() as db:
+                return self._cache_data(cache_key, data, ttl_seconds, db)
+        
+        # orjson writes datetimes as ISO 8601 strings itself
+        payload = orjson.dumps({
+            'instrument': data.instrument,
+            'timeframe': data.timeframe,
+            'exchange': data.exchange,
+            # One [timestamp, open, high, low, close, volume] row per candle
+            'rows': [
+                [c.timestamp, c.open, c.high, c.low, c.close, c.volume]
+                for c in data.candles
+            ],
+            'fetched_at': data.fetched_at
+        }).decode()
+        
+        # Update or create cache entry
+        cache_entry = db.query(DataCache).filter(DataCache.key == cache_key).first()
+        if cache_entry:
+            cache_entry.payload = payload
+            cache_entry.fetched_at = data.fetched_at
+            cache_entry.ttl_seconds = ttl_seconds
+        else:
+            # Age rows from the fetch time (UTC), like the memory tier
+            cache_entry = DataCache(
+                key=cache_key,
+                payload=payload,
+                fetched_at=data.fetched_at,
+                ttl_seconds=ttl_seconds
+            )
+            db.add(cache_entry)
+        
+        db.commit()
+    
+    def _select_adapter(self, instrument: str, db: Optional[SessionLocal] = None) -> DataAdapter:
+        """Pick the adapter for an instrument based on its exchange."""
+        route = _adapter_routes.get(instrument)
+        if route is not None and time.monotonic() - route[0] < _ADAPTER_ROUTE_TTL_SECONDS:
+            adapter = getattr(self, route[1])
+            if adapter is not None:
+                return adapter
+        
+        if db is None:
+            with SessionLocal() as db:
+                return self._select_adapter(instrument, db)
+        
+        # Check database to determine adapter based on exchange field
+        db_instrument = db.query(Instrument.exchange, Instrument.figi).filter(Instrument.symbol == instrument).first()
+        
+        if db_instrument and db_instrument.exchange == "MOEX":
+            # MOEX instrument - use Tinkoff adapter
+            if not hasattr(self, 'tinkoff_adapter') or self.tinkoff_adapter is None:
+                raise ValueError("Tinkoff adapter not initialized. Please configure Tinkoff API token in Settings → Tinkoff Invest API Configuration.")
+            if db_instrument.figi:
+                # Already have the FIGI, so TinkoffAdapter doesn't need to look it up again
+                with _figi_cache_lock:
+                    _figi_cache.setdefault(instrument, db_instrument.figi)
+            adapter_name = 'tinkoff_adapter'
+        elif '/' in instrument.upper() or instrument.upper().endswith('USDT'):
+            # Crypto
+            adapter_name = 'ccxt_adapter'
+        else:
+            # Equity (default to yfinance)
+            adapter_name = 'yfinance_adapter'
+        
+        with _adapter_routes_lock:
+            _adapter_routes[instrument] = (time.monotonic(), adapter_name)
+        return getattr(self, adapter_name)
+    
+    def _store(
+        self,
+        instrument: str,
+        timeframe: str,
+        data: MarketData,
+        cache_ttl: int,
+        db: Optional[SessionLocal] = None
+    ) -> None:
+        """Put freshly fetched data into both cache tiers."""
+        cache_key = self._get_cache_key(instrument, timeframe)
+        _put_memory(cache_key, data, cache_ttl)
+        self._cache_data(cache_key, data, cache_ttl, db)
+    
+    def _fetch_and_cache(
+        self,
+        instrument: str,
+        timeframe: str,
+        use_cache: bool,
+        cache_ttl: int,
+        adapter: Optional[DataAdapter] = None,
+        db: Optional[SessionLocal] = None
+    ) -> MarketData:
+        """Fetch market data from its adapter, bypassing the cache lookup.
+        
+        Routing, the FIGI lookup and the cache write share one database session.
+        If the same pair is already being fetched, waits for and returns that result
+        (or error) instead of making a second request.
+        """
+        if db is None:
+            with SessionLocal() as db:
+                return self._fetch_and_cache(instrument, timeframe, use_cache, cache_ttl, adapter, db)
+        
+        if adapter is None:
+            adapter = self._select_adapter(instrument, db)
+        # End the read transaction so its connection goes back to the pool during the fetch
+        db.commit()
+        
+        cache_key = self._get_cache_key(instrument, timeframe)
+        with _inflight_lock:
+            inflight = _inflight.get(cache_key)
+            if inflight is None:
+                _inflight[cache_key] = future = Future()
+        if inflight is not None:
+            return inflight.result()
+        
         try:
-            # Convert to JSON-serializable format
-            data_dict = {
-                'instrument': data.instrument,
-                'timeframe': data.timeframe,
-                'exchange': data.exchange,
-                'candles': [
-                    {
-                        'timestamp': c.timestamp.isoformat(),
-                        'open': c.open,
-                        'high': c.high,
-                        'low': c.low,
-                        'close': c.close,
-                        'volume': c.volume
-                    }
-                    for c in data.candles
-                ],
-                'fetched_at': data.fetched_at.isoformat()
-            }
-            
-            # Update or create cache entry
-            cache_entry = db.query(DataCache).filter(DataCache.key == cache_key).first()
-            if cache_entry:
-                cache_entry.payload = json.dumps(data_dict)
-                cache_entry.fetched_at = datetime.now(timezone.utc)
-                cache_entry.ttl_seconds = ttl_seconds
-            else:
-                cache_entry = DataCache(
-                    key=cache_key,
-                    payload=json.dumps(data_dict),
-                    ttl_seconds=ttl_seconds
-                )
-                db.add(cache_entry)
+            # Fetch data
+            with adapter.fetch_slots:
+                if adapter is self.tinkoff_adapter:
+                    data = adapter.fetch_ohlcv(instrument, timeframe, limit=500, db=db)
+                else:
+                    data = adapter.fetch_ohlcv(instrument, timeframe, limit=500)
             
-            db.commit()
+            # Cache it
+            if use_cache:
+                self._store(instrument, timeframe, data, cache_ttl, db)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(data)
         finally:
-            db.close()
+            with _inflight_lock:
+                del _inflight[cache_key]
+        
+        return data
+    
+    def _fetch_yfinance_batch(
+        self,
+        instruments: List[str],
+        timeframe: str,
+        use_cache: bool,
+        cache_ttl: int
+    ) -> Dict[Tuple[str, str], MarketData]:
+        """Fetch several yfinance instruments on one timeframe with batched downloads."""
+        with self.yfinance_adapter.fetch_slots:
+            batch = self.yfinance_adapter.fetch_ohlcv_batch(instruments, timeframe, limit=500)
+        
+        results = {}
+        with SessionLocal() as db:
+            for instrument, data in batch.items():
+                if use_cache:
+                    self._store(instrument, timeframe, data, cache_ttl, db)
+                results[(instrument, timeframe)] = data
+        
+        missing = [instrument for instrument in instruments if instrument not in batch]
+        if missing:
+            logger.error(f"No yfinance data for {', '.join(missing)} ({timeframe})")
+        return results
     
     def fetch_market_data(
         self,
@@ -608,40 +1048,145 @@ class DataService:
             use_cache: Whether to use cache
             cache_ttl: Cache TTL in seconds (default 5 minutes)
         """
-        cache_key = self._get_cache_key(instrument, timeframe)
+        # One session for the cache lookup, routing, FIGI lookup and cache write
+        with SessionLocal() as db:
+            # Try cache first
+            if use_cache:
+                cached = self._lookup_cache(self._get_cache_key(instrument, timeframe), cache_ttl, db)
+                if cached:
+                    return cached
+            
+            return self._fetch_and_cache(instrument, timeframe, use_cache, cache_ttl, db=db)
+    
+    def fetch_many(
+        self,
+        requests: List[Tuple[str, str]],
+        max_workers: int = 8,
+        use_cache: bool = True,
+        cache_ttl: int = 300,
+        timeout: Optional[float] = None
+    ) -> Dict[Tuple[str, str], MarketData]:
+        """Fetch market data for several instruments concurrently.
         
-        # Try cache first
-        if use_cache:
-            cached = self._get_cached_data(cache_key, cache_ttl)
-            if cached:
-                return cached
+        Cached pairs are returned without going through the thread pool. Misses are
+        fetched in parallel (the work is network-bound), with each adapter's
+        fetch_slots limiting how many requests hit one provider at a time. yfinance
+        instruments on the same timeframe share batched downloads.
         
-        # Check database to determine adapter based on exchange field
-        db = SessionLocal()
-        try:
-            from app.models.instrument import Instrument
-            db_instrument = db.query(Instrument).filter(Instrument.symbol == instrument).first()
+        Args:
+            requests: (instrument, timeframe) pairs; duplicates are fetched once
+            max_workers: Maximum number of concurrent fetches
+            use_cache: Whether to use cache
+            cache_ttl: Cache TTL in seconds (default 5 minutes)
+            timeout: Optional time limit in seconds for all uncached fetches
+        
+        Returns:
+            Market data keyed by (instrument, timeframe). Pairs that failed or did not
+            finish within the timeout are logged and left out.
+        """
+        results: Dict[Tuple[str, str], MarketData] = {}
+        misses = []
+        jobs = []
+        yfinance_groups: Dict[str, List[str]] = {}
+        now = datetime.now(timezone.utc)
+        # Cache lookups and routing share one session; each fetch job opens its own
+        with SessionLocal() as db:
+            for pair in dict.fromkeys(requests):
+                if use_cache:
+                    cached = self._lookup_cache(self._get_cache_key(*pair), cache_ttl, db, now)
+                    if cached:
+                        results[pair] = cached
+                        continue
+                misses.append(pair)
             
-            if db_instrument and db_instrument.exchange == "MOEX":
-                # MOEX instrument - use Tinkoff adapter
-                if not hasattr(self, 'tinkoff_adapter') or self.tinkoff_adapter is None:
-                    raise ValueError("Tinkoff adapter not initialized. Please configure Tinkoff API token in Settings → Tinkoff Invest API Configuration.")
-                adapter = self.tinkoff_adapter
-            elif '/' in instrument.upper() or instrument.upper().endswith('USDT'):
-                # Crypto
-                adapter = self.ccxt_adapter
+            # Route misses up front so yfinance instruments sharing a timeframe can be
+            # downloaded together
+            for instrument, timeframe in misses:
+                try:
+                    adapter = self._select_adapter(instrument, db)
+                except Exception as e:
+                    logger.error(f"Failed to fetch market data for {instrument} {timeframe}: {e}")
+                    continue
+                if adapter is self.yfinance_adapter:
+                    yfinance_groups.setdefault(timeframe, []).append(instrument)
+                else:
+                    jobs.append((
+                        [(instrument, timeframe)],
+                        self._fetch_and_cache, (instrument, timeframe, use_cache, cache_ttl, adapter),
+                    ))
+        for timeframe, instruments in yfinance_groups.items():
+            if len(instruments) > 1:
+                jobs.append((
+                    [(instrument, timeframe) for instrument in instruments],
+                    self._fetch_yfinance_batch, (instruments, timeframe, use_cache, cache_ttl),
+                ))
             else:
-                # Equity (default to yfinance)
-                adapter = self.yfinance_adapter
-        finally:
-            db.close()
+                jobs.append((
+                    [(instruments[0], timeframe)],
+                    self._fetch_and_cache, (instruments[0], timeframe, use_cache, cache_ttl, self.yfinance_adapter),
+                ))
         
-        # Fetch data
-        data = adapter.fetch_ohlcv(instrument, timeframe, limit=500)
+        if not jobs:
+            return results
         
-        # Cache it
-        if use_cache:
-            self._cache_data(cache_key, data, cache_ttl)
+        pool = ThreadPoolExecutor(max_workers=min(max_workers, len(jobs)))
+        futures = {pool.submit(fetch, *args): pairs for pairs, fetch, args in jobs}
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                pairs = futures[future]
+                try:
+                    data = future.result()
+                except Exception as e:
+                    names = ", ".join(f"{instrument} {timeframe}" for instrument, timeframe in pairs)
+                    logger.error(f"Failed to fetch market data for {names}: {e}")
+                    continue
+                if isinstance(data, MarketData):
+                    results[pairs[0]] = data
+                else:
+                    results.update(data)
+        except FuturesTimeoutError:
+            pending = [
+                f"{instrument} {timeframe}"
+                for future, pairs in futures.items() if not future.done()
+                for instrument, timeframe in pairs
+            ]
+            logger.error(f"Timed out fetching market data for: {', '.join(pending)}")
+        finally:
+            # Don't wait for stragglers after a timeout
+            pool.shutdown(wait=False, cancel_futures=True)
         
-        return data
+        return results
+
+
+# Process-wide DataService returned by get_data_service()
+_data_service: Optional[DataService] = None
+_data_service_lock = threading.Lock()
 
+
+def get_data_service(db: Optional[SessionLocal] = None) -> DataService:
+    """Get the process-wide DataService, creating it on first use.
+    
+    Sharing one service keeps its adapter routes warm across requests. The
+    service is rebuilt when the Tinkoff token in Settings changes, so a new token
+    takes effect without a restart.
+    
+    Args:
+        db: Optional database session for loading the Tinkoff token from Settings
+    """
+    global _data_service
+    tinkoff_token = get_tinkoff_token(db)
+    service = _data_service
+    if service is None or service.tinkoff_token != tinkoff_token:
+        replaced = None
+        with _data_service_lock:
+            service = _data_service
+            if service is None or service.tinkoff_token != tinkoff_token:
+                replaced = service
+                service = _data_service = DataService(tinkoff_token=tinkoff_token, db=db)
+        # The old token's client would otherwise keep its gRPC channel open until exit
+        if replaced is not None and replaced.tinkoff_adapter is not None:
+            try:
+                replaced.tinkoff_adapter.close()
+            except Exception as e:
+                logger.warning(f"Error closing Tinkoff client: {e}")
+    return service
@@ -1,9 +1,59 @@
 """
 Normalized data structures for market data.
 """
-from datetime import datetime
-from typing import List, Optional
-from pydantic import BaseModel
+import heapq
+from datetime import datetime, timezone
+from functools import cached_property
+from operator import attrgetter
+from typing import Callable, Dict, List, Optional, Sequence, Union
+import numpy as np
+from pydantic import BaseModel, PrivateAttr
+
+
+_BY_TIMESTAMP = attrgetter("timestamp")
+_PRICE_FIELDS = ("open", "high", "low", "close", "volume")
+
+
+def _is_sorted(candles: List["OHLCVCandle"]) -> bool:
+    return all(a.timestamp <= b.timestamp for a, b in zip(candles, candles[1:]))
+
+
+def candles_to_arrays(
+    candles: List["OHLCVCandle"], fields: Sequence[str] = _PRICE_FIELDS
+) -> Dict[str, np.ndarray]:
+    """Column (SoA) view of candles: float64 arrays keyed by field name.
+    
+    Args:
+        candles: Candles to convert
+        fields: Price fields to extract (default: open/high/low/close/volume)
+    """
+    count = len(candles)
+    return {
+        field: np.fromiter(map(attrgetter(field), candles), dtype=np.float64, count=count)
+        for field in fields
+    }
+
+
+def latest_index(timestamps: np.ndarray, limit: Optional[int] = None) -> Union[slice, np.ndarray]:
+    """Index selecting the last `limit` entries of a series in timestamp order.
+    
+    Providers return candles oldest first, so this is normally a plain slice after
+    an O(n) order check; only out-of-order input is argsorted.
+    
+    Args:
+        timestamps: Timestamp array (any numeric or datetime64 dtype)
+        limit: Number of most recent entries to keep (None keeps all)
+    """
+    start = -limit if limit is not None else None
+    if np.all(timestamps[:-1] <= timestamps[1:]):
+        return slice(start, None)
+    return np.argsort(timestamps, kind="stable")[start:]
+
+
+def _timestamps_ms(candles: List["OHLCVCandle"]) -> np.ndarray:
+    """Candle timestamps as int64 milliseconds since the epoch (UTC)."""
+    seconds = np.fromiter((c.timestamp.timestamp() for c in candles), dtype=np.float64, count=len(candles))
+    return np.round(seconds * 1000).astype(np.int64)
 
 
 class OHLCVCandle(BaseModel):
@@ -23,4 +73,132 @@ class MarketData(BaseModel):
     exchange: Optional[str] = None
     candles: List[OHLCVCandle]
     fetched_at: datetime
-
+    
+    # Rendered candle lines per renderer, shared by every step that reads this data
+    _formatted_lines: Dict[Callable, List[str]] = PrivateAttr(default_factory=dict)
+    
+    @classmethod
+    def from_ohlcv_rows(
+        cls,
+        instrument: str,
+        timeframe: str,
+        exchange: Optional[str],
+        rows: Sequence[Sequence[float]],
+        limit: Optional[int] = None,
+    ) -> "MarketData":
+        """Build market data from [timestamp_ms, open, high, low, close, volume] rows.
+        
+        This is the layout CCXT returns. The rows are converted to a float64 matrix
+        in one pass, so candles are built from already coerced columns without
+        per-field validation. Candles come out oldest first, keeping the last
+        `limit` rows if given.
+        
+        Raises:
+            ValueError: If a row has a missing price or volume
+        """
+        if not len(rows):
+            return cls(
+                instrument=instrument,
+                timeframe=timeframe,
+                exchange=exchange,
+                candles=[],
+                fetched_at=datetime.now(timezone.utc),
+            )
+        
+        matrix = np.asarray(rows, dtype=np.float64)
+        matrix = matrix[latest_index(matrix[:, 0], limit)]
+        prices = matrix[:, 1:6]
+        if np.isnan(prices).any():
+            raise ValueError(f"Incomplete candles returned for {instrument}")
+        candles = [
+            OHLCVCandle.model_construct(
+                timestamp=datetime.fromtimestamp(ms / 1000, tz=timezone.utc),
+                open=o, high=h, low=l, close=c, volume=v,
+            )
+            for ms, (o, h, l, c, v) in zip(matrix[:, 0].tolist(), prices.tolist())
+        ]
+        data = cls(
+            instrument=instrument,
+            timeframe=timeframe,
+            exchange=exchange,
+            candles=candles,
+            fetched_at=datetime.now(timezone.utc),
+        )
+        # The candles are ordered and the matrix already holds them column-wise, so
+        # seed sorted_candles and the SoA view instead of rebuilding them from objects
+        data.__dict__["sorted_candles"] = candles
+        ts_ms = np.round(matrix[:, 0]).astype(np.int64)
+        data.__dict__["ts_ms"] = ts_ms
+        columns = {field: np.ascontiguousarray(matrix[:, i]) for i, field in enumerate(_PRICE_FIELDS, start=1)}
+        columns["timestamp"] = ts_ms.view("datetime64[ms]")
+        data.__dict__["columns"] = columns
+        return data
+    
+    @cached_property
+    def ts_ms(self) -> np.ndarray:
+        """Timestamps of sorted_candles as int64 milliseconds since the epoch (UTC).
+        
+        Use this for binning, diffs and windows instead of datetime arithmetic on
+        candles. Candle datetimes are kept for display, since they carry the
+        exchange's UTC offset.
+        """
+        return _timestamps_ms(self.sorted_candles)
+    
+    @cached_property
+    def columns(self) -> Dict[str, np.ndarray]:
+        """Column (SoA) view of sorted_candles, computed once per instance.
+        
+        Holds float64 arrays for open/high/low/close/volume and a "timestamp"
+        datetime64[ms] array (UTC, a view of ts_ms), for vectorized indicator code.
+        """
+        columns = candles_to_arrays(self.sorted_candles)
+        columns["timestamp"] = self.ts_ms.view("datetime64[ms]")
+        return columns
+    
+    @cached_property
+    def sorted_candles(self) -> List[OHLCVCandle]:
+        """Candles ordered by timestamp (oldest first), computed once per instance.
+        
+        Adapters already return candles in order, so the sort is skipped when the
+        list is sorted.
+        """
+        candles = self.candles
+        if _is_sorted(candles):
+            return candles
+        return sorted(candles, key=_BY_TIMESTAMP)
+    
+    def last_candles(self, n: int) -> List[OHLCVCandle]:
+        """Return the n most recent candles, oldest first (slice semantics of [-n:]).
+        
+        When the history is out of order and only a small tail is needed, the tail
+        is selected with heapq instead of sorting the whole list.
+        """
+        if n > 0 and "sorted_candles" not in self.__dict__ and n * 4 < len(self.candles):
+            candles = self.candles
+            if not _is_sorted(candles):
+                tail = heapq.nlargest(n, candles, key=_BY_TIMESTAMP)
+                tail.reverse()
+                return tail
+            # Already in order - remember that so later calls just slice
+            self.__dict__["sorted_candles"] = candles
+        return self.sorted_candles[-n:]
+    
+    def formatted_tail(self, n: int, render: Callable[[List[OHLCVCandle]], List[str]]) -> List[str]:
+        """Return render(self.last_candles(n)), rendering each candle at most once per renderer.
+        
+        Lines are kept for the longest tail rendered so far, so steps asking for the
+        same or fewer candles get a slice of the already formatted lines. A longer
+        request only renders the older candles that are missing. Candles are sliced
+        before they reach ``render``, so per-candle arithmetic never runs over the
+        full history.
+        """
+        needed = len(range(len(self.candles))[-n:])
+        lines = self._formatted_lines.get(render)
+        if lines is None:
+            lines = render(self.last_candles(n))
+            self._formatted_lines[render] = lines
+        elif len(lines) < needed:
+            missing = self.last_candles(needed)[:needed - len(lines)]
+            lines = render(missing) + lines
+            self._formatted_lines[render] = lines
+        return lines[len(lines) - needed:]
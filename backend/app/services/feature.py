@@ -7,8 +7,16 @@ Simplified Model:
 - When user works in an org → they get the org owner's features
 - Organization features table is used as cache/denormalization (synced from owner)
 """
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 from datetime import datetime, timezone
+import threading
+import time
 from app.models.user import User
 from app.models.user_feature import UserFeature
 from app.models.organization_feature import OrganizationFeature
@@ -25,6 +33,57 @@ FEATURES = {
     'webhooks': 'Webhooks',
 }
 
+# (user_id, organization_id) -> effective features for the current request or job.
+# None outside feature_cache_scope(), in which case every lookup hits the database.
+_effective_features_cache: ContextVar[dict | None] = ContextVar("effective_features_cache", default=None)
+
+# Process-wide cache of get_organization_features: organization_id -> (version,
+# cached_at, features). Writes in this process bump the org's version, which
+# retires its entry (and any result computed concurrently with the write); the TTL
+# bounds how long other worker processes can serve an entry after a change.
+_ORG_FEATURES_TTL_SECONDS = 60
+_org_features_cache: dict[int, tuple[int, float, dict[str, bool]]] = {}
+_org_features_versions: dict[int, int] = {}
+_org_features_lock = threading.Lock()
+
+
+@contextmanager
+def feature_cache_scope():
+    """
+    Cache get_effective_features results for the duration of a request or job.
+    Usable as a context manager or decorator. set_user_feature clears the cache.
+    """
+    token = _effective_features_cache.set({})
+    try:
+        yield
+    finally:
+        _effective_features_cache.reset(token)
+
+
+def _upsert(db: Session, model, rows: list[dict], key_columns: tuple[str, ...], update_columns: tuple[str, ...]):
+    """
+    Insert rows, updating update_columns (and updated_at) where a row with the
+    same unique key_columns already exists. One atomic statement: ON DUPLICATE
+    KEY UPDATE on MySQL, ON CONFLICT DO UPDATE on PostgreSQL and SQLite.
+    """
+    if not rows:
+        return
+    
+    dialect_name = db.get_bind().dialect.name
+    if dialect_name == "mysql":
+        stmt = mysql_insert(model).values(rows)
+        updates = {column: stmt.inserted[column] for column in update_columns}
+        updates["updated_at"] = func.now()
+        stmt = stmt.on_duplicate_key_update(updates)
+    else:
+        insert = postgresql_insert if dialect_name == "postgresql" else sqlite_insert
+        stmt = insert(model).values(rows)
+        updates = {column: stmt.excluded[column] for column in update_columns}
+        updates["updated_at"] = func.now()
+        stmt = stmt.on_conflict_do_update(index_elements=list(key_columns), set_=updates)
+    db.execute(stmt)
+
+
 def get_user_features(db: Session, user_id: int) -> dict[str, bool]:
     """
     Get all features for a user.
@@ -35,7 +94,11 @@ def get_user_features(db: Session, user_id: int) -> dict[str, bool]:
     features = db.query(UserFeature).filter(
         UserFeature.user_id == user_id
     ).all()
-    
+    return _resolve_user_features(features)
+
+
+def _resolve_user_features(features: list[UserFeature]) -> dict[str, bool]:
+    """Map a user's UserFeature rows to feature_name -> enabled (see get_user_features)."""
     result = {}
     now = datetime.now(timezone.utc)
     
@@ -54,6 +117,16 @@ def get_user_features(db: Session, user_id: int) -> dict[str, bool]:
     return result
 
 
+def invalidate_organization_features(*organization_ids: int):
+    """
+    Drop cached features for organizations whose owner or owner's features changed.
+    """
+    with _org_features_lock:
+        for organization_id in organization_ids:
+            _org_features_versions[organization_id] = _org_features_versions.get(organization_id, 0) + 1
+            _org_features_cache.pop(organization_id, None)
+
+
 def get_organization_features(db: Session, organization_id: int) -> dict[str, bool]:
     """
     Get features for an organization (derived from owner's features).
@@ -62,7 +135,27 @@ def get_organization_features(db: Session, organization_id: int) -> dict[str, bo
     Logic: Organization features = owner's user features
     Uses organization_features table as cache/denormalization.
     If cache is stale, syncs from owner.
+    
+    Results are also kept in a process-wide cache for up to
+    _ORG_FEATURES_TTL_SECONDS (see invalidate_organization_features).
     """
+    now = time.monotonic()
+    with _org_features_lock:
+        version = _org_features_versions.get(organization_id, 0)
+        entry = _org_features_cache.get(organization_id)
+    if entry and entry[0] == version and now - entry[1] < _ORG_FEATURES_TTL_SECONDS:
+        return dict(entry[2])
+    
+    features = _load_organization_features(db, organization_id)
+    with _org_features_lock:
+        # Skip storing if a write invalidated the org while we were reading
+        if _org_features_versions.get(organization_id, 0) == version:
+            _org_features_cache[organization_id] = (version, now, dict(features))
+    return features
+
+
+def _load_organization_features(db: Session, organization_id: int) -> dict[str, bool]:
+    """Resolve organization features from the database (see get_organization_features)."""
     organization = db.query(Organization).filter(Organization.id == organization_id).first()
     if not organization:
         # Return all False if org doesn't exist
@@ -86,40 +179,45 @@ def sync_organization_features_from_owner(db: Session, organization_id: int, own
     """
     Sync organization features from owner's user features.
     This keeps organization_features table as a cache/denormalization.
+    
+    Loads the owner's feature rows with one query and upserts the org rows.
     """
-    owner_features = get_user_features(db, owner_id)
-    
-    for feature_name, enabled in owner_features.items():
-        # Get or create org feature record
-        org_feature = db.query(OrganizationFeature).filter(
-            OrganizationFeature.organization_id == organization_id,
-            OrganizationFeature.feature_name == feature_name
-        ).first()
-        
-        if org_feature:
-            org_feature.enabled = enabled
-            # Keep expiration from user feature if exists
-            user_feature = db.query(UserFeature).filter(
-                UserFeature.user_id == owner_id,
-                UserFeature.feature_name == feature_name
-            ).first()
-            if user_feature:
-                org_feature.expires_at = user_feature.expires_at
-        else:
-            # Get user feature to copy expiration
-            user_feature = db.query(UserFeature).filter(
-                UserFeature.user_id == owner_id,
-                UserFeature.feature_name == feature_name
-            ).first()
-            
-            org_feature = OrganizationFeature(
-                organization_id=organization_id,
-                feature_name=feature_name,
-                enabled=enabled,
-                expires_at=user_feature.expires_at if user_feature else None
-            )
-            db.add(org_feature)
+    _sync_organizations_from_owner(db, [organization_id], owner_id)
+
+
+def _sync_organizations_from_owner(db: Session, organization_ids: list[int], owner_id: int):
+    """
+    Sync the features of several organizations owned by the same user.
+    Owner features are loaded once for all of them, org rows are written with
+    upserts, and everything is committed together.
+    """
+    if not organization_ids:
+        return
+    
+    user_features = {
+        feature.feature_name: feature
+        for feature in db.query(UserFeature).filter(UserFeature.user_id == owner_id).all()
+    }
+    owner_features = _resolve_user_features(list(user_features.values()))
     
+    # Copy expiration from the user feature if it exists. Features the owner has no
+    # row for keep the expiration already stored on the org row.
+    with_expiration = []
+    without_expiration = []
+    for organization_id in organization_ids:
+        for feature_name, enabled in owner_features.items():
+            user_feature = user_features.get(feature_name)
+            row = {
+                "organization_id": organization_id,
+                "feature_name": feature_name,
+                "enabled": enabled,
+                "expires_at": user_feature.expires_at if user_feature else None,
+            }
+            (with_expiration if user_feature else without_expiration).append(row)
+    
+    key_columns = ("organization_id", "feature_name")
+    _upsert(db, OrganizationFeature, with_expiration, key_columns, ("enabled", "expires_at"))
+    _upsert(db, OrganizationFeature, without_expiration, key_columns, ("enabled",))
     db.commit()
 
 
@@ -139,8 +237,17 @@ def get_effective_features(db: Session, user_id: int, organization_id: int) -> d
     
     This means: When Jerry is invited to Tom's workspace, Jerry gets access to all features
     that Tom (the org owner) has enabled.
+    
+    Inside feature_cache_scope() the result is computed once per (user, org).
     """
+    cache = _effective_features_cache.get()
+    key = (user_id, organization_id)
+    if cache is not None and key in cache:
+        return dict(cache[key])
+    
     org_features = get_organization_features(db, organization_id)
+    if cache is not None:
+        cache[key] = dict(org_features)
     return org_features
 
 
@@ -171,30 +278,29 @@ def set_user_feature(
     if feature_name not in FEATURES:
         raise ValueError(f"Unknown feature: {feature_name}")
     
+    _upsert(
+        db,
+        UserFeature,
+        [{"user_id": user_id, "feature_name": feature_name, "enabled": enabled, "expires_at": expires_at}],
+        ("user_id", "feature_name"),
+        ("enabled", "expires_at"),
+    )
+    db.commit()
+    
+    # The owner's change affects every org they own and its members
+    cache = _effective_features_cache.get()
+    if cache is not None:
+        cache.clear()
+    
     feature = db.query(UserFeature).filter(
         UserFeature.user_id == user_id,
         UserFeature.feature_name == feature_name
-    ).first()
-    
-    if feature:
-        feature.enabled = enabled
-        feature.expires_at = expires_at
-    else:
-        feature = UserFeature(
-            user_id=user_id,
-            feature_name=feature_name,
-            enabled=enabled,
-            expires_at=expires_at
-        )
-        db.add(feature)
-    
-    db.commit()
-    db.refresh(feature)
+    ).one()
     
     # Sync to all organizations owned by this user
-    user_orgs = db.query(Organization).filter(Organization.owner_id == user_id).all()
-    for org in user_orgs:
-        sync_organization_features_from_owner(db, org.id, user_id)
+    org_ids = [org_id for (org_id,) in db.query(Organization.id).filter(Organization.owner_id == user_id).all()]
+    _sync_organizations_from_owner(db, org_ids, user_id)
+    invalidate_organization_features(*org_ids)
     
     return feature
 
@@ -0,0 +1,80 @@
+"""
+In-process cache of LLM responses keyed by the exact request.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LLMResponseCache:
+    """Bounded, thread-safe exact-match cache of LLMClient.call() results.
+
+    Entries expire after ttl_seconds; when full, the least recently used entry
+    is evicted.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 900.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        system_prompt: str,
+        user_prompt: str,
+        model: Optional[str],
+        temperature: float,
+        max_tokens: Optional[int],
+        organization_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+    ) -> str:
+        """Digest identifying an LLM request (prompts plus generation settings).
+
+        The requesting organization and user are part of the key so a cached answer
+        is never served across tenants.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (
+            repr(organization_id), repr(user_id),
+            model or "", repr(temperature), repr(max_tokens), system_prompt, user_prompt,
+        ):
+            encoded = part.encode("utf-8")
+            # Length prefix keeps field boundaries unambiguous
+            digest.update(len(encoded).to_bytes(8, "little"))
+            digest.update(encoded)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached result for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, result = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return dict(result)
+
+    def set(self, key: str, result: Dict[str, Any]) -> None:
+        """Store a copy of an LLM call result under key."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), dict(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by all analysis steps in this process
+llm_response_cache = LLMResponseCache()
@@ -94,11 +94,21 @@ class LLMClient:
         """
         model = model or self.default_model
         
+        # Anthropic models only reuse a cached prompt prefix up to an explicit
+        # cache_control breakpoint (OpenRouter passes it through); other providers
+        # cache identical prefixes automatically
+        if model.startswith("anthropic/"):
+            system_content: Any = [
+                {"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}},
+            ]
+        else:
+            system_content = system_prompt
+        
         try:
             response = self.client.chat.completions.create(
                 model=model,
                 messages=[
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": system_content},
                     {"role": "user", "content": user_prompt},
                 ],
                 temperature=temperature,
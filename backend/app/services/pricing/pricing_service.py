@@ -14,6 +14,10 @@ from app.core.config import EXCHANGE_RATE_USD_TO_RUB
 from app.services.pricing.pricing_models import ModelPricing, PricingCalculation
 
 
+# The rate is a static config value, so it is converted to Decimal once at import
+_EXCHANGE_RATE = Decimal(str(EXCHANGE_RATE_USD_TO_RUB))
+
+
 def get_exchange_rate() -> Decimal:
     """
     Get exchange rate from config.
@@ -21,7 +25,7 @@ def get_exchange_rate() -> Decimal:
     Returns:
         Exchange rate (USD to RUB) as Decimal
     """
-    return Decimal(str(EXCHANGE_RATE_USD_TO_RUB))
+    return _EXCHANGE_RATE
 
 
 def get_model_pricing(db: Session, model_name: str, provider: str) -> Optional[ModelPricing]:
@@ -115,7 +115,8 @@ class EmbeddingService:
                         user_id=user_id,
                         organization_id=organization_id,
                         amount=total_tokens,
-                        source_type="subscription"  # Default to subscription, will fall back to balance if needed
+                        source_type="subscription",  # Default to subscription, will fall back to balance if needed
+                        commit=False  # Committed together with the consumption record below
                     )
                     
                     if not charge_result.success:
@@ -125,26 +126,34 @@ class EmbeddingService:
                     # Determine source type from charge result
                     source_type = "subscription" if charge_result.source == "subscription" else "balance"
                     
-                    # Record consumption
-                    record_consumption(
-                        db=db,
-                        user_id=user_id,
-                        organization_id=organization_id,
-                        model_name=model,
-                        provider=provider,
-                        input_tokens=total_tokens,
-                        output_tokens=0,  # Embeddings don't have output tokens
-                        run_id=None,
-                        step_id=None,
-                        rag_query_id=None,
-                        source_type=source_type,
-                        source_name=source_name
-                    )
-                    
-                    logger.info(f"Recorded token consumption for embedding: {total_tokens} tokens, source: {source_type}")
+                    # Record consumption in a savepoint, so a failure (e.g. no pricing for the
+                    # model) doesn't discard the charge
+                    try:
+                        with db.begin_nested():
+                            record_consumption(
+                                db=db,
+                                user_id=user_id,
+                                organization_id=organization_id,
+                                model_name=model,
+                                provider=provider,
+                                input_tokens=total_tokens,
+                                output_tokens=0,  # Embeddings don't have output tokens
+                                run_id=None,
+                                step_id=None,
+                                rag_query_id=None,
+                                source_type=source_type,
+                                source_name=source_name,
+                                commit=False
+                            )
+                        logger.info(f"Recorded token consumption for embedding: {total_tokens} tokens, source: {source_type}")
+                    except Exception as e:
+                        logger.error(f"Failed to record token consumption for embedding: {e}")
+                    db.commit()
                     
                 except Exception as e:
                     logger.error(f"Failed to track token consumption for embedding: {e}")
+                    # Drop a partially applied charge so its row locks are released
+                    db.rollback()
                     # Don't fail the embedding generation if consumption tracking fails
             
             return embedding
@@ -260,7 +269,8 @@ class EmbeddingService:
                     user_id=user_id,
                     organization_id=organization_id,
                     amount=total_tokens,
-                    source_type="subscription"  # Default to subscription, will fall back to balance if needed
+                    source_type="subscription",  # Default to subscription, will fall back to balance if needed
+                    commit=False  # Committed together with the consumption record below
                 )
                 
                 if not charge_result.success:
@@ -270,26 +280,34 @@ class EmbeddingService:
                 # Determine source type from charge result
                 source_type = "subscription" if charge_result.source == "subscription" else "balance"
                 
-                # Record consumption
-                record_consumption(
-                    db=db,
-                    user_id=user_id,
-                    organization_id=organization_id,
-                    model_name=model,
-                    provider=provider,
-                    input_tokens=total_input_tokens,
-                    output_tokens=0,  # Embeddings don't have output tokens
-                    run_id=None,
-                    step_id=None,
-                    rag_query_id=None,  # Could be set to doc_id if we track it
-                    source_type=source_type,
-                    source_name=source_name
-                )
-                
-                logger.info(f"Recorded token consumption for embedding: {total_tokens} tokens, source: {source_type}")
+                # Record consumption in a savepoint, so a failure (e.g. no pricing for the
+                # model) doesn't discard the charge
+                try:
+                    with db.begin_nested():
+                        record_consumption(
+                            db=db,
+                            user_id=user_id,
+                            organization_id=organization_id,
+                            model_name=model,
+                            provider=provider,
+                            input_tokens=total_input_tokens,
+                            output_tokens=0,  # Embeddings don't have output tokens
+                            run_id=None,
+                            step_id=None,
+                            rag_query_id=None,  # Could be set to doc_id if we track it
+                            source_type=source_type,
+                            source_name=source_name,
+                            commit=False
+                        )
+                    logger.info(f"Recorded token consumption for embedding: {total_tokens} tokens, source: {source_type}")
+                except Exception as e:
+                    logger.error(f"Failed to record token consumption for embedding: {e}")
+                db.commit()
                 
             except Exception as e:
                 logger.error(f"Failed to track token consumption for embedding: {e}")
+                # Drop a partially applied charge so its row locks are released
+                db.rollback()
                 # Don't fail the embedding generation if consumption tracking fails
         
         return {
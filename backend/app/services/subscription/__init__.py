@@ -3,6 +3,7 @@ Subscription service for managing user subscriptions.
 """
 from app.services.subscription.subscription_service import (
     get_active_subscription,
+    invalidate_active_subscription,
     get_current_subscription,
     get_subscription_by_id,
     create_subscription,
@@ -20,6 +21,7 @@ from app.services.subscription.subscription_models import (
 
 __all__ = [
     "get_active_subscription",
+    "invalidate_active_subscription",
     "get_current_subscription",
     "get_subscription_by_id",
     "create_subscription",
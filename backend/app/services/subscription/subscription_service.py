@@ -5,10 +5,29 @@ import json
 from datetime import datetime, timedelta, date, timezone
 from typing import Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import event, text
 from app.services.subscription.subscription_models import Subscription, SubscriptionStats
 from app.services.feature import set_user_feature, FEATURES
 
+# Session.info key under which get_active_subscription() results are memoized
+_ACTIVE_SUBSCRIPTION_CACHE = "active_subscription_cache"
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _clear_active_subscription_cache(session: Session) -> None:
+    """Drop memoized subscriptions when the transaction that read them ends."""
+    session.info.pop(_ACTIVE_SUBSCRIPTION_CACHE, None)
+
+
+def invalidate_active_subscription(db: Session) -> None:
+    """Drop the session's memoized subscriptions after writing to user_subscriptions.
+
+    Writers call this right after their UPDATE/INSERT, so reads later in the same
+    transaction (before it commits) see the new values.
+    """
+    db.info.pop(_ACTIVE_SUBSCRIPTION_CACHE, None)
+
 
 def get_active_subscription(
     db: Session,
@@ -20,6 +39,11 @@ def get_active_subscription(
     
     Returns the most recent active subscription (status: 'trial' or 'active').
     
+    The result is memoized on the session until the current transaction commits or
+    rolls back, so repeated quota checks within a request read it once. Writes to
+    user_subscriptions that may stay uncommitted for a while (charge_tokens() with
+    commit=False) drop the memo through invalidate_active_subscription().
+    
     Args:
         db: Database session
         user_id: User ID
@@ -28,6 +52,11 @@ def get_active_subscription(
     Returns:
         Subscription object or None if not found
     """
+    cache = db.info.setdefault(_ACTIVE_SUBSCRIPTION_CACHE, {})
+    key = (user_id, organization_id)
+    if key in cache:
+        return cache[key]
+    
     result = db.execute(
         text("""
             SELECT 
@@ -49,10 +78,9 @@ def get_active_subscription(
     )
     
     row = result.fetchone()
-    if not row:
-        return None
-    
-    return Subscription.from_db_row(row)
+    subscription = Subscription.from_db_row(row) if row else None
+    cache[key] = subscription
+    return subscription
 
 
 def get_current_subscription(
@@ -169,6 +197,7 @@ def create_subscription(
     )
     
     subscription_id = result.lastrowid
+    invalidate_active_subscription(db)
     db.commit()
     
     # Get created subscription
@@ -307,6 +336,7 @@ def update_subscription(
             "trial_ends_at": new_trial_ends_at,
         }
     )
+    invalidate_active_subscription(db)
     
     db.commit()
     
@@ -370,6 +400,7 @@ def renew_subscription(
             "status": new_status,
         }
     )
+    invalidate_active_subscription(db)
     
     db.commit()
     
@@ -470,6 +501,7 @@ def reset_subscription_period(
             "status": new_status,
         }
     )
+    invalidate_active_subscription(db)
     
     db.commit()
     
@@ -521,6 +553,7 @@ def extend_trial(
             "trial_ends_at": new_trial_end,
         }
     )
+    invalidate_active_subscription(db)
     
     db.commit()
     
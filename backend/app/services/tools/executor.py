@@ -1,12 +1,13 @@
 """
 Tool execution engine for user-configured tools.
 """
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from sqlalchemy.orm import Session
 import logging
 import re
 import json
 import hashlib
+import heapq
 from functools import lru_cache
 from app.models.user_tool import UserTool, ToolType
 from app.models.rag_knowledge_base import RAGKnowledgeBase
@@ -25,6 +26,26 @@ logger = logging.getLogger(__name__)
 _extraction_cache: Dict[str, Dict[str, Any]] = {}
 
 
+def _candle_dict_timestamp(candle: Dict[str, Any]) -> Any:
+    return candle.get('timestamp', '')
+
+
+def _last_candle_dicts(candles: List[Dict[str, Any]], n: int) -> List[Dict[str, Any]]:
+    """Last n serialized candles ordered by timestamp (oldest first).
+    
+    Adapter results are already in order, so they are just sliced. Out-of-order
+    input is sorted, or for a small tail selected with heapq in O(N log n).
+    """
+    timestamps = list(map(_candle_dict_timestamp, candles))
+    if not any(a > b for a, b in zip(timestamps, timestamps[1:])):
+        return candles[-n:]
+    if n * 4 < len(candles):
+        tail = heapq.nlargest(n, candles, key=_candle_dict_timestamp)
+        tail.reverse()
+        return tail
+    return sorted(candles, key=_candle_dict_timestamp)[-n:]
+
+
 class ToolExecutor:
     """Executes user-configured tools based on tool type."""
     
@@ -540,10 +561,10 @@ Extract parameters needed to execute this tool. Return ONLY valid JSON."""
         if tool_type == ToolType.RAG.value:
             # Format RAG results as "Relevant context: ..."
             if "results" in result and result["results"]:
-                formatted = "Relevant context from knowledge base"
+                parts = ["Relevant context from knowledge base"]
                 if "rag_name" in result:
-                    formatted += f" ({result['rag_name']})"
-                formatted += ":\n"
+                    parts.append(f" ({result['rag_name']})")
+                parts.append(":\n")
                 # Include all results (up to top_k, which is now 10 by default)
                 for idx, item in enumerate(result["results"], 1):
                     document_text = item.get('document', '')
@@ -552,10 +573,10 @@ Extract parameters needed to execute this tool. Return ONLY valid JSON."""
                         # Only truncate if extremely long (>2000 chars) to avoid token limits
                         if len(document_text) > 2000:
                             truncated = document_text[:2000] + "..."
-                            formatted += f"{idx}. {truncated}\n"
+                            parts.append(f"{idx}. {truncated}\n")
                         else:
-                            formatted += f"{idx}. {document_text}\n"
-                return formatted
+                            parts.append(f"{idx}. {document_text}\n")
+                return "".join(parts)
             return "Relevant context: No results found."
         
         elif tool_type == ToolType.DATABASE.value:
@@ -564,10 +585,9 @@ Extract parameters needed to execute this tool. Return ONLY valid JSON."""
                 if not result["rows"]:
                     return "Database query returned no results."
                 # Format as simple table
-                formatted = "Database results:\n"
-                for row in result["rows"][:10]:  # Limit to 10 rows
-                    formatted += str(row) + "\n"
-                return formatted
+                lines = ["Database results:\n"]
+                lines.extend(str(row) + "\n" for row in result["rows"][:10])  # Limit to 10 rows
+                return "".join(lines)
             return str(result)
         
         elif tool_type == ToolType.API.value:
@@ -589,11 +609,9 @@ Extract parameters needed to execute this tool. Return ONLY valid JSON."""
                 data = result.get("data", {})
                 candles_data = data.get("candles", [])
                 if candles_data:
-                    formatted = ""
-                    # Sort candles by timestamp (oldest first)
-                    sorted_candles = sorted(candles_data, key=lambda c: c.get('timestamp', ''))
-                    # Take last 50 candles (or all if less)
-                    candles_to_show = sorted_candles[-50:] if len(sorted_candles) > 50 else sorted_candles
+                    lines = []
+                    # Take last 50 candles (or all if less), oldest first
+                    candles_to_show = _last_candle_dicts(candles_data, 50)
                     
                     for candle in candles_to_show:
                         timestamp_str = candle.get('timestamp', '')
@@ -612,9 +630,9 @@ Extract parameters needed to execute this tool. Return ONLY valid JSON."""
                         else:
                             timestamp_formatted = str(timestamp_str)
                         
-                        formatted += f"- {timestamp_formatted}: O={candle.get('open', 0):.2f} H={candle.get('high', 0):.2f} L={candle.get('low', 0):.2f} C={candle.get('close', 0):.2f} V={candle.get('volume', 0):.2f}\n"
+                        lines.append(f"- {timestamp_formatted}: O={candle.get('open', 0):.2f} H={candle.get('high', 0):.2f} L={candle.get('low', 0):.2f} C={candle.get('close', 0):.2f} V={candle.get('volume', 0):.2f}\n")
                     
-                    return formatted if formatted else "No market data available."
+                    return "".join(lines) if lines else "No market data available."
             
             # Format other API results as JSON or text
             if "data" in result: